@@ -0,0 +1,78 @@
+import itertools
+import random
+import time
+from datetime import timedelta
+from tarkibi.utilities.planner import _Planner
+
+CANDIDATE_COUNTS = [10, 50, 500]
+TARGET_DURATION = timedelta(hours=1)
+DURATION_MULTIPLIER = 2.0
+REPEATS = 5
+
+
+def _random_length(rng: random.Random) -> str:
+    seconds = rng.randint(60, 3 * 60 * 60)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+    return f"{minutes}:{seconds:02d}"
+
+
+def _make_videos(count: int, seed: int = 0) -> list[dict[str, str]]:
+    rng = random.Random(seed)
+    return [
+        {"title": f"video {i}", "length": _random_length(rng), "id": f"id{i:05d}"}
+        for i in range(count)
+    ]
+
+
+def _exhaustive(planner: _Planner, videos: list[dict[str, str]], budget: int) -> int:
+    durations = [planner._convert_time_to_seconds(v["length"]) for v in videos]
+    best = 0
+    for size in range(1, len(durations) + 1):
+        for combination in itertools.combinations(durations, size):
+            total = sum(combination)
+            if best < total <= budget:
+                best = total
+
+    return best
+
+
+def main() -> None:
+    planner = _Planner()
+    budget = int(TARGET_DURATION.total_seconds() * DURATION_MULTIPLIER)
+
+    print(f"budget: {budget}s")
+    print(f"{'candidates':>10} {'best (ms)':>10} {'mean (ms)':>10} {'planned (s)':>12}")
+    for count in CANDIDATE_COUNTS:
+        videos = _make_videos(count)
+
+        timings = []
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            selection = planner.select(videos, budget)
+            timings.append(time.perf_counter() - start)
+
+        planned = sum(planner._convert_time_to_seconds(v["length"]) for v in selection)
+        print(
+            f"{count:>10} {min(timings) * 1000:>10.3f} {sum(timings) / REPEATS * 1000:>10.3f} {planned:>12}"
+        )
+
+    # sanity check against the old exhaustive search where it is still tractable
+    videos = _make_videos(CANDIDATE_COUNTS[0])
+    start = time.perf_counter()
+    exhaustive_best = _exhaustive(planner, videos, budget)
+    exhaustive_time = time.perf_counter() - start
+    planned = sum(
+        planner._convert_time_to_seconds(v["length"])
+        for v in planner.select(videos, budget)
+    )
+    print(
+        f"exhaustive ({CANDIDATE_COUNTS[0]} candidates): {exhaustive_best}s in {exhaustive_time * 1000:.3f} ms, planner: {planned}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+import argparse
+import functools
+import glob
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+import time
+import typing
+from datetime import timedelta
+from unittest import mock
+import numpy as np
+import bench_planner
+import stubs
+import synthetic
+import tarkibi.audio.chunking
+import tarkibi.audio.diarization
+import tarkibi.audio.noise_reduction
+import tarkibi.audio.speaker_verification
+import tarkibi.utilities.job
+import tarkibi.utilities.ledger
+import tarkibi.utilities.pipeline
+import tarkibi.utilities.wav
+from tarkibi import Tarkibi
+
+DEFAULT_SCALES = [30, 120, 300]
+RESAMPLE_RATES = [16000, 22050, 48000]
+TRANSCRIPT_SECONDS = 8
+BATCH_SPEAKERS = 3
+DENOISE_NOISE_LEVEL = 0.05
+SEGMENT_COUNTS = [50, 200, 800]
+SEGMENT_SCALING_SECONDS = 300
+DIARIZATION_WINDOW_SECONDS = 60
+
+
+def _timed(fn: typing.Callable, *args: typing.Any) -> tuple[float, typing.Any]:
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def _row(stage: str, scale: str, wall: float, audio_seconds: float) -> dict:
+    return {
+        "stage": stage,
+        "scale": scale,
+        "wall_seconds": wall,
+        "audio_seconds": audio_seconds,
+        "throughput": audio_seconds / wall if wall else None,
+    }
+
+
+def _make_tarkibi() -> Tarkibi:
+    # the real agent is constructed before it is replaced, it only reads the key
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    instance = Tarkibi()
+    instance._agent = stubs._StubAgent()
+    instance._youtube = stubs._StubYoutube()
+    instance._noise_reduction = stubs._StubNoiseReduction()
+    instance._diarization = stubs._StubDiarization()
+    instance._speaker_verification = stubs._StubSpeakerVerification()
+    return instance
+
+
+def _spleeter_available() -> bool:
+    model_path = os.environ.get("MODEL_PATH", "pretrained_models")
+    return importlib.util.find_spec("spleeter") is not None and os.path.isdir(
+        os.path.join(model_path, "2stems")
+    )
+
+
+def _diarizer_available() -> bool:
+    return importlib.util.find_spec("simple_diarizer") is not None and os.path.isdir(
+        "pretrained_models/spkrec-xvect-voxceleb"
+    )
+
+
+def _titanet_available() -> bool:
+    nemo_cache = os.path.expanduser("~/.cache/torch/NeMo")
+    return importlib.util.find_spec("nemo") is not None and bool(
+        glob.glob(f"{nemo_cache}/**/*titanet_large*.nemo", recursive=True)
+    )
+
+
+def bench_planner_stage() -> list[dict]:
+    planner = bench_planner._Planner()
+    budget = int(
+        bench_planner.TARGET_DURATION.total_seconds()
+        * bench_planner.DURATION_MULTIPLIER
+    )
+
+    rows = []
+    for count in bench_planner.CANDIDATE_COUNTS:
+        videos = bench_planner._make_videos(count)
+        wall, selection = _timed(planner.select, videos, budget)
+        planned = sum(planner._convert_time_to_seconds(v["length"]) for v in selection)
+        rows.append(_row("planner", f"{count} videos", wall, planned))
+
+    return rows
+
+
+def _split_job(
+    workdir: str, name: str, reference: str
+) -> tarkibi.utilities.job._BuildJob:
+    job = tarkibi.utilities.job._BuildJob(
+        None, reference, None, f"{workdir}/{name}", work_dir=f"{workdir}/{name}_work"
+    )
+    os.makedirs(job.wav_output_dir)
+    return job
+
+
+def bench_clip_splitting(instance: Tarkibi, workdir: str, seconds: int) -> list[dict]:
+    track = f"{workdir}/speaker_{seconds}.wav"
+    synthetic.write_synthetic_wav(track, seconds, speakers=1)
+
+    rows = []
+    job = _split_job(workdir, f"split_{seconds}", track)
+    wall, _ = _timed(instance._split_audio_clips_to_dataset, job, track)
+    rows.append(_row("split (in-process)", f"{seconds}s", wall, seconds))
+
+    if shutil.which("ffmpeg"):
+        job = _split_job(workdir, f"split_ffmpeg_{seconds}", track)
+        with mock.patch.object(
+            tarkibi.utilities.wav, "is_pcm16_wav", return_value=False
+        ):
+            wall, _ = _timed(instance._split_audio_clips_to_dataset, job, track)
+        rows.append(_row("split (ffmpeg)", f"{seconds}s", wall, seconds))
+
+    return rows
+
+
+def bench_segment_export(workdir: str, seconds: int) -> tuple[list[dict], str]:
+    recording = f"{workdir}/recording_{seconds}.wav"
+    segments = synthetic.write_synthetic_wav(recording, seconds)
+
+    diarization = tarkibi.audio.diarization._Diarization()
+    speakers = diarization._group_segments_by_speaker(segments)
+    speakers_dir = f"{workdir}/speakers_{seconds}"
+
+    wall, _ = _timed(
+        diarization._segment_audio_clips, speakers, recording, speakers_dir
+    )
+    row = _row(
+        f"segment export ({len(segments)} segments)", f"{seconds}s", wall, seconds
+    )
+
+    return [row], speakers_dir
+
+
+def bench_segment_scaling(workdir: str) -> list[dict]:
+    # the same recording cut into more and more segments, export time should grow with the audio not the count
+    seconds = SEGMENT_SCALING_SECONDS
+    recording = f"{workdir}/segment_scaling.wav"
+    synthetic.write_synthetic_wav(recording, seconds)
+    diarization = tarkibi.audio.diarization._Diarization()
+
+    rows = []
+    for count in SEGMENT_COUNTS:
+        bounds = np.linspace(0, seconds, count + 1)
+        segments = [
+            {"start": start, "end": end, "label": index % 2}
+            for index, (start, end) in enumerate(zip(bounds[:-1], bounds[1:]))
+        ]
+        speakers = diarization._group_segments_by_speaker(segments)
+        wall, _ = _timed(
+            diarization._segment_audio_clips,
+            speakers,
+            recording,
+            f"{workdir}/segment_scaling_{count}",
+        )
+        rows.append(
+            _row(f"segment export ({count} segments)", f"{seconds}s", wall, seconds)
+        )
+
+    return rows
+
+
+def bench_verification_loop(
+    speakers_dir: str, reference: str, seconds: int
+) -> list[dict]:
+    verification = stubs._StubSpeakerVerification()
+    wall, _ = _timed(verification._speaker_verify_dir, speakers_dir, reference)
+    return [_row("verification loop (stub model)", f"{seconds}s", wall, seconds)]
+
+
+def bench_ljspeech_formatting(
+    instance: Tarkibi, workdir: str, seconds: int
+) -> list[dict]:
+    clips = max(1, seconds // TRANSCRIPT_SECONDS)
+    transcription_dir = f"{workdir}/ljspeech_{seconds}"
+    os.makedirs(transcription_dir)
+    for clip_id in range(clips):
+        with open(f"{transcription_dir}/{clip_id:05d}.txt", "w") as transcript:
+            transcript.write(" a synthetic transcript line\n")
+
+    wall, _ = _timed(
+        instance._format_transcription_ljspeech, transcription_dir, transcription_dir
+    )
+    return [_row(f"ljspeech formatting ({clips} clips)", f"{seconds}s", wall, seconds)]
+
+
+def bench_resampling(seconds: int) -> list[dict]:
+    samples, _ = synthetic.synthesize_speech(seconds, speakers=1)
+
+    rows = []
+    for target_rate in RESAMPLE_RATES:
+        wall, _ = _timed(
+            tarkibi.utilities.wav.resample,
+            samples,
+            synthetic.SAMPLE_RATE,
+            target_rate,
+        )
+        rows.append(_row(f"resample to {target_rate}", f"{seconds}s", wall, seconds))
+
+    return rows
+
+
+def bench_pipeline(instance: Tarkibi, workdir: str, seconds: int) -> list[dict]:
+    output_path = f"{workdir}/dataset_{seconds}"
+    reference = f"{workdir}/reference.wav"
+    # keep single videos below the planner budget of twice the target
+    instance._youtube = stubs._StubYoutube(
+        min_seconds=max(5, seconds // 4), max_seconds=max(10, seconds)
+    )
+
+    wall, _ = _timed(
+        lambda: instance.build_dataset(
+            "Benchmark Speaker",
+            reference_audio=reference,
+            target_duration=timedelta(seconds=seconds),
+            output_path=output_path,
+            with_transcription=False,
+        )
+    )
+    collected = tarkibi.utilities.ledger._DurationLedger(output_path).total
+    return [_row("build_dataset (stub models)", f"{seconds}s", wall, collected)]
+
+
+def bench_batch(instance: Tarkibi, workdir: str, seconds: int) -> list[dict]:
+    reference = f"{workdir}/reference.wav"
+    instance._youtube = stubs._StubYoutube(
+        min_seconds=max(5, seconds // 4), max_seconds=max(10, seconds)
+    )
+    output_paths = [
+        f"{workdir}/batch_{seconds}_{speaker}" for speaker in range(BATCH_SPEAKERS)
+    ]
+
+    wall, _ = _timed(
+        lambda: instance.build_datasets(
+            [
+                (
+                    f"Benchmark Speaker {speaker}",
+                    reference,
+                    timedelta(seconds=seconds),
+                    output_path,
+                )
+                for speaker, output_path in enumerate(output_paths)
+            ],
+            with_transcription=False,
+        )
+    )
+    collected = sum(
+        tarkibi.utilities.ledger._DurationLedger(output_path).total
+        for output_path in output_paths
+    )
+    return [
+        _row(
+            f"build_datasets ({BATCH_SPEAKERS} speakers, stub models)",
+            f"{seconds}s",
+            wall,
+            collected,
+        )
+    ]
+
+
+def _si_sdr(reference: np.ndarray, estimate: np.ndarray) -> float:
+    # scale-invariant signal to distortion ratio in dB, over every channel
+    reference = np.asarray(reference, np.float64).ravel()
+    estimate = np.asarray(estimate, np.float64).ravel()
+    target = np.dot(estimate, reference) / np.dot(reference, reference) * reference
+    return float(10 * np.log10(np.sum(target**2) / np.sum((estimate - target) ** 2)))
+
+
+def bench_denoise(workdir: str, seconds: int) -> list[dict]:
+    clean, _ = synthetic.synthesize_speech(seconds, speakers=2, noise_level=0.0)
+    noisy, _ = synthetic.synthesize_speech(
+        seconds, speakers=2, noise_level=DENOISE_NOISE_LEVEL
+    )
+    noisy_path = f"{workdir}/noisy_{seconds}.wav"
+    tarkibi.utilities.wav.write_wav(noisy_path, noisy, synthetic.SAMPLE_RATE)
+    output_dir = f"{workdir}/denoise_{seconds}"
+    os.makedirs(output_dir)
+
+    backends = ["spectral_gate"]
+    if _spleeter_available():
+        backends.append("resident")
+    else:
+        print(
+            f"skipping spleeter denoise quality ({seconds}s): model not found locally"
+        )
+
+    rows = [
+        {
+            **_row("noisy input", f"{seconds}s", 0.0, seconds),
+            "si_sdr": _si_sdr(clean, noisy),
+        }
+    ]
+    for backend in backends:
+        noise_reduction = tarkibi.audio.noise_reduction._NoiseReduction(backend)
+        if backend == "resident":
+            # the model is loaded before timing, only inference is compared
+            noise_reduction._separator()
+
+        wall, vocals_path = _timed(
+            noise_reduction._noise_reduction, noisy_path, output_dir
+        )
+        vocals, _ = tarkibi.utilities.wav.read_wav(vocals_path)
+        rows.append(
+            {
+                **_row(f"denoise ({backend})", f"{seconds}s", wall, seconds),
+                "si_sdr": _si_sdr(clean, vocals[: len(clean)]),
+            }
+        )
+
+    return rows
+
+
+def bench_real_models(workdir: str, reference: str, seconds: int) -> list[dict]:
+    recording = f"{workdir}/recording_{seconds}.wav"
+    rows = []
+
+    if _spleeter_available():
+        output_dir = f"{workdir}/spleeter_{seconds}"
+        os.makedirs(output_dir)
+        # the first resident call includes loading the model, the second is inference only
+        for name, backend, runs in (
+            ("spleeter (cli)", "cli", 1),
+            ("spleeter (resident)", "resident", 2),
+        ):
+            noise_reduction = tarkibi.audio.noise_reduction._NoiseReduction(backend)
+            for run in range(runs):
+                wall, _ = _timed(
+                    noise_reduction._noise_reduction, recording, output_dir
+                )
+                label = f"{name}, {'warm' if run else 'cold'}"
+                rows.append(_row(label, f"{seconds}s", wall, seconds))
+    else:
+        print(f"skipping spleeter ({seconds}s): model not found locally")
+
+    if _diarizer_available():
+        diarization = tarkibi.audio.diarization._Diarization()
+        # the load is timed on its own, as the pipeline warms the diarizer up before the first video
+        load, _ = _timed(diarization.warm_up)
+        rows.append(_row("diarizer (xvec), load", f"{seconds}s", load, seconds))
+        wall, _ = _timed(diarization._diarize_audio_to_segments, recording)
+        rows.append(_row("diarizer (xvec), warm", f"{seconds}s", wall, seconds))
+
+        if seconds > DIARIZATION_WINDOW_SECONDS:
+            workers = os.cpu_count()
+            chunked = tarkibi.audio.chunking._ChunkedAudio(
+                None,
+                diarization,
+                None,
+                DIARIZATION_WINDOW_SECONDS,
+                Tarkibi._CHUNK_OVERLAP_SECONDS,
+                diarization_workers=workers,
+            )
+            # the windows run in the processes of a diarization stage, as in a build
+            stage = tarkibi.utilities.pipeline._Stage(
+                "diarization",
+                None,
+                use_processes=True,
+                warm_up=diarization.warm_up,
+                processes=workers,
+            )
+            with tarkibi.utilities.pipeline._Pipeline([stage]) as pipeline:
+                # the first run waits for the workers to load their diarizers
+                for run in range(2):
+                    wall, _ = _timed(
+                        chunked._diarize_audio_file,
+                        recording,
+                        f"{workdir}/parallel_speakers_{seconds}_{run}",
+                        functools.partial(pipeline.offload_map, "diarization"),
+                    )
+                    label = f"diarizer (xvec, {workers} workers), {'warm' if run else 'cold'}"
+                    rows.append(_row(label, f"{seconds}s", wall, seconds))
+    else:
+        print(f"skipping diarizer ({seconds}s): model not found locally")
+
+    if _titanet_available():
+        wall, _ = _timed(
+            tarkibi.audio.speaker_verification._SpeakerVerification()._speaker_verify_dir,
+            f"{workdir}/speakers_{seconds}",
+            reference,
+        )
+        rows.append(_row("verification (titanet)", f"{seconds}s", wall, seconds))
+    else:
+        print(f"skipping titanet ({seconds}s): model not found locally")
+
+    return rows
+
+
+def _print_rows(rows: list[dict]) -> None:
+    print(
+        f"{'stage':<40} {'scale':>12} {'wall (s)':>10} {'audio (s)':>10} {'audio-s/wall-s':>15} {'SI-SDR (dB)':>12}"
+    )
+    for row in rows:
+        throughput = f"{row['throughput']:.1f}" if row["throughput"] else "-"
+        si_sdr = f"{row['si_sdr']:.1f}" if "si_sdr" in row else "-"
+        print(
+            f"{row['stage']:<40} {row['scale']:>12} {row['wall_seconds']:>10.3f} {row['audio_seconds']:>10.1f} {throughput:>15} {si_sdr:>12}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for Tarkibi")
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SCALES,
+        help="seconds of audio per benchmark input",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="also run build_dataset and build_datasets end to end",
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tarkibi-bench-")
+    reference = f"{workdir}/reference.wav"
+    synthetic.write_synthetic_wav(
+        reference, 10, speakers=1, sample_rate=16000, channels=1
+    )
+
+    try:
+        instance = _make_tarkibi()
+        rows = bench_planner_stage()
+        rows += bench_segment_scaling(workdir)
+
+        for seconds in args.scales:
+            rows += bench_clip_splitting(instance, workdir, seconds)
+            segment_rows, speakers_dir = bench_segment_export(workdir, seconds)
+            rows += segment_rows
+            rows += bench_verification_loop(speakers_dir, reference, seconds)
+            rows += bench_ljspeech_formatting(instance, workdir, seconds)
+            rows += bench_resampling(seconds)
+            rows += bench_denoise(workdir, seconds)
+            rows += bench_real_models(workdir, reference, seconds)
+
+            if args.pipeline:
+                rows += bench_pipeline(_make_tarkibi(), workdir, seconds)
+                rows += bench_batch(_make_tarkibi(), workdir, seconds)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    _print_rows(rows)
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump(rows, results_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
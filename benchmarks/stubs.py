@@ -0,0 +1,123 @@
+import os
+import random
+import shutil
+import wave
+import numpy as np
+import synthetic
+import tarkibi.audio.diarization
+import tarkibi.audio.speaker_verification
+
+
+class _StubAgent:
+    def _generate_search_query(self, person: str) -> str:
+        return f"{person} interview"
+
+
+class _StubYoutube:
+    def __init__(
+        self,
+        min_seconds: int = 120,
+        max_seconds: int = 600,
+        page_size: int = 20,
+        speakers: int = 2,
+        seed: int = 0,
+    ) -> None:
+        """
+        Offline stand-in for _Youtube, every search returns a page of new synthetic videos
+        parameters
+        ----------
+        min_seconds: int
+            The shortest video length
+        max_seconds: int
+            The longest video length
+        page_size: int
+            The number of videos per search
+        speakers: int
+            The number of speakers in every video, speaker 0 is the target
+        seed: int
+            The random seed
+        """
+        self._rng = random.Random(seed)
+        self._min_seconds = min_seconds
+        self._max_seconds = max_seconds
+        self._page_size = page_size
+        self._speakers = speakers
+        self._lengths: dict[str, int] = {}
+
+    def _search(self, query: str) -> list[dict[str, str]]:
+        results = []
+        for _ in range(self._page_size):
+            video_id = f"stub{len(self._lengths):07d}"
+            seconds = self._rng.randint(self._min_seconds, self._max_seconds)
+            self._lengths[video_id] = seconds
+
+            results.append(
+                {
+                    "title": f"{query} {video_id}",
+                    "length": f"{seconds // 60}:{seconds % 60:02d}",
+                    "id": video_id,
+                    "url": f"https://www.youtube.com/watch?v={video_id}",
+                }
+            )
+
+        return results
+
+    def _download_video_dlc(self, video_id: str, output_dir: str) -> None:
+        synthetic.write_synthetic_wav(
+            f"{output_dir}/{video_id}.wav",
+            self._lengths[video_id],
+            speakers=self._speakers,
+            seed=int(video_id[len("stub") :]),
+        )
+
+
+class _StubNoiseReduction:
+    def _noise_reduction(self, audio_file_path: str, output_file_path: str) -> str:
+        filename_without_extension = audio_file_path.split("/")[-1].split(".")[0]
+        vocals_path = f"{output_file_path}/{filename_without_extension}_vocals.wav"
+
+        shutil.copyfile(audio_file_path, vocals_path)
+        shutil.copyfile(f"{audio_file_path}.json", f"{vocals_path}.json")
+
+        return vocals_path
+
+    def warm_up(self) -> None:
+        pass
+
+
+class _StubDiarization(tarkibi.audio.diarization._Diarization):
+    # segment export is the real implementation, only the model is replaced by the ground truth
+    def _diarize_audio_to_segments(self, file_path: str = None) -> list:
+        return synthetic.read_segments(file_path)
+
+    def warm_up(self) -> None:
+        pass
+
+
+class _StubSpeakerModel:
+    def __init__(self, target_label: int = 0) -> None:
+        self._target_label = target_label
+
+    def verify_speakers(self, path2audio_file1: str, path2audio_file2: str) -> bool:
+        # open both files like the real model would, the label is in the speaker file name
+        for path in (path2audio_file1, path2audio_file2):
+            with wave.open(path, "rb") as wav_file:
+                wav_file.readframes(wav_file.getnframes())
+
+        return os.path.basename(path2audio_file2) == f"{self._target_label}.wav"
+
+
+class _StubSpeakerVerification(tarkibi.audio.speaker_verification._SpeakerVerification):
+    def _score_files(
+        self, audio_files: list[str], reference_audio_file: str
+    ) -> np.ndarray:
+        speaker_model = _StubSpeakerModel()
+        return np.array(
+            [
+                float(speaker_model.verify_speakers(reference_audio_file, audio_file))
+                for audio_file in audio_files
+            ]
+        )
+
+    def warm_up(self) -> None:
+        pass
@@ -0,0 +1,109 @@
+import json
+import numpy as np
+from tarkibi.utilities import wav
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+
+
+def synthesize_speech(
+    duration: float,
+    speakers: int = 2,
+    sample_rate: int = SAMPLE_RATE,
+    channels: int = CHANNELS,
+    noise_level: float = 0.02,
+    turn_seconds: tuple[float, float] = (2.0, 8.0),
+    seed: int = 0,
+) -> tuple[np.ndarray, list[dict]]:
+    """
+    Generate a speech-like multi-speaker recording, every speaker is a harmonic voice with its own pitch
+    and syllable rate, speaking in alternating turns separated by short pauses
+    parameters
+    ----------
+    duration: float
+        The length of the recording in seconds
+    speakers: int
+        The number of speakers
+    sample_rate: int
+        The sample rate of the recording
+    channels: int
+        The number of channels of the recording
+    noise_level: float
+        The amplitude of the background noise, relative to full scale
+    turn_seconds: tuple[float, float]
+        The shortest and longest speaker turn in seconds
+    seed: int
+        The random seed
+
+    returns
+    -------
+    tuple[np.ndarray, list[dict]]
+        The int16 samples with shape (frames, channels), and the ground truth segments
+        as dicts with 'start', 'end' (seconds) and 'label'
+    """
+    rng = np.random.default_rng(seed)
+    frames = int(duration * sample_rate)
+    signal = np.zeros(frames, dtype=np.float32)
+
+    pitches = rng.uniform(90.0, 240.0, size=speakers)
+    syllable_rates = rng.uniform(3.0, 6.0, size=speakers)
+
+    segments = []
+    position = 0.0
+    speaker = 0
+    while position < duration:
+        turn = rng.uniform(*turn_seconds)
+        start, end = position, min(position + turn, duration)
+        start_frame, end_frame = int(start * sample_rate), int(end * sample_rate)
+
+        t = np.arange(end_frame - start_frame, dtype=np.float32) / sample_rate
+        vibrato = 1.0 + 0.03 * np.sin(2 * np.pi * 5.0 * t)
+        phase = 2 * np.pi * np.cumsum(pitches[speaker] * vibrato) / sample_rate
+        voice = sum(np.sin(harmonic * phase) / harmonic for harmonic in range(1, 6))
+        envelope = 0.5 * (1 + np.sin(2 * np.pi * syllable_rates[speaker] * t)) ** 2
+        signal[start_frame:end_frame] = 0.25 * voice * envelope
+
+        segments.append({"start": start, "end": end, "label": int(speaker)})
+
+        # pause between turns, then hand over to another speaker
+        position = end + rng.uniform(0.2, 0.8)
+        speaker = (
+            (speaker + int(rng.integers(1, speakers))) % speakers if speakers > 1 else 0
+        )
+
+    signal += noise_level * rng.standard_normal(frames).astype(np.float32)
+    samples = np.clip(signal * 32767, -32768, 32767).astype(np.int16)
+
+    return np.repeat(samples[:, None], channels, axis=1), segments
+
+
+def write_synthetic_wav(path: str, duration: float, **kwargs) -> list[dict]:
+    """
+    Write a synthetic recording and its ground truth segments (to path + '.json')
+    parameters
+    ----------
+    path: str
+        The path of the wav file to write
+    duration: float
+        The length of the recording in seconds
+    kwargs: typing.Any
+        Passed to synthesize_speech
+
+    returns
+    -------
+    list[dict]
+        The ground truth segments
+    """
+    sample_rate = kwargs.get("sample_rate", SAMPLE_RATE)
+    samples, segments = synthesize_speech(duration, **kwargs)
+    wav.write_wav(path, samples, sample_rate)
+
+    with open(f"{path}.json", "w") as segments_file:
+        json.dump(segments, segments_file)
+
+    return segments
+
+
+def read_segments(path: str) -> list[dict]:
+    with open(f"{path}.json") as segments_file:
+        return json.load(segments_file)
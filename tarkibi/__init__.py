@@ -1 +1,13 @@
-from .tarkibi import Tarkibi
+def __getattr__(name: str):
+    # Tarkibi pulls in torch, spleeter, simple_diarizer and nemo, so it is only
+    # imported on first use and the lightweight utilities (e.g. the planner)
+    # stay importable without them
+    if name == "Tarkibi":
+        from .tarkibi import Tarkibi
+
+        return Tarkibi
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ["Tarkibi"]
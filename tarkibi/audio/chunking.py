@@ -0,0 +1,653 @@
+import functools
+import os
+import shutil
+import typing
+import numpy as np
+import tarkibi.utilities.wav
+from tarkibi.utilities._config import logger
+
+logger = logger.getChild(__name__)
+
+
+class _ChunkedAudio:
+    # speakers of neighbouring windows are linked if they talk together for this long in the overlap
+    _MIN_LINK_SECONDS = 1.0
+    # speakers of different windows are linked if the cosine similarity of their x-vector centroids is this high
+    _MIN_LINK_SIMILARITY = 0.6
+
+    def __init__(
+        self,
+        noise_reduction: typing.Any,
+        diarization: typing.Any,
+        speaker_verification: typing.Any,
+        window_seconds: float,
+        overlap_seconds: float,
+        diarization_workers: int | None = None,
+    ) -> None:
+        """
+        Runs separation, diarization and verification on overlapping windows of long recordings, so memory
+        is bounded by the window size rather than the recording length. Has the same methods as the
+        components it wraps, recordings shorter than a window are passed to the components as a whole
+        parameters
+        ----------
+        noise_reduction: _NoiseReduction
+            Separates the vocals of a window
+        diarization: _Diarization
+            Diarizes a window
+        speaker_verification: _SpeakerVerification
+            Verifies the speakers
+        window_seconds: float
+            The length of a window
+        overlap_seconds: float
+            The overlap of neighbouring windows, must be less than half a window
+        diarization_workers: int | None
+            The number of windows handed to the window runner at a time, speakers are then linked across
+            windows by their x-vector centroids. None diarizes the windows one after the other and links
+            speakers by their speech in the overlaps
+        """
+        if not 0 < 2 * overlap_seconds < window_seconds:
+            raise ValueError(
+                f"Window overlap of {overlap_seconds}s does not fit a {window_seconds}s window"
+            )
+
+        self.noise_reduction = noise_reduction
+        self.diarization = diarization
+        self.speaker_verification = speaker_verification
+        self.window_seconds = window_seconds
+        self.overlap_seconds = overlap_seconds
+        self.diarization_workers = diarization_workers
+
+    def _plan_windows(self, total_seconds: float) -> list[tuple[float, float]]:
+        """
+        Plan the windows of a recording
+        parameters
+        ----------
+        total_seconds: float
+            The length of the recording
+
+        returns
+        -------
+        list[tuple[float, float]]
+            The (start, end) of every window in seconds, neighbours overlap by overlap_seconds
+        """
+        step = self.window_seconds - self.overlap_seconds
+        windows = []
+        start = 0.0
+        while True:
+            end = min(start + self.window_seconds, total_seconds)
+            windows.append((start, end))
+            if end >= total_seconds:
+                return windows
+
+            start += step
+
+    def _load(self, audio_file: str) -> tuple[typing.Any, int] | None:
+        # recordings that fit a window, or that cannot be memory-mapped, are processed whole
+        if not tarkibi.utilities.wav.is_pcm16_wav(audio_file):
+            logger.info(
+                f"Tarkibi _ChunkedAudio: {audio_file} is not 16-bit PCM, processing it whole"
+            )
+            return None
+
+        samples, sample_rate = tarkibi.utilities.wav.read_wav(audio_file)
+        if len(samples) <= self.window_seconds * sample_rate:
+            return None
+
+        return samples, sample_rate
+
+    def _write_window(
+        self,
+        samples: typing.Any,
+        sample_rate: int,
+        window: tuple[float, float],
+        path: str,
+    ) -> str:
+        start, end = window
+        tarkibi.utilities.wav.write_wav(
+            path,
+            samples[int(start * sample_rate) : int(end * sample_rate)],
+            sample_rate,
+        )
+        return path
+
+    def _conform(
+        self, samples: typing.Any, sample_rate: int, writer: typing.Any
+    ) -> typing.Any:
+        """
+        Convert the vocals of a window to the sample rate and channels of the vocals written so far, windows
+        of clean speech are not separated and keep the format of the recording
+        parameters
+        ----------
+        samples: np.ndarray
+            The int16 vocals of the window, with shape (frames, channels)
+        sample_rate: int
+            The sample rate of the vocals
+        writer: wave.Wave_write
+            The open vocals file
+
+        returns
+        -------
+        np.ndarray
+            The vocals at the rate and channels of writer
+        """
+        channels = writer.getnchannels()
+        if samples.shape[1] != channels:
+            mono = samples.mean(axis=1, keepdims=True).astype(samples.dtype)
+            samples = mono if channels == 1 else mono.repeat(channels, axis=1)
+
+        return tarkibi.utilities.wav.resample(
+            samples, sample_rate, writer.getframerate()
+        )
+
+    def _kept_span(
+        self, windows: list[tuple[float, float]], index: int
+    ) -> tuple[float, float]:
+        """
+        The part of a window that is kept when windows are joined, the halves of the overlaps
+        nearest to the window
+        parameters
+        ----------
+        windows: list[tuple[float, float]]
+            The (start, end) of every window
+        index: int
+            The index of the window
+
+        returns
+        -------
+        tuple[float, float]
+            The (start, end) of the kept part in seconds, relative to the recording
+        """
+        start, end = windows[index]
+        if index > 0:
+            start += self.overlap_seconds / 2
+        if index < len(windows) - 1:
+            end -= self.overlap_seconds / 2
+
+        return start, end
+
+    def _noise_reduction(self, audio_file_path: str, output_file_path: str) -> str:
+        """
+        Separate the vocals of a recording window by window, the vocals of every window are cut at the
+        middle of the overlaps so the edges of a window, where separation is weakest, are dropped
+        parameters
+        ----------
+        audio_file_path: str
+            The path to the recording
+        output_file_path: str
+            The directory to write the vocals to
+
+        returns
+        -------
+        str
+            The path to the vocals
+        """
+        loaded = self._load(audio_file_path)
+        if loaded is None:
+            return self.noise_reduction._noise_reduction(
+                audio_file_path, output_file_path
+            )
+
+        samples, sample_rate = loaded
+        name = os.path.basename(audio_file_path).split(".")[0]
+        windows = self._plan_windows(len(samples) / sample_rate)
+        logger.info(
+            f"Tarkibi _ChunkedAudio: Separating {audio_file_path} in {len(windows)} windows"
+        )
+
+        chunks_dir = f"{output_file_path}/{name}_windows"
+        os.makedirs(chunks_dir, exist_ok=True)
+        vocals_path = f"{output_file_path}/{name}_vocals.wav"
+        writer = None
+        try:
+            for index, window in enumerate(windows):
+                window_path = self._write_window(
+                    samples, sample_rate, window, f"{chunks_dir}/{name}_{index:04d}.wav"
+                )
+                window_vocals, vocals_rate = tarkibi.utilities.wav.read_wav(
+                    self.noise_reduction._noise_reduction(window_path, chunks_dir)
+                )
+                if writer is None:
+                    writer = tarkibi.utilities.wav.open_writer(
+                        vocals_path, window_vocals.shape[1], vocals_rate
+                    )
+                elif (vocals_rate, window_vocals.shape[1]) != (
+                    writer.getframerate(),
+                    writer.getnchannels(),
+                ):
+                    window_vocals = self._conform(window_vocals, vocals_rate, writer)
+                    vocals_rate = writer.getframerate()
+
+                kept_start, kept_end = self._kept_span(windows, index)
+                offset = window[0]
+                tarkibi.utilities.wav.append_frames(
+                    writer,
+                    window_vocals[
+                        int((kept_start - offset) * vocals_rate) : int(
+                            (kept_end - offset) * vocals_rate
+                        )
+                    ],
+                )
+                del window_vocals
+                # only one window of stems is kept on disk at a time
+                for filename in os.listdir(chunks_dir):
+                    os.remove(os.path.join(chunks_dir, filename))
+        finally:
+            if writer is not None:
+                writer.close()
+            shutil.rmtree(chunks_dir, ignore_errors=True)
+
+        return vocals_path
+
+    def _stitch_segments(
+        self,
+        windows: list[tuple[float, float]],
+        window_segments: list[list[dict]],
+    ) -> list[dict]:
+        """
+        Join the diarization of every window into one, the speakers of neighbouring windows are linked by
+        how long they talk at the same time in the overlap. Speakers that are silent in an overlap cannot
+        be linked and continue under a new label
+        parameters
+        ----------
+        windows: list[tuple[float, float]]
+            The (start, end) of every window
+        window_segments: list[list[dict]]
+            The segments of every window, with 'start' and 'end' relative to the window and 'label'
+
+        returns
+        -------
+        list[dict]
+            The segments of the recording, with 'start', 'end' and 'label'
+        """
+        segments = []
+        previous = []
+        labels: dict = {}
+        next_label = 0
+
+        for index, (window, local_segments) in enumerate(zip(windows, window_segments)):
+            current = [
+                {
+                    "start": window[0] + segment["start"],
+                    "end": window[0] + segment["end"],
+                    "local": segment["label"],
+                }
+                for segment in local_segments
+            ]
+
+            links = {}
+            if index > 0:
+                overlap_start, overlap_end = window[0], windows[index - 1][1]
+                shared: dict[tuple, float] = {}
+                for earlier in previous:
+                    for later in current:
+                        seconds = min(earlier["end"], later["end"], overlap_end) - max(
+                            earlier["start"], later["start"], overlap_start
+                        )
+                        if seconds > 0:
+                            key = (labels[earlier["local"]], later["local"])
+                            shared[key] = shared.get(key, 0.0) + seconds
+
+                # greedy one to one matching, longest shared speech first
+                linked_globals = set()
+                for (global_label, local_label), seconds in sorted(
+                    shared.items(), key=lambda item: -item[1]
+                ):
+                    if seconds < self._MIN_LINK_SECONDS:
+                        break
+                    if global_label in linked_globals or local_label in links:
+                        continue
+
+                    links[local_label] = global_label
+                    linked_globals.add(global_label)
+
+            labels = {}
+            for segment in current:
+                if segment["local"] not in labels:
+                    if segment["local"] in links:
+                        labels[segment["local"]] = links[segment["local"]]
+                    else:
+                        labels[segment["local"]] = next_label
+                        next_label += 1
+
+            segments += self._kept_segments(windows, index, current, labels)
+            previous = current
+
+        return segments
+
+    def _kept_segments(
+        self,
+        windows: list[tuple[float, float]],
+        index: int,
+        segments: list[dict],
+        labels: dict,
+    ) -> list[dict]:
+        """
+        Cut the segments of a window to its kept span and give them their recording wide labels
+        parameters
+        ----------
+        windows: list[tuple[float, float]]
+            The (start, end) of every window
+        index: int
+            The index of the window
+        segments: list[dict]
+            The segments of the window, with 'start' and 'end' relative to the recording and 'local' label
+        labels: dict
+            The recording wide label of every local label
+
+        returns
+        -------
+        list[dict]
+            The kept segments, with 'start', 'end' and 'label'
+        """
+        kept_start, kept_end = self._kept_span(windows, index)
+        kept = []
+        for segment in segments:
+            start = max(segment["start"], kept_start)
+            end = min(segment["end"], kept_end)
+            if end > start:
+                kept.append(
+                    {"start": start, "end": end, "label": labels[segment["local"]]}
+                )
+
+        return kept
+
+    def _link_centroids(
+        self,
+        windows: list[tuple[float, float]],
+        window_results: list[tuple[list[dict], dict]],
+    ) -> tuple[list[dict], dict[int, np.ndarray]]:
+        """
+        Join the diarization of every window into one, the speakers of a window are matched to the speakers
+        found so far by the cosine similarity of their x-vector centroids. Unlike linking by the overlaps,
+        a speaker who is silent for a few windows keeps their label
+        parameters
+        ----------
+        windows: list[tuple[float, float]]
+            The (start, end) of every window
+        window_results: list[tuple[list[dict], dict]]
+            The segments of every window, relative to the window, and the centroid of every local label
+
+        returns
+        -------
+        tuple[list[dict], dict[int, np.ndarray]]
+            The segments of the recording, with 'start', 'end' and 'label', and the unit length centroid
+            of every label
+        """
+        segments = []
+        # the centroid of every recording wide label, weighted by the seconds of speech behind it
+        centroids: list[np.ndarray] = []
+        weights: list[float] = []
+
+        for index, (window, (local_segments, local_centroids)) in enumerate(
+            zip(windows, window_results)
+        ):
+            current = [
+                {
+                    "start": window[0] + segment["start"],
+                    "end": window[0] + segment["end"],
+                    "local": segment["label"],
+                }
+                for segment in local_segments
+            ]
+            seconds: dict = {}
+            for segment in current:
+                seconds[segment["local"]] = (
+                    seconds.get(segment["local"], 0.0)
+                    + segment["end"]
+                    - segment["start"]
+                )
+
+            local_labels = [label for label in local_centroids if label in seconds]
+            similarities = np.zeros((len(local_labels), len(centroids)))
+            if local_labels and centroids:
+                global_centroids = np.stack(centroids)
+                global_centroids /= np.linalg.norm(
+                    global_centroids, axis=1, keepdims=True
+                )
+                similarities = (
+                    np.stack([local_centroids[label] for label in local_labels])
+                    @ global_centroids.T
+                )
+
+            # greedy one to one matching, most similar first
+            labels = {}
+            linked_globals = set()
+            for flat_index in np.argsort(-similarities, axis=None):
+                local_index, global_label = np.unravel_index(
+                    flat_index, similarities.shape
+                )
+                if similarities[local_index, global_label] < self._MIN_LINK_SIMILARITY:
+                    break
+                local_label = local_labels[local_index]
+                if global_label in linked_globals or local_label in labels:
+                    continue
+
+                labels[local_label] = int(global_label)
+                linked_globals.add(global_label)
+
+            for local_label in local_labels:
+                weight = seconds[local_label]
+                if local_label in labels:
+                    global_label = labels[local_label]
+                    centroids[global_label] = (
+                        centroids[global_label] * weights[global_label]
+                        + local_centroids[local_label] * weight
+                    ) / (weights[global_label] + weight)
+                    weights[global_label] += weight
+                else:
+                    labels[local_label] = len(centroids)
+                    centroids.append(local_centroids[local_label])
+                    weights.append(weight)
+
+            segments += self._kept_segments(
+                windows,
+                index,
+                [segment for segment in current if segment["local"] in labels],
+                labels,
+            )
+
+        return segments, {
+            label: centroid / (np.linalg.norm(centroid) + 1e-8)
+            for label, centroid in enumerate(centroids)
+        }
+
+    def _run_inline(self, fn: typing.Callable, items: list) -> list:
+        return [fn(item) for item in items]
+
+    def _diarize_windows_in_parallel(
+        self,
+        samples: typing.Any,
+        sample_rate: int,
+        windows: list[tuple[float, float]],
+        output_file_path: str,
+        window_runner: typing.Callable[[typing.Callable, list], list] | None = None,
+    ) -> tuple[list[dict], dict[int, np.ndarray]]:
+        """
+        Diarize the windows of a recording with the window runner and link their speakers by centroid. Only
+        diarization_workers windows are written to disk at a time
+        parameters
+        ----------
+        samples: np.ndarray
+            The int16 samples of the recording, usually memory-mapped
+        sample_rate: int
+            The sample rate of the samples
+        windows: list[tuple[float, float]]
+            The (start, end) of every window
+        output_file_path: str
+            The directory of the speaker tracks, the windows are written next to it
+        window_runner: typing.Callable[[typing.Callable, list], list] | None
+            Calls a picklable function with every window path and returns the results in order, the
+            pipeline runs the windows in its diarization processes. None diarizes them inline
+
+        returns
+        -------
+        tuple[list[dict], dict[int, np.ndarray]]
+            The segments of the recording, with 'start', 'end' and 'label', and the centroid of every label
+        """
+        window_runner = window_runner or self._run_inline
+        # kept apart from the speaker tracks, every wav in their directory is taken for a track
+        windows_dir = f"{output_file_path}_windows"
+        os.makedirs(windows_dir, exist_ok=True)
+        window_results = []
+        try:
+            for batch_start in range(0, len(windows), self.diarization_workers):
+                window_paths = [
+                    self._write_window(
+                        samples,
+                        sample_rate,
+                        window,
+                        f"{windows_dir}/window_{batch_start + index:04d}.wav",
+                    )
+                    for index, window in enumerate(
+                        windows[batch_start : batch_start + self.diarization_workers]
+                    )
+                ]
+                window_results += window_runner(
+                    self.diarization._diarize_audio_to_centroids, window_paths
+                )
+                for window_path in window_paths:
+                    os.remove(window_path)
+        finally:
+            shutil.rmtree(windows_dir, ignore_errors=True)
+
+        return self._link_centroids(windows, window_results)
+
+    def _diarize_audio_file(
+        self,
+        audio_file_path: str,
+        output_file_path: str,
+        window_runner: typing.Callable[[typing.Callable, list], list] | None = None,
+    ) -> str:
+        """
+        Diarize a recording window by window and write one track per speaker
+        parameters
+        ----------
+        audio_file_path: str
+            The path to the recording
+        output_file_path: str
+            The path to the output directory
+        window_runner: typing.Callable[[typing.Callable, list], list] | None
+            Runs the diarization of the windows with diarization_workers, see _diarize_windows_in_parallel.
+            Recordings that fit a window are diarized whole through it as well
+
+        returns
+        -------
+        str
+            The path to the output directory
+        """
+        loaded = self._load(audio_file_path)
+        if loaded is None:
+            return (window_runner or self._run_inline)(
+                functools.partial(
+                    self.diarization._diarize_audio_file,
+                    output_file_path=output_file_path,
+                ),
+                [audio_file_path],
+            )[0]
+
+        samples, sample_rate = loaded
+        windows = self._plan_windows(len(samples) / sample_rate)
+        logger.info(
+            f"Tarkibi _ChunkedAudio: Diarizing {audio_file_path} in {len(windows)} windows"
+        )
+
+        os.makedirs(output_file_path, exist_ok=True)
+        centroids = None
+        if self.diarization_workers:
+            segments, centroids = self._diarize_windows_in_parallel(
+                samples, sample_rate, windows, output_file_path, window_runner
+            )
+        else:
+            # kept apart from the speaker tracks, every wav in their directory is taken for a track
+            windows_dir = f"{output_file_path}_windows"
+            os.makedirs(windows_dir, exist_ok=True)
+            window_path = f"{windows_dir}/window.wav"
+            window_segments = []
+            try:
+                for window in windows:
+                    self._write_window(samples, sample_rate, window, window_path)
+                    window_segments.append(
+                        self.diarization._diarize_audio_to_segments(window_path)
+                    )
+                    os.remove(window_path)
+            finally:
+                shutil.rmtree(windows_dir, ignore_errors=True)
+
+            segments = self._stitch_segments(windows, window_segments)
+
+        speakers = self.diarization._group_segments_by_speaker(segments)
+        for speaker, info in speakers.items():
+            tarkibi.utilities.wav.write_spans(
+                f"{output_file_path}/{speaker}.wav",
+                samples,
+                sample_rate,
+                [(segment["start"], segment["end"]) for segment in info["segments"]],
+            )
+
+        # windows diarized one after the other are linked without embeddings
+        if centroids is not None and self.diarization.keep_centroids:
+            self.diarization._write_centroids(
+                {label: centroids[label] for label in speakers if label in centroids},
+                output_file_path,
+            )
+
+        return output_file_path
+
+    def _speaker_verify_dir(
+        self, dir_path: str, reference_audio_file: str
+    ) -> list[str]:
+        """
+        Verify the speaker tracks in a directory, tracks longer than a window are verified on their first window
+        parameters
+        ----------
+        dir_path: str
+            The directory to verify
+        reference_audio_file: str
+            The reference audio file to compare the audio files to
+
+        returns
+        -------
+        list[str]
+            A list of audio files that are similar to the reference audio file
+        """
+        if self.speaker_verification.verification_mode == "sampled":
+            # windows are sampled from the whole track, reading only the windows
+            return self.speaker_verification._speaker_verify_dir(
+                dir_path, reference_audio_file
+            )
+
+        excerpts_dir = f"{dir_path}_excerpts"
+        similar_clips, undecided = self.speaker_verification._centroid_verify(
+            dir_path,
+            self.speaker_verification._get_audio_files(dir_path),
+            reference_audio_file,
+        )
+        try:
+            verified_files = []
+            for audio_file in undecided:
+                loaded = self._load(audio_file)
+                verified_file = audio_file
+                if loaded is not None:
+                    os.makedirs(excerpts_dir, exist_ok=True)
+                    samples, sample_rate = loaded
+                    verified_file = self._write_window(
+                        samples,
+                        sample_rate,
+                        (0, self.window_seconds),
+                        os.path.join(excerpts_dir, os.path.basename(audio_file)),
+                    )
+                verified_files.append(verified_file)
+
+            # the tracks are embedded in batches and scored together
+            scores = self.speaker_verification._score_files(
+                verified_files, reference_audio_file
+            )
+            similar_clips += [
+                audio_file
+                for audio_file, score in zip(undecided, scores)
+                if score >= self.speaker_verification._TITANET_THRESHOLD
+            ]
+        finally:
+            shutil.rmtree(excerpts_dir, ignore_errors=True)
+
+        return similar_clips
@@ -0,0 +1,120 @@
+import numpy as np
+import tarkibi.utilities.wav
+from tarkibi.utilities._config import logger
+
+logger = logger.getChild(__name__)
+
+
+class _CleanSpeechDetector:
+    _WINDOWS = 8
+    _WINDOW_SECONDS = 4.0
+    _FRAME_SECONDS = 0.032
+    # the loudest and quietest frames, as percentiles, the ratio of their energy is the SNR
+    _SPEECH_PERCENTILE = 90
+    _FLOOR_PERCENTILE = 10
+    # noise between words is broadband, music playing under the speech is tonal
+    _MIN_FLOOR_FLATNESS = 0.1
+    _EPSILON = 1e-10
+
+    def __init__(self, snr_threshold: float) -> None:
+        """
+        Cheap check of whether a recording is already clean speech, from the spectra of a few windows
+        sampled across it. A recording is clean if its loud frames are snr_threshold dB above its
+        quietest frames and the quietest frames sound like noise or silence rather than music
+        parameters
+        ----------
+        snr_threshold: float
+            The lowest SNR, in dB, of a clean recording
+        """
+        self.snr_threshold = snr_threshold
+
+    def _sample_windows(
+        self, samples: np.ndarray, sample_rate: int
+    ) -> list[np.ndarray]:
+        window_frames = int(self._WINDOW_SECONDS * sample_rate)
+        if len(samples) <= window_frames * self._WINDOWS:
+            starts = range(0, len(samples), window_frames)
+        else:
+            starts = np.linspace(0, len(samples) - window_frames, self._WINDOWS)
+
+        # mixed down to mono, only the sampled windows are read from disk
+        return [
+            np.asarray(
+                samples[int(start) : int(start) + window_frames], np.float32
+            ).mean(axis=1)
+            for start in starts
+        ]
+
+    def analyse(self, audio_file: str) -> dict[str, float] | None:
+        """
+        Measure the SNR of a recording and the spectral flatness of its quietest frames
+        parameters
+        ----------
+        audio_file: str
+            The path to the recording
+
+        returns
+        -------
+        dict[str, float] | None
+            The 'snr' in dB and the 'floor_flatness' between 0 (tonal) and 1 (white noise or silence),
+            None if the file is not a 16-bit PCM wav or is too short to analyse
+        """
+        if not tarkibi.utilities.wav.is_pcm16_wav(audio_file):
+            return None
+
+        samples, sample_rate = tarkibi.utilities.wav.read_wav(audio_file)
+        n_fft = 2 ** int(np.ceil(np.log2(self._FRAME_SECONDS * sample_rate)))
+        hop = n_fft // 2
+        frames = [
+            np.lib.stride_tricks.sliding_window_view(window, n_fft)[::hop]
+            for window in self._sample_windows(samples, sample_rate)
+            if len(window) >= n_fft
+        ]
+        if not frames:
+            return None
+
+        frames = np.concatenate(frames)
+        power = np.abs(np.fft.rfft(frames * np.hanning(n_fft), axis=1)) ** 2
+        power = power[:, 1:]
+        energy = power.sum(axis=1)
+
+        floor = np.percentile(energy, self._FLOOR_PERCENTILE)
+        speech = np.percentile(energy, self._SPEECH_PERCENTILE)
+        quietest = power[energy <= floor] + self._EPSILON
+        flatness = np.exp(np.log(quietest).mean(axis=1)) / quietest.mean(axis=1)
+
+        return {
+            "snr": float(
+                10 * np.log10((speech + self._EPSILON) / (floor + self._EPSILON))
+            ),
+            "floor_flatness": float(np.median(flatness)),
+        }
+
+    def is_clean(self, audio_file: str) -> bool:
+        """
+        Decide if a recording can skip vocal separation, the decision is logged with the measurements
+        parameters
+        ----------
+        audio_file: str
+            The path to the recording
+
+        returns
+        -------
+        bool
+            True if the recording is clean speech, False if it needs separating or cannot be analysed
+        """
+        analysis = self.analyse(audio_file)
+        if analysis is None:
+            return False
+
+        clean = (
+            analysis["snr"] >= self.snr_threshold
+            and analysis["floor_flatness"] >= self._MIN_FLOOR_FLATNESS
+        )
+        logger.info(
+            f"Tarkibi _CleanSpeechDetector: {audio_file} SNR {analysis['snr']:.1f}dB (threshold {self.snr_threshold}dB), "
+            f"floor flatness {analysis['floor_flatness']:.2f} (threshold {self._MIN_FLOOR_FLATNESS}), "
+            f"{'skipping' if clean else 'needs'} separation"
+        )
+
+        return clean
@@ -1,7 +1,14 @@
+import contextlib
 import os
+import subprocess
+import tempfile
 import typing
 from datetime import timedelta
 import tarkibi.utilities.general
+import tarkibi.utilities.models
+import tarkibi.utilities.wav
+import numpy as np
+import torch
 from simple_diarizer.diarizer import Diarizer
 from pydub import AudioSegment
 from tarkibi.utilities._config import logger
@@ -11,13 +18,111 @@ logger = logger.getChild(__name__)
 
 class _Diarization:
     _AUDIO_CLIPS_PATH = f"{tarkibi.utilities.general.BASE_DIR}/audio_clips"
+    _EMBED_MODEL = "xvec"
+    _CLUSTER_METHOD = "sc"
+    # the diarizer converts any other input next to the input itself
+    _DIARIZER_SAMPLE_RATE = 16000
+    # the windows the diarizer embeds speech in, the defaults of Diarizer
+    _EMBED_WINDOW_SECONDS = 1.5
+    _EMBED_PERIOD_SECONDS = 0.75
+    _MIN_REFERENCE_SECONDS = 0.5
+    # the x-vector centroid of every speaker track, written next to the tracks
+    _CENTROIDS_FILE = "centroids.npz"
 
-    def __init__(self) -> None:
+    def __init__(self, keep_centroids: bool = False) -> None:
+        """
+        Diarizes recordings into one track per speaker
+        parameters
+        ----------
+        keep_centroids: bool
+            Whether to write the x-vector centroid of every speaker next to the tracks, so speakers can
+            be verified against a reference without embedding the tracks again
+        """
+        self.keep_centroids = keep_centroids
         tarkibi.utilities.general.make_directories([self._AUDIO_CLIPS_PATH])
 
     def _format_time(self, seconds) -> str:
         return str(timedelta(seconds=seconds))
 
+    @property
+    def _diarizer_name(self) -> str:
+        return f"diarizer_{self._EMBED_MODEL}_{self._CLUSTER_METHOD}"
+
+    def _load_diarizer(self) -> Diarizer:
+        return Diarizer(
+            embed_model=self._EMBED_MODEL, cluster_method=self._CLUSTER_METHOD
+        )
+
+    def _diarizer(self) -> Diarizer:
+        """
+        Get the diarizer, its x-vector and VAD models are loaded once per process and shared by
+        every thread
+
+        returns
+        -------
+        Diarizer
+            The diarizer
+        """
+        return tarkibi.utilities.models.registry.get(
+            self._diarizer_name, self._load_diarizer
+        )
+
+    def warm_up(self) -> None:
+        """
+        Load the diarizer before the first file is diarized, called when the worker starts
+        """
+        tarkibi.utilities.models.registry.warm(self._diarizer_name, self._load_diarizer)
+
+    def _needs_conversion(self, file_path: str) -> bool:
+        if not tarkibi.utilities.wav.is_pcm16_wav(file_path):
+            return True
+
+        samples, sample_rate = tarkibi.utilities.wav.read_wav(file_path)
+        return sample_rate != self._DIARIZER_SAMPLE_RATE or samples.shape[1] != 1
+
+    @contextlib.contextmanager
+    def _diarizer_input(self, file_path: str) -> typing.Iterator[str]:
+        """
+        Give the diarizer a file it does not have to convert. It writes its conversion of anything but 16kHz
+        mono wavs next to the input and never removes it, so other files are converted into a temporary
+        directory that is removed once the file is diarized
+        parameters
+        ----------
+        file_path: str
+            The path to the audio file to diarize
+
+        returns
+        -------
+        typing.Iterator[str]
+            The path to pass to the diarizer
+        """
+        if not self._needs_conversion(file_path):
+            yield file_path
+            return
+
+        with tempfile.TemporaryDirectory(prefix="tarkibi_diarization_") as work_dir:
+            converted_path = os.path.join(
+                work_dir, f"{os.path.splitext(os.path.basename(file_path))[0]}.wav"
+            )
+            subprocess.run(
+                [
+                    "ffmpeg",
+                    "-y",
+                    "-i",
+                    file_path,
+                    "-ac",
+                    "1",
+                    "-ar",
+                    str(self._DIARIZER_SAMPLE_RATE),
+                    "-c:a",
+                    "pcm_s16le",
+                    converted_path,
+                ],
+                capture_output=True,
+                check=True,
+            )
+            yield converted_path
+
     def _diarize_audio_to_segments(
         self, file_path: str = None
     ) -> list | dict[str, typing.Any]:
@@ -36,15 +141,142 @@ class _Diarization:
         logger.info(
             f"Tarkibi _diarize_audio_to_segments: Diarizing audio file: {file_path}"
         )
-        diar = Diarizer(embed_model="xvec", cluster_method="sc")
+        with self._diarizer_input(file_path) as diarizer_input:
+            segments = self._diarizer().diarize(
+                diarizer_input,
+                num_speakers=None,
+                threshold=1e-1,
+            )
 
-        segments = diar.diarize(
-            file_path,
-            num_speakers=None,
-            threshold=1e-1,
+        return segments
+
+    def _diarize_audio_to_centroids(
+        self, file_path: str
+    ) -> tuple[list[dict], dict[typing.Any, np.ndarray]]:
+        """
+        Diarize an audio file to segments, with the x-vector centroid of every speaker so the speakers
+        can be matched to those of other files
+        parameters
+        ----------
+        file_path: str
+            The path to the audio file to diarize
+
+        returns
+        -------
+        tuple[list[dict], dict[typing.Any, np.ndarray]]
+            The segments, with 'start', 'end' and 'label', and the unit length mean embedding of every
+            label. Both are empty if the file has no speech
+        """
+        logger.info(
+            f"Tarkibi _diarize_audio_to_centroids: Diarizing audio file: {file_path}"
         )
+        result = self._diarize_with_embeddings(file_path)
+        if result is None:
+            return [], {}
 
-        return segments
+        embeds = np.asarray(result["embeds"], dtype=np.float32)
+        cluster_labels = np.asarray(result["cluster_labels"])
+        centroids = {}
+        for label in np.unique(cluster_labels):
+            centroid = embeds[cluster_labels == label].mean(axis=0)
+            centroids[label.item()] = centroid / (np.linalg.norm(centroid) + 1e-8)
+
+        return list(result["clean_segments"]), centroids
+
+    def _diarize_with_embeddings(self, file_path: str) -> dict[str, typing.Any] | None:
+        try:
+            with self._diarizer_input(file_path) as diarizer_input:
+                return self._diarizer().diarize(
+                    diarizer_input,
+                    num_speakers=None,
+                    threshold=1e-1,
+                    extra_info=True,
+                )
+        except AssertionError:
+            # the diarizer asserts that voice activity detection found speech
+            logger.info(
+                f"Tarkibi _diarize_with_embeddings: No speech found in {file_path}"
+            )
+            return None
+
+    def _reference_embedding(self, reference_audio_file: str) -> np.ndarray | None:
+        """
+        The x-vector of a reference recording, the mean of the embeddings of its windows as diarization
+        embeds them. The reference is expected to be speech of one speaker, so it is neither filtered by
+        voice activity detection nor clustered. Computed once per process and reference content
+        parameters
+        ----------
+        reference_audio_file: str
+            The path to the reference recording
+
+        returns
+        -------
+        np.ndarray | None
+            The unit length embedding, None if the recording is too short to embed
+        """
+
+        def embed() -> np.ndarray | None:
+            # converted in a temporary directory, nothing is written next to the reference
+            with self._diarizer_input(reference_audio_file) as diarizer_input:
+                samples, _ = tarkibi.utilities.wav.read_wav(diarizer_input)
+                signal = samples[:, 0].astype(np.float32) / 32768
+
+            if len(signal) < self._MIN_REFERENCE_SECONDS * self._DIARIZER_SAMPLE_RATE:
+                logger.info(
+                    f"Tarkibi _reference_embedding: {reference_audio_file} is too short to embed"
+                )
+                return None
+
+            embeds, _ = self._diarizer().windowed_embeds(
+                torch.from_numpy(signal).unsqueeze(0),
+                self._DIARIZER_SAMPLE_RATE,
+                self._EMBED_WINDOW_SECONDS,
+                self._EMBED_PERIOD_SECONDS,
+            )
+            embedding = np.asarray(embeds, dtype=np.float32).mean(axis=0)
+            return embedding / (np.linalg.norm(embedding) + 1e-8)
+
+        return tarkibi.utilities.models.embeddings.get(
+            f"{self._EMBED_MODEL}_reference", reference_audio_file, embed
+        )
+
+    def _write_centroids(
+        self, centroids: dict[typing.Any, np.ndarray], output_file_path: str
+    ) -> None:
+        """
+        Write the centroid of every speaker track to the directory of the tracks
+        parameters
+        ----------
+        centroids: dict[typing.Any, np.ndarray]
+            The centroid of every speaker, keyed by the label the track is named after
+        output_file_path: str
+            The directory of the tracks
+        """
+        np.savez(
+            os.path.join(output_file_path, self._CENTROIDS_FILE),
+            **{str(label): centroid for label, centroid in centroids.items()},
+        )
+
+    def _read_centroids(self, dir_path: str) -> dict[str, np.ndarray]:
+        """
+        Read the centroids of the speaker tracks in a directory
+        parameters
+        ----------
+        dir_path: str
+            The directory of the tracks
+
+        returns
+        -------
+        dict[str, np.ndarray]
+            The centroid of every speaker, keyed by the name of its track without the extension. Empty if
+            the tracks were diarized without keep_centroids
+        """
+        centroids_path = os.path.join(dir_path, self._CENTROIDS_FILE)
+        if not os.path.exists(centroids_path):
+            return {}
+
+        with np.load(centroids_path) as centroids:
+            return {label: centroids[label] for label in centroids.files}
 
     def _group_segments_by_speaker(
         self, segments: list | dict[str, typing.Any]
@@ -111,23 +343,38 @@ class _Diarization:
         if not os.path.exists(output_file_path):
             os.mkdir(output_file_path)
 
+        # decoded once, every speaker file is written span by span in one pass
+        samples, sample_rate = self._decode(audio_file_path)
         for speaker, info in speakers.items():
-            segments = []
+            tarkibi.utilities.wav.write_spans(
+                f"{output_file_path}/{speaker}.wav",
+                samples,
+                sample_rate,
+                [(segment["start"], segment["end"]) for segment in info["segments"]],
+            )
 
-            for _, segment in enumerate(info["segments"]):
-                segment_start = segment["start"] * 1000
-                segment_end = segment["end"] * 1000
+        return output_file_path
 
-                audio = AudioSegment.from_wav(audio_file_path)
-                segment_audio = audio[segment_start:segment_end]
+    def _decode(self, audio_file_path: str) -> tuple[np.ndarray, int]:
+        """
+        Decode an audio file to int16 samples
+        parameters
+        ----------
+        audio_file_path: str
+            The path to the audio file, 16-bit PCM wavs are memory-mapped rather than decoded
 
-                segments.append(segment_audio)
+        returns
+        -------
+        tuple[np.ndarray, int]
+            The int16 samples with shape (frames, channels), and the sample rate
+        """
+        if tarkibi.utilities.wav.is_pcm16_wav(audio_file_path):
+            return tarkibi.utilities.wav.read_wav(audio_file_path)
 
-            concatenated_audio = sum(segments)
-            output_file = f"{output_file_path}/{speaker}.wav"
-            concatenated_audio.export(output_file, format="wav")
+        audio = AudioSegment.from_file(audio_file_path).set_sample_width(2)
+        samples = np.array(audio.get_array_of_samples(), dtype=np.int16)
 
-        return output_file_path
+        return samples.reshape(-1, audio.channels), audio.frame_rate
 
     def _diarize_audio_file(self, audio_file_path: str, output_file_path: str) -> str:
         """
@@ -146,10 +393,19 @@ class _Diarization:
         """
         logger.info(f"Tarkibi _diarize_audio: Diarizing audio file: {audio_file_path}")
 
-        segments = self._diarize_audio_to_segments(audio_file_path)
+        if self.keep_centroids:
+            # the embeddings behind the clustering are reused rather than thrown away
+            segments, centroids = self._diarize_audio_to_centroids(audio_file_path)
+        else:
+            segments = self._diarize_audio_to_segments(audio_file_path)
         speakers = self._group_segments_by_speaker(segments)
         audio_clips_path = self._segment_audio_clips(
             speakers, audio_file_path, output_file_path
         )
+        if self.keep_centroids:
+            self._write_centroids(
+                {label: centroids[label] for label in speakers if label in centroids},
+                audio_clips_path,
+            )
 
         return audio_clips_path
@@ -1,32 +1,297 @@
+import contextlib
+import os
+import shutil
 import subprocess
+import threading
+import typing
+import numpy as np
 import tarkibi.utilities.general
+import tarkibi.utilities.models
+import tarkibi.utilities.wav
+import tarkibi.audio.clean_speech
+import tarkibi.audio.spectral_gate
 from tarkibi.utilities._config import logger
 
 logger = logger.getChild(__name__)
 
+# the TensorFlow predictor of a separator cannot run two separations at once, the pipeline runs
+# noise reduction in a process pool so every worker has a separator of its own
+_SEPARATOR_LOCK = threading.Lock()
+
 
 class _NoiseReduction:
     _NR_OUTPUT_PATH = f"{tarkibi.utilities.general.BASE_DIR}/audio_nn"
+    _SPLEETER_MODEL = "spleeter:2stems"
+    _SPLEETER_SAMPLE_RATE = 44100
+    _BACKENDS = ("auto", "resident", "cli", "spectral_gate")
+    # the resident separator separates long recordings a block at a time, neighbouring blocks overlap so
+    # the edges of a block, where separation is weakest, are dropped
+    _SEPARATION_BLOCK_SECONDS = 600
+    _SEPARATION_OVERLAP_SECONDS = 10
+
+    def __init__(
+        self,
+        backend: str = "auto",
+        clean_speech_snr: float | None = None,
+        gate_workers: int = 1,
+    ) -> None:
+        """
+        Separates the vocals of audio files with Spleeter, or gates steady background noise
+        parameters
+        ----------
+        backend: str
+            'auto' keeps the Spleeter separator loaded in the process and falls back to the spleeter CLI when
+            the spleeter package cannot be imported, 'resident' always uses the loaded separator, 'cli' runs
+            the spleeter CLI for every file, 'spectral_gate' denoises with _SpectralGate instead of separating
+        clean_speech_snr: float | None
+            Files whose SNR in dB is at least this, with no music under the speech, are not separated, their
+            audio is used as the vocals. None separates every file
+        gate_workers: int
+            The number of threads gating chunks of a file with the 'spectral_gate' backend
+        """
+        if backend not in self._BACKENDS:
+            raise ValueError(f"Unknown separation backend: {backend}")
 
-    def __init__(self) -> None:
+        self.backend = backend
+        self.clean_speech_snr = clean_speech_snr
+        self.gate_workers = gate_workers
         tarkibi.utilities.general.make_directories([self._NR_OUTPUT_PATH])
 
+    @property
+    def separation_model(self) -> str:
+        # the Spleeter backends produce the same vocals
+        if self.backend == "spectral_gate":
+            return "spectral_gate"
+
+        return self._SPLEETER_MODEL
+
+    def _load_separator(self):
+        from spleeter.separator import Separator
+
+        return Separator(self._SPLEETER_MODEL)
+
+    def _separator(self):
+        """
+        Get the Spleeter separator of this process, loading it on first use
+
+        returns
+        -------
+        Separator | None
+            The separator, None if the backend is 'cli' or spleeter cannot be imported with 'auto'
+        """
+        if self.backend in ("cli", "spectral_gate"):
+            return None
+
+        try:
+            return tarkibi.utilities.models.registry.get(
+                f"separator_{self._SPLEETER_MODEL}", self._load_separator
+            )
+        except ImportError as e:
+            if self.backend == "resident":
+                raise
+
+            logger.info(
+                f"Tarkibi _noise_reduction: spleeter cannot be imported ({e}), using the spleeter CLI"
+            )
+            self.backend = "cli"
+            return None
+
+    def warm_up(self) -> None:
+        """
+        Load the Spleeter separator before the first file is separated, nothing is loaded by the 'cli'
+        and 'spectral_gate' backends
+        """
+        try:
+            self._separator()
+        except Exception as e:
+            logger.error(
+                f"Tarkibi _noise_reduction: Warming up the separator failed: {e}"
+            )
+
+    @contextlib.contextmanager
+    def _pcm16_input(
+        self, audio_file_path: str, vocals_path: str
+    ) -> typing.Iterator[str]:
+        """
+        Give a 16-bit PCM wav of an audio file, other formats are decoded with ffmpeg next to the vocals
+        and removed once they have been read
+        parameters
+        ----------
+        audio_file_path: str
+            The path to the audio file
+        vocals_path: str
+            The path the vocals are written to
+
+        returns
+        -------
+        typing.Iterator[str]
+            The path to the 16-bit PCM wav
+        """
+        if tarkibi.utilities.wav.is_pcm16_wav(audio_file_path):
+            yield audio_file_path
+            return
+
+        decoded_path = f"{vocals_path}.pcm.wav"
+        subprocess.run(
+            ["ffmpeg", "-y", "-i", audio_file_path, "-c:a", "pcm_s16le", decoded_path],
+            capture_output=True,
+            check=True,
+        )
+        try:
+            yield decoded_path
+        finally:
+            os.remove(decoded_path)
+
+    def _load_waveform(self, samples: np.ndarray, sample_rate: int) -> np.ndarray:
+        """
+        Convert int16 samples to the float32 stereo waveform Spleeter expects
+        parameters
+        ----------
+        samples: np.ndarray
+            The int16 samples, with shape (frames, channels)
+        sample_rate: int
+            The sample rate of the samples
+
+        returns
+        -------
+        np.ndarray
+            The waveform at 44.1kHz, with shape (frames, 2)
+        """
+        samples = tarkibi.utilities.wav.resample(
+            samples, sample_rate, self._SPLEETER_SAMPLE_RATE
+        )
+        waveform = samples.astype(np.float32) / 32768
+        if waveform.shape[1] == 1:
+            waveform = np.repeat(waveform, 2, axis=1)
+
+        return waveform
+
+    def _separate_vocals(self, waveform: np.ndarray) -> np.ndarray:
+        """
+        Separate the vocals of a waveform with the loaded separator
+        parameters
+        ----------
+        waveform: np.ndarray
+            The float32 waveform at 44.1kHz, with shape (frames, 2)
+
+        returns
+        -------
+        np.ndarray
+            The int16 vocals, with shape (frames, 2)
+        """
+        separator = self._separator()
+        with _SEPARATOR_LOCK:
+            vocals = separator.separate(waveform)["vocals"]
+
+        return np.clip(np.rint(vocals * 32768), -32768, 32767).astype(np.int16)
+
+    def _separate_file(self, audio_file_path: str, vocals_path: str) -> None:
+        """
+        Separate the vocals of an audio file with the loaded separator, a block at a time so memory does not
+        grow with the length of the recording. The vocals of a block are cut at the middle of its overlaps
+        parameters
+        ----------
+        audio_file_path: str
+            The path to the audio file
+        vocals_path: str
+            The path to write the vocals to, a 44.1kHz stereo 16-bit PCM wav
+        """
+        with self._pcm16_input(audio_file_path, vocals_path) as pcm16_path:
+            samples, sample_rate = tarkibi.utilities.wav.read_wav(pcm16_path)
+            block = int(self._SEPARATION_BLOCK_SECONDS * sample_rate)
+            overlap = int(self._SEPARATION_OVERLAP_SECONDS * sample_rate)
+            # frames of the recording to frames of the vocals
+            rate_ratio = self._SPLEETER_SAMPLE_RATE / sample_rate
+
+            with tarkibi.utilities.wav.open_writer(
+                vocals_path, 2, self._SPLEETER_SAMPLE_RATE
+            ) as writer:
+                start = 0
+                while True:
+                    end = min(start + block, len(samples))
+                    vocals = self._separate_vocals(
+                        self._load_waveform(samples[start:end], sample_rate)
+                    )
+                    # the next block starts keeping its vocals where this one stops
+                    kept_start = start + overlap // 2 if start else 0
+                    kept_end = (
+                        end - overlap + overlap // 2 if end < len(samples) else end
+                    )
+                    offset = round(start * rate_ratio)
+                    kept = slice(
+                        round(kept_start * rate_ratio) - offset,
+                        round(kept_end * rate_ratio) - offset,
+                    )
+                    tarkibi.utilities.wav.append_frames(writer, vocals[kept])
+                    if end == len(samples):
+                        break
+
+                    start = end - overlap
+
+    def _spectral_gate(self, audio_file_path: str, vocals_path: str) -> None:
+        """
+        Denoise an audio file with spectral gating
+        parameters
+        ----------
+        audio_file_path: str
+            The path to the audio file, other formats than 16-bit PCM wav are decoded with ffmpeg first
+        vocals_path: str
+            The path to write the denoised audio to
+        """
+        gate = tarkibi.audio.spectral_gate._SpectralGate(workers=self.gate_workers)
+        with self._pcm16_input(audio_file_path, vocals_path) as pcm16_path:
+            gate.denoise_file(pcm16_path, vocals_path)
+
     def _noise_reduction(self, audio_file_path: str, output_file_path: str) -> str:
         """
         Reduce the noise of an audio file
         parameters
         ----------
-        file_path: str
+        audio_file_path: str
             The path to the audio file to reduce the noise of
+        output_file_path: str
+            The directory to write the vocals to
+
+        returns
+        -------
+        str
+            The path to the vocals, a 44.1kHz 16-bit PCM wav when separated by Spleeter, otherwise
+            a 16-bit PCM wav at the rate of the file
         """
         logger.info(
             f"Tarkibi _noise_reduction: Noise reduction on file: {audio_file_path}"
         )
 
         filename_without_extension = audio_file_path.split("/")[-1].split(".")[0]
+        vocals_path = f"{output_file_path}/{filename_without_extension}_vocals.wav"
+
+        if (
+            self.clean_speech_snr is not None
+            and tarkibi.audio.clean_speech._CleanSpeechDetector(
+                self.clean_speech_snr
+            ).is_clean(audio_file_path)
+        ):
+            shutil.copyfile(audio_file_path, vocals_path)
+            return vocals_path
+
+        if self.backend == "spectral_gate":
+            self._spectral_gate(audio_file_path, vocals_path)
+            return vocals_path
+
+        if self._separator() is not None:
+            # only the vocals are written, the accompaniment never leaves memory
+            self._separate_file(audio_file_path, vocals_path)
+            return vocals_path
 
         spleeter_cmd = f"spleeter separate -o {output_file_path} {audio_file_path}"
         spleeter_cmd += " -f {filename}_{instrument}.{codec}"
         subprocess.run(spleeter_cmd, shell=True, check=True)
 
-        return f"{output_file_path}/{filename_without_extension}_vocals.wav"
+        # only the vocals are used
+        accompaniment_path = (
+            f"{output_file_path}/{filename_without_extension}_accompaniment.wav"
+        )
+        if os.path.exists(accompaniment_path):
+            os.remove(accompaniment_path)
+
+        return vocals_path
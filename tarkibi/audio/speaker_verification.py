@@ -1,8 +1,13 @@
 import librosa
 import numpy as np
 import os
+import typing
+import zlib
+import torch
 from sklearn.metrics.pairwise import cosine_similarity
 import nemo.collections.asr as nemo_asr
+import tarkibi.utilities.models
+import tarkibi.utilities.wav
 from tarkibi.utilities._config import logger
 
 logger = logger.getChild(__name__)
@@ -12,9 +17,76 @@ class _SpeakerVerification:
     _FAILED_THRESHOLD = 20
     _PASSED_THRESHOLD = 20
     _NVIDIA_NEMO_MODEL = "nvidia/speakerverification_en_titanet_large"
+    _VERIFICATION_MODES = ("titanet", "centroid", "sampled")
+    # cosine similarity of the x-vector centroid of a speaker to the reference, speakers in between are
+    # verified with TitaNet
+    _CENTROID_ACCEPT = 0.85
+    _CENTROID_REJECT = 0.5
+    _SAMPLE_RATE = 16000
+    # signals per TitaNet forward pass, tracks of similar length are batched together to limit padding
+    _BATCH_SIZE = 8
+    # longer tracks are embedded from evenly spaced excerpts whose embeddings are averaged, so a forward
+    # pass holds at most _BATCH_SIZE excerpts whatever the length of the tracks
+    _EMBED_EXCERPT_SECONDS = 30.0
+    _EMBED_EXCERPTS = 4
+    # tracks shorter than this fail without being embedded
+    _MIN_EMBED_SECONDS = 0.5
+    # the threshold of NeMo's verify_speakers, on the cosine similarity rescaled to [0, 1]
+    _TITANET_THRESHOLD = 0.7
+    # 'sampled' mode embeds windows of a track a round at a time, windows scoring within the margin of the
+    # threshold count as neither passed nor failed, a track is decided once either count reaches its threshold
+    _SAMPLE_WINDOW_SECONDS = 3.0
+    _SAMPLE_WINDOWS_PER_ROUND = 4
+    _SAMPLE_MAX_WINDOWS = 16
+    _SAMPLE_MARGIN = 0.05
+    _SAMPLE_PASSED_THRESHOLD = 3
+    _SAMPLE_FAILED_THRESHOLD = 3
+
+    def __init__(
+        self, verification_mode: str = "titanet", diarization: typing.Any = None
+    ) -> None:
+        """
+        Verifies which speaker tracks are the speaker of a reference recording
+        parameters
+        ----------
+        verification_mode: str
+            'titanet' verifies every track with TitaNet, 'centroid' compares the x-vector centroids kept by
+            diarization to the reference first, only ambiguous tracks are verified with TitaNet, 'sampled'
+            verifies random windows of every track with TitaNet, longest first, each track only until it is decided
+        diarization: _Diarization
+            Embeds the reference in 'centroid' mode
+        """
+        if verification_mode not in self._VERIFICATION_MODES:
+            raise ValueError(f"Unknown verification mode: {verification_mode}")
+
+        self.verification_mode = verification_mode
+        self.diarization = diarization
+
+    def _load_speaker_model(self) -> nemo_asr.models.EncDecSpeakerLabelModel:
+        return nemo_asr.models.EncDecSpeakerLabelModel.from_pretrained(
+            self._NVIDIA_NEMO_MODEL
+        )
 
-    def __init__(self) -> None:
-        pass
+    def _speaker_model(self) -> nemo_asr.models.EncDecSpeakerLabelModel:
+        """
+        Get the speaker model, loaded once per process
+
+        returns
+        -------
+        nemo_asr.models.EncDecSpeakerLabelModel
+            The speaker model
+        """
+        return tarkibi.utilities.models.registry.get(
+            self._NVIDIA_NEMO_MODEL, self._load_speaker_model
+        )
+
+    def warm_up(self) -> None:
+        """
+        Load TitaNet before the first track is verified, called when the worker starts
+        """
+        tarkibi.utilities.models.registry.warm(
+            self._NVIDIA_NEMO_MODEL, self._load_speaker_model
+        )
 
     def _get_audio_files(self, audio_directory: str) -> list[str]:
         """
@@ -150,11 +222,7 @@ class _SpeakerVerification:
         logger.info(
             f"Tarkibi _speaker_recognition: Finding similar clips from audio directories: {audio_directories}"
         )
-        speaker_model: nemo_asr.models.EncDecSpeakerLabelModel = (
-            nemo_asr.models.EncDecSpeakerLabelModel.from_pretrained(
-                self._NVIDIA_NEMO_MODEL
-            )
-        )
+        speaker_model = self._speaker_model()
         audio_files = self._get_audio_files(audio_directories)
 
         speaker_performance = {}
@@ -218,6 +286,213 @@ class _SpeakerVerification:
 
         return self._most_common_audio(audio_directories)
 
+    def _load_signal(
+        self, audio_file: str, offset: float = 0.0, duration: float | None = None
+    ) -> np.ndarray:
+        """
+        Load an audio file, or a span of it, as the mono float32 signal at the rate TitaNet was trained on
+        parameters
+        ----------
+        audio_file: str
+            The audio file, only the span is read from 16-bit PCM wavs
+        offset: float
+            The start of the span in seconds
+        duration: float | None
+            The length of the span in seconds, None reads to the end
+
+        returns
+        -------
+        np.ndarray
+            The signal
+        """
+        if tarkibi.utilities.wav.is_pcm16_wav(audio_file):
+            samples, sample_rate = tarkibi.utilities.wav.read_wav(audio_file)
+            start = int(offset * sample_rate)
+            end = None if duration is None else start + int(duration * sample_rate)
+            samples = tarkibi.utilities.wav.resample(
+                samples[start:end], sample_rate, self._SAMPLE_RATE
+            )
+            return samples.mean(axis=1, dtype=np.float32) / 32768
+
+        signal, _ = librosa.load(
+            audio_file, sr=self._SAMPLE_RATE, offset=offset, duration=duration
+        )
+        return signal.astype(np.float32)
+
+    def _track_seconds(self, audio_file: str) -> float:
+        if tarkibi.utilities.wav.is_pcm16_wav(audio_file):
+            samples, sample_rate = tarkibi.utilities.wav.read_wav(audio_file)
+            return len(samples) / sample_rate
+
+        return librosa.get_duration(path=audio_file)
+
+    def _embed_batch(self, signals: list[np.ndarray]) -> np.ndarray:
+        """
+        Embed signals with TitaNet in one forward pass, the signals are zero padded to the longest
+        parameters
+        ----------
+        signals: list[np.ndarray]
+            The mono float32 signals at 16kHz, at least _MIN_EMBED_SECONDS long
+
+        returns
+        -------
+        np.ndarray
+            The unit length embedding of every signal, in order
+        """
+        speaker_model = self._speaker_model()
+        speaker_model.eval()
+        padded = np.zeros(
+            (len(signals), max(len(signal) for signal in signals)), dtype=np.float32
+        )
+        for row, signal in enumerate(signals):
+            padded[row, : len(signal)] = signal
+
+        with torch.no_grad():
+            _, embeddings = speaker_model.forward(
+                input_signal=torch.from_numpy(padded).to(speaker_model.device),
+                input_signal_length=torch.tensor(
+                    [len(signal) for signal in signals], device=speaker_model.device
+                ),
+            )
+
+        embeddings = embeddings.cpu().numpy()
+        return embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-8)
+
+    def _excerpts(self, audio_file: str) -> list[tuple[float, float | None]]:
+        """
+        The spans of a track to embed, the whole track when it is short enough
+        parameters
+        ----------
+        audio_file: str
+            The track
+
+        returns
+        -------
+        list[tuple[float, float | None]]
+            The offset and duration in seconds of every span, None reads to the end
+        """
+        seconds = self._track_seconds(audio_file)
+        if seconds <= self._EMBED_EXCERPT_SECONDS:
+            return [(0.0, None)]
+
+        excerpts = min(
+            self._EMBED_EXCERPTS, int(np.ceil(seconds / self._EMBED_EXCERPT_SECONDS))
+        )
+        return [
+            (float(offset), self._EMBED_EXCERPT_SECONDS)
+            for offset in np.linspace(
+                0, seconds - self._EMBED_EXCERPT_SECONDS, excerpts
+            )
+        ]
+
+    def _embed_rows(
+        self, rows: list[tuple[int, np.ndarray]], sums: dict[int, np.ndarray]
+    ) -> None:
+        for (index, _), embedding in zip(
+            rows, self._embed_batch([signal for _, signal in rows])
+        ):
+            sums[index] = sums[index] + embedding if index in sums else embedding
+
+    def _embed_files(self, audio_files: list[str]) -> np.ndarray:
+        """
+        Embed audio files with TitaNet in padded mini-batches, long files are embedded from a few
+        excerpts so memory does not grow with their length
+        parameters
+        ----------
+        audio_files: list[str]
+            The audio files to embed
+
+        returns
+        -------
+        np.ndarray
+            The unit length embedding of every file, in order, zeros for files too short to embed
+        """
+        # the size of a wav is proportional to its length
+        order = sorted(
+            range(len(audio_files)),
+            key=lambda index: os.path.getsize(audio_files[index]),
+        )
+        min_frames = int(self._MIN_EMBED_SECONDS * self._SAMPLE_RATE)
+
+        # the summed excerpt embeddings of every file, only a batch of signals is loaded at a time
+        sums: dict[int, np.ndarray] = {}
+        rows: list[tuple[int, np.ndarray]] = []
+        for index in order:
+            for offset, duration in self._excerpts(audio_files[index]):
+                signal = self._load_signal(audio_files[index], offset, duration)
+                if len(signal) >= min_frames:
+                    rows.append((index, signal))
+
+            while len(rows) >= self._BATCH_SIZE:
+                self._embed_rows(rows[: self._BATCH_SIZE], sums)
+                rows = rows[self._BATCH_SIZE :]
+        if rows:
+            self._embed_rows(rows, sums)
+
+        dimension = next((len(embedding) for embedding in sums.values()), 0)
+        embeddings = np.zeros((len(audio_files), dimension), dtype=np.float32)
+        for index, embedding in sums.items():
+            embeddings[index] = embedding / (np.linalg.norm(embedding) + 1e-8)
+
+        return embeddings
+
+    def _reference_embedding(self, reference_audio_file: str) -> np.ndarray:
+        """
+        The TitaNet embedding of a reference recording, computed once per process and reference content
+        parameters
+        ----------
+        reference_audio_file: str
+            The path to the reference recording
+
+        returns
+        -------
+        np.ndarray
+            The unit length embedding
+        """
+        return tarkibi.utilities.models.embeddings.get(
+            f"{self._NVIDIA_NEMO_MODEL}_reference",
+            reference_audio_file,
+            lambda: self._embed_files([reference_audio_file])[0],
+        )
+
+    def _score_files(
+        self, audio_files: list[str], reference_audio_file: str
+    ) -> np.ndarray:
+        """
+        Score audio files against a reference recording, every file is compared in one matrix product
+        parameters
+        ----------
+        audio_files: list[str]
+            The audio files to score
+        reference_audio_file: str
+            The reference audio file to compare the audio files to
+
+        returns
+        -------
+        np.ndarray
+            The cosine similarity of every file to the reference rescaled to [0, 1] as NeMo's
+            verify_speakers does, 0 for files too short to embed
+        """
+        if not audio_files:
+            return np.zeros(0)
+
+        logger.info(
+            f"Tarkibi _score_files: Comparing {len(audio_files)} audio files to reference audio file: {reference_audio_file}"
+        )
+        reference = self._reference_embedding(reference_audio_file)
+        if not reference.any():
+            raise ValueError(
+                f"Reference audio {reference_audio_file} is too short to embed"
+            )
+
+        embeddings = self._embed_files(audio_files)
+        scores = np.zeros(len(audio_files))
+        embedded = embeddings.any(axis=1)
+        if embedded.any():
+            scores[embedded] = (embeddings[embedded] @ reference + 1) / 2
+
+        return scores
+
     def _speaker_verify_file(self, audio_file: str, reference_audio_file: str) -> bool:
         """
         Verify if an audio file is similar to a reference audio file
@@ -233,18 +508,220 @@ class _SpeakerVerification:
         bool
             True if the audio file is similar to the reference audio file, False otherwise
         """
+        score = self._score_files([audio_file], reference_audio_file)[0]
+
+        return bool(score >= self._TITANET_THRESHOLD)
+
+    def _centroid_verify(
+        self, dir_path: str, audio_files: list[str], reference_audio_file: str
+    ) -> tuple[list[str], list[str]]:
+        """
+        Verify speaker tracks by the x-vector centroids diarization kept for them, all tracks are scored
+        against the reference embedding at once
+        parameters
+        ----------
+        dir_path: str
+            The directory of the tracks
+        audio_files: list[str]
+            The tracks to verify
+        reference_audio_file: str
+            The reference audio file to compare the tracks to
+
+        returns
+        -------
+        tuple[list[str], list[str]]
+            The tracks similar to the reference, and the tracks that are too close to call or have no
+            centroid, every track outside 'centroid' mode
+        """
+        if self.verification_mode != "centroid":
+            return [], audio_files
+
+        centroids = self.diarization._read_centroids(dir_path)
+        tracks = [
+            audio_file
+            for audio_file in audio_files
+            if os.path.basename(audio_file).split(".")[0] in centroids
+        ]
+        undecided = [
+            audio_file for audio_file in audio_files if audio_file not in tracks
+        ]
+        reference = (
+            self.diarization._reference_embedding(reference_audio_file)
+            if tracks
+            else None
+        )
+        if reference is None:
+            return [], audio_files
+
+        scores = (
+            np.stack(
+                [centroids[os.path.basename(track).split(".")[0]] for track in tracks]
+            )
+            @ reference
+        )
+
+        similar_clips = []
+        for track, score in zip(tracks, scores):
+            if score >= self._CENTROID_ACCEPT:
+                similar_clips.append(track)
+            elif score > self._CENTROID_REJECT:
+                undecided.append(track)
+
+        logger.info(
+            f"Tarkibi _centroid_verify: {dir_path} centroid scores {np.round(scores, 3).tolist()}, "
+            f"{len(similar_clips)} accepted, {len(undecided)} left for TitaNet"
+        )
+        return similar_clips, undecided
+
+    def _sampled_verify_file(
+        self, audio_file: str, reference_audio_file: str
+    ) -> tuple[bool, float]:
+        """
+        Verify a track on randomly sampled windows with a sequential test, extending the passed and failed
+        counting of _speaker_recognition to windows of one track. More windows are only sampled while the
+        scores are too close to the threshold to decide
+        parameters
+        ----------
+        audio_file: str
+            The track to verify
+        reference_audio_file: str
+            The reference audio file to compare the track to
+
+        returns
+        -------
+        tuple[bool, float]
+            Whether the track is similar to the reference, and the mean score of the windows embedded
+        """
+        seconds = self._track_seconds(audio_file)
+        if seconds <= self._SAMPLE_WINDOW_SECONDS:
+            score = self._score_files([audio_file], reference_audio_file)[0]
+            return bool(score >= self._TITANET_THRESHOLD), float(score)
+
+        reference = self._reference_embedding(reference_audio_file)
+        # the same track is sampled the same way in every run, tracks of other videos share their names
+        track_name = os.path.join(
+            os.path.basename(os.path.dirname(audio_file)), os.path.basename(audio_file)
+        )
+        rng = np.random.default_rng(zlib.crc32(track_name.encode()))
+        windows = int(seconds // self._SAMPLE_WINDOW_SECONDS)
+        offsets = (
+            rng.permutation(windows)[: self._SAMPLE_MAX_WINDOWS]
+            * self._SAMPLE_WINDOW_SECONDS
+        )
+
+        scores = []
+        passed = failed = 0
+        for start in range(0, len(offsets), self._SAMPLE_WINDOWS_PER_ROUND):
+            signals = [
+                self._load_signal(audio_file, offset, self._SAMPLE_WINDOW_SECONDS)
+                for offset in offsets[start : start + self._SAMPLE_WINDOWS_PER_ROUND]
+            ]
+            round_scores = (self._embed_batch(signals) @ reference + 1) / 2
+            scores.extend(round_scores.tolist())
+            passed += int(
+                (round_scores >= self._TITANET_THRESHOLD + self._SAMPLE_MARGIN).sum()
+            )
+            failed += int(
+                (round_scores < self._TITANET_THRESHOLD - self._SAMPLE_MARGIN).sum()
+            )
+            if (
+                passed >= self._SAMPLE_PASSED_THRESHOLD
+                or failed >= self._SAMPLE_FAILED_THRESHOLD
+            ):
+                break
+
+        mean_score = float(np.mean(scores))
+        decided = (
+            passed >= self._SAMPLE_PASSED_THRESHOLD
+            or failed >= self._SAMPLE_FAILED_THRESHOLD
+        )
+        if decided and passed != failed:
+            is_similar = passed > failed
+        else:
+            # every window sampled and still undecided
+            is_similar = mean_score >= self._TITANET_THRESHOLD
+
+        logger.info(
+            f"Tarkibi _sampled_verify_file: {audio_file} {len(scores)} of {windows} windows, "
+            f"{passed} passed, {failed} failed, mean score {mean_score:.3f}, {'similar' if is_similar else 'not similar'}"
+        )
+        return is_similar, mean_score
+
+    def _sampled_verify(
+        self, audio_files: list[str], reference_audio_file: str
+    ) -> tuple[list[str], dict[str, float]]:
+        """
+        Verify tracks on sampled windows, the tracks with the most diarized speech, most likely the host
+        and the guest, are verified first. Every track is decided, diarization and the stitching of windows
+        can split one speaker over several tracks
+        parameters
+        ----------
+        audio_files: list[str]
+            The tracks to verify
+        reference_audio_file: str
+            The reference audio file to compare the tracks to
+
+        returns
+        -------
+        tuple[list[str], dict[str, float]]
+            The tracks similar to the reference, and the mean window score of every track verified
+        """
+        similar_clips = []
+        scores = {}
+        for audio_file in sorted(audio_files, key=self._track_seconds, reverse=True):
+            is_similar, scores[audio_file] = self._sampled_verify_file(
+                audio_file, reference_audio_file
+            )
+            if is_similar:
+                similar_clips.append(audio_file)
+
         logger.info(
-            f"Tarkibi _speaker_verification: Comparing audio file: {audio_file} to reference audio file: {reference_audio_file}"
+            f"Tarkibi _sampled_verify: {len(similar_clips)} of {len(audio_files)} tracks accepted"
         )
-        speaker_model: nemo_asr.models.EncDecSpeakerLabelModel = (
-            nemo_asr.models.EncDecSpeakerLabelModel.from_pretrained(
-                self._NVIDIA_NEMO_MODEL
+        return similar_clips, scores
+
+    def _speaker_verify_dir_with_scores(
+        self, dir_path: str, reference_audio_file: str
+    ) -> tuple[list[str], dict[str, float]]:
+        """
+        Verify if audio files in a directory are similar to a reference audio file, the files are embedded
+        in batches and scored together
+        parameters
+        ----------
+        dir_path: str
+            The directory to verify
+        reference_audio_file: str
+            The reference audio file to compare the audio files to
+
+        returns
+        -------
+        tuple[list[str], dict[str, float]]
+            The audio files that are similar to the reference audio file, and the TitaNet score of every
+            file scored by TitaNet
+        """
+        if self.verification_mode == "sampled":
+            return self._sampled_verify(
+                self._get_audio_files(dir_path), reference_audio_file
             )
+
+        similar_clips, undecided = self._centroid_verify(
+            dir_path, self._get_audio_files(dir_path), reference_audio_file
         )
 
-        is_similar = speaker_model.verify_speakers(reference_audio_file, audio_file)
+        scores = dict(
+            zip(
+                undecided,
+                self._score_files(undecided, reference_audio_file).tolist(),
+            )
+        )
+        similar_clips += [
+            audio_file
+            for audio_file, score in scores.items()
+            if score >= self._TITANET_THRESHOLD
+        ]
+        logger.info(f"Tarkibi _speaker_verify_dir: {dir_path} scores {scores}")
 
-        return is_similar
+        return similar_clips, scores
 
     def _speaker_verify_dir(
         self, dir_path: str, reference_audio_file: str
@@ -263,13 +740,8 @@ class _SpeakerVerification:
         list[str]
             A list of audio files that are similar to the reference audio file
         """
-        audio_files = self._get_audio_files(dir_path)
-        similar_clips = []
-
-        for audio_file in audio_files:
-            # could be bad practice to constantly load model in memory and then out of memory for each file
-            is_similar = self._speaker_verify_file(audio_file, reference_audio_file)
-            if is_similar:
-                similar_clips.append(audio_file)
+        similar_clips, _ = self._speaker_verify_dir_with_scores(
+            dir_path, reference_audio_file
+        )
 
         return similar_clips
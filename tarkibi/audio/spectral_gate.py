@@ -0,0 +1,239 @@
+import typing
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy.ndimage import uniform_filter
+import tarkibi.utilities.wav
+from tarkibi.utilities._config import logger
+
+logger = logger.getChild(__name__)
+
+
+class _SpectralGate:
+    _FRAME_SECONDS = 0.064
+    # frames per hop, the hann windows overlap by three quarters
+    _OVERLAP = 4
+    _NOISE_PERCENTILE = 15
+    _PROFILE_SECONDS = 60.0
+    _CHUNK_SECONDS = 30.0
+    # time (frames) and frequency (bins) smoothing of the mask, against musical noise
+    _SMOOTH_FRAMES = 5
+    _SMOOTH_BINS = 3
+
+    def __init__(
+        self, n_std: float = 1.5, noise_gain: float = 0.1, workers: int = 1
+    ) -> None:
+        """
+        Stationary spectral gating, a light alternative to source separation when the only problem is
+        steady background noise. A per-frequency noise threshold is learned from the quietest frames of
+        a recording, bins below it are attenuated
+        parameters
+        ----------
+        n_std: float
+            How many standard deviations above the mean noise level a bin must be to be kept
+        noise_gain: float
+            The gain applied to gated bins, 0.1 attenuates them by 20dB
+        workers: int
+            The number of threads denoising chunks of a recording at the same time, numpy's FFT
+            releases the GIL
+        """
+        self.n_std = n_std
+        self.noise_gain = noise_gain
+        self.workers = workers
+
+    def _n_fft(self, sample_rate: int) -> int:
+        return 2 ** int(np.ceil(np.log2(self._FRAME_SECONDS * sample_rate)))
+
+    def _stft(self, signal: np.ndarray, n_fft: int) -> np.ndarray:
+        """
+        The short-time Fourier transform of a signal, every frame in one batched FFT
+        parameters
+        ----------
+        signal: np.ndarray
+            The float32 signal, with shape (frames, channels)
+        n_fft: int
+            The frame length
+
+        returns
+        -------
+        np.ndarray
+            The spectra, with shape (channels, stft frames, bins)
+        """
+        hop = n_fft // self._OVERLAP
+        frames = np.lib.stride_tricks.sliding_window_view(signal, n_fft, axis=0)[::hop]
+        # (stft frames, channels, n_fft) -> (channels, stft frames, n_fft)
+        frames = frames.transpose(1, 0, 2) * np.hanning(n_fft).astype(np.float32)
+        return np.fft.rfft(frames, axis=-1)
+
+    def _istft(self, spectra: np.ndarray, n_fft: int, length: int) -> np.ndarray:
+        """
+        Overlap-add the spectra back into a signal
+        parameters
+        ----------
+        spectra: np.ndarray
+            The spectra, with shape (channels, stft frames, bins)
+        n_fft: int
+            The frame length
+        length: int
+            The number of samples of the signal
+
+        returns
+        -------
+        np.ndarray
+            The float32 signal, with shape (frames, channels)
+        """
+        hop = n_fft // self._OVERLAP
+        window = np.hanning(n_fft).astype(np.float32)
+        frames = np.fft.irfft(spectra, n=n_fft, axis=-1).astype(np.float32) * window
+        channels, count, _ = frames.shape
+
+        signal = np.zeros((channels, (count - 1) * hop + n_fft), dtype=np.float32)
+        norm = np.zeros((count - 1) * hop + n_fft, dtype=np.float32)
+        # the frames of one overlap phase sit end to end, each phase is added in one slice
+        for phase in range(self._OVERLAP):
+            phase_frames = frames[:, phase :: self._OVERLAP]
+            start = phase * hop
+            end = start + phase_frames.shape[1] * n_fft
+            signal[:, start:end] += phase_frames.reshape(channels, -1)
+            norm[start:end] += np.tile(window**2, phase_frames.shape[1])
+
+        norm[norm < 1e-3] = 1.0
+        return (signal / norm)[:, :length].T
+
+    def noise_threshold(self, samples: np.ndarray, sample_rate: int) -> np.ndarray:
+        """
+        Learn the per-frequency noise threshold of a recording from its quietest frames
+        parameters
+        ----------
+        samples: np.ndarray
+            The int16 samples, with shape (frames, channels)
+        sample_rate: int
+            The sample rate of the samples
+
+        returns
+        -------
+        np.ndarray
+            The threshold in dB per frequency bin
+        """
+        n_fft = self._n_fft(sample_rate)
+        # the profile is learned from evenly spaced excerpts of long recordings
+        profile_frames = int(self._PROFILE_SECONDS * sample_rate)
+        if len(samples) > profile_frames:
+            starts = np.linspace(0, len(samples) - profile_frames // 10, 10).astype(int)
+            excerpt = np.concatenate(
+                [samples[start : start + profile_frames // 10] for start in starts]
+            )
+        else:
+            excerpt = samples
+
+        mono = np.asarray(excerpt, np.float32).mean(axis=1, keepdims=True) / 32768
+        if len(mono) < n_fft:
+            mono = np.pad(mono, ((0, n_fft - len(mono)), (0, 0)))
+
+        decibels = 20 * np.log10(np.abs(self._stft(mono, n_fft)[0]) + 1e-8)
+        energy = decibels.mean(axis=1)
+        quiet = decibels[energy <= np.percentile(energy, self._NOISE_PERCENTILE)]
+
+        return quiet.mean(axis=0) + self.n_std * quiet.std(axis=0)
+
+    def _gate(
+        self, signal: np.ndarray, threshold: np.ndarray, n_fft: int
+    ) -> np.ndarray:
+        # padded so every sample is covered by the full overlap of frames
+        padded = np.pad(signal, ((n_fft, n_fft + n_fft // self._OVERLAP), (0, 0)))
+        spectra = self._stft(padded, n_fft)
+        decibels = 20 * np.log10(np.abs(spectra) + 1e-8)
+        mask = (decibels > threshold).astype(np.float32)
+        mask = uniform_filter(
+            mask, size=(1, self._SMOOTH_FRAMES, self._SMOOTH_BINS), mode="nearest"
+        )
+        gain = self.noise_gain + (1 - self.noise_gain) * mask
+
+        denoised = self._istft(spectra * gain, n_fft, len(padded))
+        return denoised[n_fft : n_fft + len(signal)]
+
+    def _denoised_chunks(
+        self, samples: np.ndarray, sample_rate: int
+    ) -> typing.Iterator[np.ndarray]:
+        """
+        Denoise a recording chunk by chunk, the chunks overlap by a frame so their edges are discarded.
+        Only as many chunks as there are workers are held in memory
+        parameters
+        ----------
+        samples: np.ndarray
+            The int16 samples, with shape (frames, channels), usually memory-mapped
+        sample_rate: int
+            The sample rate of the samples
+
+        returns
+        -------
+        typing.Iterator[np.ndarray]
+            The denoised int16 chunks, in order
+        """
+        n_fft = self._n_fft(sample_rate)
+        threshold = self.noise_threshold(samples, sample_rate)
+        chunk = int(self._CHUNK_SECONDS * sample_rate)
+
+        def denoise_chunk(start: int) -> np.ndarray:
+            padded_start = max(start - n_fft, 0)
+            end = min(start + chunk, len(samples))
+            padded_end = min(end + n_fft, len(samples))
+            signal = np.asarray(samples[padded_start:padded_end], np.float32) / 32768
+            denoised = self._gate(signal, threshold, n_fft)
+
+            return np.clip(
+                np.rint(denoised[start - padded_start : end - padded_start] * 32768),
+                -32768,
+                32767,
+            ).astype(np.int16)
+
+        starts = list(range(0, len(samples), chunk))
+        if self.workers <= 1:
+            for start in starts:
+                yield denoise_chunk(start)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for index in range(0, len(starts), self.workers):
+                yield from executor.map(
+                    denoise_chunk, starts[index : index + self.workers]
+                )
+
+    def denoise(self, samples: np.ndarray, sample_rate: int) -> np.ndarray:
+        """
+        Denoise a recording held in memory
+        parameters
+        ----------
+        samples: np.ndarray
+            The int16 samples, with shape (frames, channels)
+        sample_rate: int
+            The sample rate of the samples
+
+        returns
+        -------
+        np.ndarray
+            The denoised int16 samples, with the same shape
+        """
+        if len(samples) == 0:
+            return np.array(samples, dtype=np.int16)
+
+        return np.concatenate(list(self._denoised_chunks(samples, sample_rate)))
+
+    def denoise_file(self, audio_file: str, output_file: str) -> None:
+        """
+        Denoise a 16-bit PCM wav file, it is memory-mapped and written chunk by chunk
+        parameters
+        ----------
+        audio_file: str
+            The path to the wav file
+        output_file: str
+            The path to write the denoised wav file to, same sample rate and channels
+        """
+        samples, sample_rate = tarkibi.utilities.wav.read_wav(audio_file)
+        logger.info(
+            f"Tarkibi _SpectralGate: Gating {audio_file}, {len(samples) / sample_rate:.0f}s"
+        )
+        with tarkibi.utilities.wav.open_writer(
+            output_file, samples.shape[1], sample_rate
+        ) as wav_file:
+            for chunk in self._denoised_chunks(samples, sample_rate):
+                tarkibi.utilities.wav.append_frames(wav_file, chunk)
@@ -1,5 +1,6 @@
 import subprocess
 import tarkibi.utilities.general
+import tarkibi.utilities.models
 import os
 from tarkibi.utilities._config import logger
 
@@ -11,6 +12,8 @@ class _Transcription:
     _WHISPER_CPP_REPO = "https://github.com/ggerganov/whisper.cpp.git"
     _TRANSCRIPTION_DIR = f"{tarkibi.utilities.general.BASE_DIR}/whisper.cpp"
     _WHISPER_ARGS = ["--output-txt", "--print-progress", "--no-timestamps"]
+    # files per whisper.cpp run, the model is loaded once per run
+    _BATCH_SIZE = 64
 
     def __init__(self, model: str = _WHISPER_DEFAULT_MODEL) -> None:
         self.model = model
@@ -80,7 +83,76 @@ class _Transcription:
         )
         subprocess.run(make_model_cmd, shell=True)
 
-    def transcribe_file(self, audio_file_path: str, output_name: str) -> None:
+    def _prepare_whisper_cpp(self) -> str:
+        """
+        Clone and build whisper.cpp and download the model, unless they are there already
+
+        returns
+        -------
+        str
+            The path to the model
+        """
+        if not self._check_whisper_cpp_exists():
+            self._clone_whisper_cpp()
+            self._download_and_make_whisper_cpp_model()
+
+        elif not self._check_whisper_cpp_model_exists():
+            self._download_and_make_whisper_cpp_model()
+
+        return self.model_path
+
+    def _whisper_cpp(self) -> str:
+        # threads transcribing at the same time must not build whisper.cpp twice
+        return tarkibi.utilities.models.registry.get(
+            f"whisper_{self.model}", self._prepare_whisper_cpp
+        )
+
+    def warm_up(self) -> None:
+        """
+        Build whisper.cpp and download the model before the first file is transcribed
+        """
+        tarkibi.utilities.models.registry.warm(
+            f"whisper_{self.model}", self._prepare_whisper_cpp
+        )
+
+    def transcribe_files(
+        self, audio_file_paths: list[str], output_names: list[str], output_dir: str
+    ) -> None:
+        """
+        Transcribe several files, whisper.cpp loads the model once per batch of files rather than per file
+        parameters
+        ----------
+        audio_file_paths: list[str]
+            The files to transcribe
+        output_names: list[str]
+            The name of the output file of every file
+        output_dir: str
+            The directory to write the transcriptions to
+
+        returns
+        -------
+        None
+        """
+        self._whisper_cpp()
+
+        for start in range(0, len(audio_file_paths), self._BATCH_SIZE):
+            batch = range(start, min(start + self._BATCH_SIZE, len(audio_file_paths)))
+            # whisper.cpp pairs the nth output file with the nth input file
+            args = self._WHISPER_ARGS + [
+                f"-of {os.path.join(os.path.abspath(output_dir), output_names[index])}"
+                for index in batch
+            ]
+            args_text = " ".join(args)
+            inputs_text = " ".join(
+                os.path.abspath(audio_file_paths[index]) for index in batch
+            )
+
+            transcription_cmd = f"cd .tarkibi/whisper.cpp/ && ./main -m models/ggml-{self.model}.bin {args_text} {inputs_text}"
+            subprocess.run(transcription_cmd, shell=True)
+
+    def transcribe_file(
+        self, audio_file_path: str, output_name: str, output_dir: str = "dataset"
+    ) -> None:
         """
         Transcribe a file
         parameters
@@ -89,22 +161,21 @@ class _Transcription:
             The directory to get the audio files from
         output_name: str
             The name of the output file
+        output_dir: str
+            The directory to write the transcription to
+            Default is 'dataset'
 
         returns
         -------
         None
         """
-        if not self._check_whisper_cpp_exists():
-            self._clone_whisper_cpp()
-            self._download_and_make_whisper_cpp_model()
+        self._whisper_cpp()
 
-        elif not self._check_whisper_cpp_model_exists():
-            self._download_and_make_whisper_cpp_model()
-
-        args = self._WHISPER_ARGS + [f"-of ../../dataset/{output_name}"]
+        output_file = os.path.join(os.path.abspath(output_dir), output_name)
+        args = self._WHISPER_ARGS + [f"-of {output_file}"]
         args_text = " ".join(args)
 
-        transcription_cmd = f"cd .tarkibi/whisper.cpp/ && ./main -m models/ggml-{self.model}.bin {args_text} ../../{audio_file_path}"
+        transcription_cmd = f"cd .tarkibi/whisper.cpp/ && ./main -m models/ggml-{self.model}.bin {args_text} {os.path.abspath(audio_file_path)}"
         subprocess.run(transcription_cmd, shell=True)
 
     def transcribe_file_v2(self, audio_file_path: str, output_path: str):
@@ -121,12 +192,7 @@ class _Transcription:
         -------
         None
         """
-        if not self._check_whisper_cpp_exists():
-            self._clone_whisper_cpp()
-            self._download_and_make_whisper_cpp_model()
-
-        elif not self._check_whisper_cpp_model_exists():
-            self._download_and_make_whisper_cpp_model()
+        self._whisper_cpp()
 
         args = self._WHISPER_ARGS + [f"-of ../../{audio_file_path}"]
         args_text = " ".join(args)
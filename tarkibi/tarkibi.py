@@ -2,11 +2,16 @@ import subprocess
 from datetime import timedelta
 import os
 import shutil
-import itertools
 import wave
-import tarkibi.utilities.general, tarkibi.utilities.youtube, tarkibi.utilities.agent
-import tarkibi.audio.noise_reduction, tarkibi.audio.diarization, tarkibi.audio.speaker_verification, tarkibi.audio.transcription
+import tarkibi.utilities.general, tarkibi.utilities.youtube, tarkibi.utilities.agent, tarkibi.utilities.planner
+import tarkibi.audio.noise_reduction, tarkibi.audio.diarization, tarkibi.audio.speaker_verification, tarkibi.audio.transcription, tarkibi.audio.chunking
+import tarkibi.utilities.pipeline, tarkibi.utilities.manifest, tarkibi.utilities.wav, tarkibi.utilities.ledger, tarkibi.utilities.profiler, tarkibi.utilities.job, tarkibi.utilities.yield_stats, tarkibi.utilities.cache, tarkibi.utilities.scratch, tarkibi.utilities.shards, tarkibi.utilities.models
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import itertools
+import multiprocessing
 import random
+import re
 from tarkibi.utilities._config import logger
 
 logger = logger.getChild(__name__)
@@ -19,26 +24,77 @@ class Tarkibi:
     _AUDIO_FINAL_PATH = f"{_BASE_DIR}/audio_final"
     _AUDIO_NN_PATH = f"{_BASE_DIR}/audio_nn"
     _AUDIO_CLIPS_PATH = f"{_BASE_DIR}/audio_clips"
+    _CACHE_PATH = f"{_BASE_DIR}/cache"
 
     _DURATION_MULTIPLIER = 2.0
 
     _DEFAULT_SAMPLE_RATE = 16000
     _MAX_CLIP_DURATION = 15
     _MIN_CLIP_DURATION = 1
+    # overlap of the windows long recordings are processed in, see chunk_duration
+    _CHUNK_OVERLAP_SECONDS = 20
+    _CLIP_WRITER_THREADS = 4
+    _OUTPUT_FORMATS = ("ljspeech", "sharded")
+
+    # stages of _process_video, in order, with the default number of concurrent workers
+    _STAGE_WORKERS = {
+        "download": 1,
+        "noise_reduction": 1,
+        "diarization": 1,
+        "verification": 1,
+        "split": 1,
+    }
+    # stages running models in-process, these are offloaded to a process pool so every worker has its own
+    _PROCESS_STAGES = ("noise_reduction", "diarization", "verification")
+    # model attributes of the stage components that cached artifacts depend on
+    _CACHED_MODEL_ATTRIBUTES = {
+        "noise_reduction": ("separation_model", "clean_speech_snr"),
+        "diarization": ("_EMBED_MODEL", "_CLUSTER_METHOD"),
+        "verification": ("_NVIDIA_NEMO_MODEL", "verification_mode"),
+        "transcription": ("model",),
+    }
+    # the artifacts each stage is the last to read, removed once the stage is recorded
+    _STAGE_INPUTS = {
+        "noise_reduction": ("raw",),
+        "diarization": ("vocals",),
+        "split": ("speakers",),
+    }
+    # the key of the video item each stage fills in, recorded in the build manifest
+    _STAGE_ARTIFACTS = {
+        "download": "raw",
+        "noise_reduction": "vocals",
+        "diarization": "speakers",
+        "verification": "similar_clips",
+        "split": "clips",
+    }
 
     def __init__(self) -> None:
         self._noise_reduction = tarkibi.audio.noise_reduction._NoiseReduction()
         self._diarization = tarkibi.audio.diarization._Diarization()
         self._speaker_verification = (
-            tarkibi.audio.speaker_verification._SpeakerVerification()
+            tarkibi.audio.speaker_verification._SpeakerVerification(
+                diarization=self._diarization
+            )
         )
         self._transcription = tarkibi.audio.transcription._Transcription()
 
         self._agent = tarkibi.utilities.agent._Agent()
         self._youtube = tarkibi.utilities.youtube._Youtube()
-
-        self._offset = 0
-        self._clips_used = []
+        self._planner = tarkibi.utilities.planner._Planner()
+
+        self._stage_workers = dict(self._STAGE_WORKERS)
+        self._pipeline = None
+        self._running_jobs = []
+
+        self._sample_rate = self._DEFAULT_SAMPLE_RATE
+        self._with_transcription = False
+        self._resample_executor = None
+        # set when long recordings are processed in windows, wraps the audio components
+        self._chunked_audio = None
+        self._cache = None
+        self._scratch = None
+        self._keep_intermediates = False
+        self._profiler = tarkibi.utilities.profiler._Profiler()
 
         tarkibi.utilities.general.make_directories(
             [
@@ -50,73 +106,539 @@ class Tarkibi:
                 self._AUDIO_CLIPS_PATH,
             ]
         )
+        self._yield_stats = tarkibi.utilities.yield_stats._YieldStats(self._BASE_DIR)
 
-    def _convert_time_to_minutes(self, time_str: str) -> float:
+    def _find_closest_combination(
+        self,
+        clips: list[dict[str, str]],
+        target_duration: timedelta,
+        expected_yield: float | None = None,
+    ) -> tuple | list:
         """
-        Function to convert a time string to minutes
+        Function to find the closest combination of audio clips to the target duration
         paramaters
         ----------
-        time_str : str (required)
-            The time string to convert
+        clips : list[dict[str, str]] (required)
+            A dictionary of the audio clips
+        target_duration : timedelta (required)
+            The target duration of the audio clips
+        expected_yield : float (optional)
+            The expected seconds of the speaker per second of video
+            Default is None, 1 / _DURATION_MULTIPLIER is assumed
+
+        returns
+        -------
+        tuple | list
+            The closest combination of audio clips to the target duration
+        """
+        if expected_yield:
+            target_seconds = target_duration.total_seconds() / expected_yield
+        else:
+            target_seconds = target_duration.total_seconds() * self._DURATION_MULTIPLIER
+
+        combination = self._planner.select(clips, target_seconds)
+        if not combination and clips:
+            # every video overshoots a small deficit, take the shortest rather than none
+            combination = self._planner.select(
+                clips,
+                min(
+                    self._planner._convert_time_to_seconds(clip["length"])
+                    for clip in clips
+                ),
+            )
+
+        return combination
+
+    def _offload(self, stage_name: str, fn, *args, audio_path: str | None = None):
+        """
+        Function to run the heavy part of a stage, in the stage's process pool if a pipeline is running
+        paramaters
+        ----------
+        stage_name : str (required)
+            The name of the stage
+        fn : callable (required)
+            The function to run, must be picklable
+        args : any (optional)
+            The arguments to call fn with
+        audio_path : str (optional)
+            The wav file or directory of wav files the call processes, for profiling
+            Default is None
+
+        returns
+        -------
+        any
+            The return value of fn
+        """
+        runner = None
+        if self._pipeline is not None:
+            runner = functools.partial(self._pipeline.offload, stage_name)
+
+        return self._profiler.measure(
+            fn.__name__,
+            fn,
+            *args,
+            audio=(
+                functools.partial(self._audio_seconds, audio_path)
+                if audio_path
+                else None
+            ),
+            runner=runner,
+        )
+
+    def _audio_seconds(self, audio_path: str) -> float:
+        """
+        Function to calculate the duration of a wav file, or of every wav file in a directory
+        paramaters
+        ----------
+        audio_path : str (required)
+            The path to the wav file or directory
 
         returns
         -------
         float
-            The time in minutes
+            The duration in seconds
         """
-        parts = time_str.split(":")
+        if not os.path.isdir(audio_path):
+            return self._single_duration(audio_path)
+
+        return sum(
+            self._single_duration(os.path.join(audio_path, filename))
+            for filename in os.listdir(audio_path)
+            if filename.endswith(".wav")
+        )
+
+    def _download_stage(self, video: dict) -> dict | None:
+        logger.info(f"Tarkibi _process_video: Processing video {video['id']}")
+        job = video["job"]
+        if self._scratch is not None:
+            self._scratch.acquire(self._scratch_key(video))
+
+        # fix age restricted video download error
+        raw_path = f"{job.raw_path}/{video['id']}.wav"
+        key, cached = self._cache_fetch("download", video["id"], job.raw_path)
+        if cached is None:
+            try:
+                self._profiler.measure(
+                    "_download_video_dlc",
+                    self._youtube._download_video_dlc,
+                    video["id"],
+                    job.raw_path,
+                    audio=functools.partial(self._audio_seconds, raw_path),
+                )
+            except Exception as e:
+                logger.error(f"Error downloading video {video['id']}: {e}")
+                return None
+
+            self._cache_store("download", key, [raw_path])
+
+        video["raw"] = raw_path
+        video["downloaded_seconds"] = self._audio_seconds(raw_path)
+        return video
+
+    def _noise_reduction_stage(self, video: dict) -> dict:
+        key, cached = self._cache_fetch(
+            "noise_reduction", video["id"], video["job"].nn_path
+        )
+        if cached is not None:
+            video["vocals"] = cached[0][0]
+            return video
+
+        video["vocals"] = self._offload(
+            "noise_reduction",
+            (self._chunked_audio or self._noise_reduction)._noise_reduction,
+            video["raw"],
+            video["job"].nn_path,
+            audio_path=video["raw"],
+        )
+        self._cache_store("noise_reduction", key, [video["vocals"]])
+        return video
+
+    def _diarization_stage(self, video: dict) -> dict:
+        speakers_dir = f"{video['job'].clips_path}/{video['id']}"
+        key, cached = self._cache_fetch("diarization", video["id"], speakers_dir)
+        if cached is not None:
+            os.makedirs(speakers_dir, exist_ok=True)
+            video["speakers"] = speakers_dir
+            return video
+
+        if self._diarizes_windows_in_parallel():
+            # the recording is split into windows here, the windows are diarized in the stage's processes
+            video["speakers"] = self._profiler.measure(
+                "_diarize_audio_file",
+                self._chunked_audio._diarize_audio_file,
+                video["vocals"],
+                speakers_dir,
+                (
+                    functools.partial(self._pipeline.offload_map, "diarization")
+                    if self._pipeline is not None
+                    else None
+                ),
+                audio=functools.partial(self._audio_seconds, video["vocals"]),
+            )
+        else:
+            video["speakers"] = self._offload(
+                "diarization",
+                (self._chunked_audio or self._diarization)._diarize_audio_file,
+                video["vocals"],
+                speakers_dir,
+                audio_path=video["vocals"],
+            )
+        centroids_path = os.path.join(
+            video["speakers"], self._diarization._CENTROIDS_FILE
+        )
+        self._cache_store(
+            "diarization",
+            key,
+            self._speaker_verification._get_audio_files(video["speakers"])
+            + ([centroids_path] if os.path.exists(centroids_path) else []),
+        )
+        return video
+
+    def _diarizes_windows_in_parallel(self) -> bool:
+        return (
+            self._chunked_audio is not None
+            and self._chunked_audio.diarization_workers is not None
+        )
 
-        if len(parts) == 2:
-            minutes, seconds = map(int, parts)
-            total_minutes = minutes + seconds / 60.0
-        elif len(parts) == 3:
-            hours, minutes, seconds = map(int, parts)
-            total_minutes = hours * 60 + minutes + seconds / 60.0
+    def _verification_stage(self, video: dict) -> dict:
+        reference_audio = video["job"].reference_audio
+        subject = [video["id"]]
+        if self._cache is not None:
+            subject.append(self._cache.file_digest(reference_audio))
+
+        key, cached = self._cache_fetch("verification", subject)
+        if cached is not None:
+            video["similar_clips"] = [
+                os.path.join(video["speakers"], filename) for filename in cached[1]
+            ]
         else:
-            raise ValueError(f"Invalid time string: {time_str}")
+            video["similar_clips"] = self._offload(
+                "verification",
+                (self._chunked_audio or self._speaker_verification)._speaker_verify_dir,
+                video["speakers"],
+                reference_audio,
+                audio_path=video["speakers"],
+            )
+            self._cache_store(
+                "verification",
+                key,
+                value=[os.path.basename(path) for path in video["similar_clips"]],
+            )
 
-        return total_minutes
+        self._record_yield(video)
+        return video
 
-    def _find_closest_combination(
-        self, clips: list[dict[str, str]], target_duration: timedelta
-    ) -> tuple | list:
+    def _cache_params(self, stage_name: str) -> dict:
         """
-        Function to find the closest combination of audio clips to the target duration
+        Function to describe the models and parameters the artifact of a stage depends on, including
+        those of the stages before it for the stages of _process_video
         paramaters
         ----------
-        clips : list[dict[str, str]] (required)
-            A dictionary of the audio clips
-        target_duration : timedelta (required)
-            The target duration of the audio clips
+        stage_name : str (required)
+            The name of the stage
 
         returns
         -------
-        tuple | list
-            The closest combination of audio clips to the target duration
+        dict
+            The parameters, part of the cache key
         """
-        target_minutes = (
-            target_duration.total_seconds() / 60
-        ) * self._DURATION_MULTIPLIER
-        clips.sort(key=lambda x: self._convert_time_to_minutes(x["length"]))
+        components = {
+            "download": self._youtube,
+            "noise_reduction": self._noise_reduction,
+            "diarization": self._diarization,
+            "verification": self._speaker_verification,
+            "transcription": self._transcription,
+        }
+        stage_names = list(self._STAGE_ARTIFACTS)
+        chain = [stage_name]
+        if stage_name in stage_names:
+            chain = stage_names[: stage_names.index(stage_name) + 1]
+
+        params = {}
+        for name in chain:
+            component = components[name]
+            params[name] = {
+                "component": type(component).__name__,
+                **{
+                    attribute: getattr(component, attribute, None)
+                    for attribute in self._CACHED_MODEL_ATTRIBUTES.get(name, ())
+                },
+            }
+
+        if len(chain) > 1 and self._chunked_audio is not None:
+            params["windows"] = [
+                self._chunked_audio.window_seconds,
+                self._chunked_audio.overlap_seconds,
+            ]
+            if "diarization" in chain and self._diarizes_windows_in_parallel():
+                # the number of workers does not change the tracks, how speakers are linked does
+                params["speaker_linking"] = "centroids"
+
+        return params
 
-        closest_combination = []
-        closest_duration = 0
+    def _cache_fetch(
+        self, stage_name: str, subject, destination_dir: str | None = None
+    ) -> tuple[str | None, tuple | None]:
+        """
+        Function to look up the artifact of a stage in the cache
+        paramaters
+        ----------
+        stage_name : str (required)
+            The name of the stage
+        subject : any (required)
+            What the artifact is made from, a video id or the digest of an audio file
+        destination_dir : str (optional)
+            The directory to copy the cached files to
+            Default is None
 
-        for i in range(1, len(clips) + 1):
-            for combination in itertools.combinations(clips, i):
-                total_duration = sum(
-                    self._convert_time_to_minutes(clip["length"])
-                    for clip in combination
+        returns
+        -------
+        tuple[str | None, tuple | None]
+            The cache key, None without a cache, and the cached files and value, None on a miss
+        """
+        if self._cache is None:
+            return None, None
+
+        key = self._cache.key(stage_name, subject, self._cache_params(stage_name))
+        return key, self._cache.fetch(stage_name, key, destination_dir)
+
+    def _cache_store(
+        self, stage_name: str, key: str | None, paths: list[str] = (), value=None
+    ) -> None:
+        if self._cache is not None and key is not None:
+            self._cache.store(stage_name, key, paths, value)
+
+    def _record_yield(self, video: dict) -> None:
+        job = video["job"]
+        if job.author is None:
+            return
+
+        downloaded_seconds = video.get("downloaded_seconds")
+        if downloaded_seconds is None:
+            # resumed after the download stage
+            if not os.path.exists(video["raw"]):
+                return
+            downloaded_seconds = self._audio_seconds(video["raw"])
+
+        verified_seconds = sum(
+            self._single_duration(clip_path) for clip_path in video["similar_clips"]
+        )
+        self._yield_stats.record(
+            job.author,
+            job.queries.get(video["id"]),
+            video["id"],
+            downloaded_seconds,
+            verified_seconds,
+        )
+
+    def _split_stage(self, video: dict) -> dict:
+        video["clips"] = []
+        for clip_path in video["similar_clips"]:
+            video["clips"].extend(
+                self._profiler.measure(
+                    "_split_audio_clips_to_dataset",
+                    self._split_audio_clips_to_dataset,
+                    video["job"],
+                    clip_path,
+                    audio=functools.partial(self._audio_seconds, clip_path),
                 )
+            )
+
+        # stop early once every dataset in the run has its clips
+        if (
+            video["job"].target_reached()
+            and self._pipeline is not None
+            and all(job.target_reached() for job in self._running_jobs)
+        ):
+            self._pipeline.stop()
 
-                if (
-                    total_duration <= target_minutes
-                    and total_duration > closest_duration
-                ):
-                    closest_combination = combination
-                    closest_duration = total_duration
+        return video
+
+    def _artifacts_exist(self, artifacts: dict) -> bool:
+        for value in artifacts.values():
+            paths = value if isinstance(value, list) else [value]
+            if not all(os.path.exists(path) for path in paths):
+                return False
+
+        return True
+
+    def _new_video(self, job: tarkibi.utilities.job._BuildJob, video_id: str) -> dict:
+        """
+        Function to create the pipeline item of a video, resuming from the build manifest when possible
+        paramaters
+        ----------
+        job : _BuildJob (required)
+            The build the video was selected for
+        video_id : str (required)
+            The id of the video
+
+        returns
+        -------
+        dict
+            The video item, stages in 'done' are skipped
+        """
+        video = {"id": video_id, "job": job, "done": set()}
+        manifest = job.manifest
+        if manifest is None:
+            return video
+
+        # resume after the latest completed stage whose artifacts are still on disk
+        stage_names = list(self._STAGE_ARTIFACTS)
+        for index in range(len(stage_names) - 1, -1, -1):
+            artifacts = manifest.completed(video_id, stage_names[index])
+            if artifacts is None or not self._artifacts_exist(artifacts):
+                continue
+
+            for stage_name in stage_names[: index + 1]:
+                video.update(manifest.completed(video_id, stage_name) or {})
+                video["done"].add(stage_name)
+
+            logger.info(
+                f"Tarkibi _new_video: Resuming video {video_id} after stage {stage_names[index]}"
+            )
+            break
 
-        return closest_combination
+        return video
+
+    def _checkpointed_stage(self, stage_name: str, fn, video: dict) -> dict | None:
+        if video["job"].target_reached():
+            logger.info(
+                f"Tarkibi _checkpointed_stage: Dropping video {video['id']} before {stage_name}, target duration reached"
+            )
+            self._discard_video(video)
+            return None
+
+        if stage_name in video["done"]:
+            return video
+
+        try:
+            result = fn(video)
+        except Exception:
+            # the files are kept for a resume, the video just stops counting against the scratch budget
+            if self._scratch is not None:
+                self._scratch.release(self._scratch_key(video))
+            raise
+
+        if result is None:
+            # failed or left nothing to process, a resume must not retry it
+            if video["job"].manifest is not None:
+                video["job"].manifest.record(video["id"], "dropped")
+            self._discard_video(video)
+            return None
+
+        if video["job"].manifest is not None:
+            artifact_key = self._STAGE_ARTIFACTS[stage_name]
+            video["job"].manifest.record(
+                video["id"], stage_name, {artifact_key: video[artifact_key]}
+            )
+
+        self._release_inputs(stage_name, video)
+        return video
+
+    def _scratch_key(self, video: dict) -> str:
+        return f"{video['job'].output_path}:{video['id']}"
+
+    def _discard_artifacts(self, video: dict, artifact_keys: tuple) -> None:
+        """
+        Function to remove intermediate files of a video
+        paramaters
+        ----------
+        video : dict (required)
+            The video item
+        artifact_keys : tuple (required)
+            The keys of the video item holding the files or directories to remove
+
+        returns
+        -------
+        None
+        """
+        if self._keep_intermediates:
+            return
+
+        for artifact_key in artifact_keys:
+            path = video.get(artifact_key)
+            if not path:
+                continue
+
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+
+    def _release_inputs(self, stage_name: str, video: dict) -> None:
+        """
+        Function to remove the files a stage consumed, as soon as the stage is recorded
+        paramaters
+        ----------
+        stage_name : str (required)
+            The name of the stage that finished
+        video : dict (required)
+            The video item
+
+        returns
+        -------
+        None
+        """
+        if stage_name == "verification" and not self._keep_intermediates:
+            similar_clips = set(video["similar_clips"])
+            for track in self._speaker_verification._get_audio_files(video["speakers"]):
+                if track not in similar_clips:
+                    os.remove(track)
+
+        self._discard_artifacts(video, self._STAGE_INPUTS.get(stage_name, ()))
+        if stage_name == list(self._STAGE_ARTIFACTS)[-1] and self._scratch is not None:
+            self._scratch.release(self._scratch_key(video))
+
+    def _discard_video(self, video: dict) -> None:
+        self._discard_artifacts(video, ("raw", "vocals", "speakers"))
+        if self._scratch is not None:
+            self._scratch.release(self._scratch_key(video))
+
+    def _build_stages(self, stage_workers: dict[str, int] | None = None) -> list:
+        """
+        Function to build the stages of _process_video for the pipeline
+        paramaters
+        ----------
+        stage_workers : dict[str, int] (optional)
+            The number of workers per stage
+            Default is None, the workers set on the instance
+
+        returns
+        -------
+        list[_Stage]
+            The pipeline stages, in order
+        """
+        stage_fns = {
+            "download": self._download_stage,
+            "noise_reduction": self._noise_reduction_stage,
+            "diarization": self._diarization_stage,
+            "verification": self._verification_stage,
+            "split": self._split_stage,
+        }
+        # with diarization_workers the stage threads split recordings into windows and the stage processes
+        # diarize the windows, there are diarization_workers diarizers however many threads there are
+        stage_processes = {}
+        if self._diarizes_windows_in_parallel():
+            stage_processes["diarization"] = self._chunked_audio.diarization_workers
+
+        # models loaded when the pipeline starts rather than by the first video
+        stage_warm_ups = {
+            "noise_reduction": self._noise_reduction.warm_up,
+            "diarization": self._diarization.warm_up,
+            "verification": self._speaker_verification.warm_up,
+        }
+
+        return [
+            tarkibi.utilities.pipeline._Stage(
+                name,
+                functools.partial(self._checkpointed_stage, name, fn),
+                workers=(stage_workers or self._stage_workers)[name],
+                use_processes=name in self._PROCESS_STAGES,
+                warm_up=stage_warm_ups.get(name),
+                processes=stage_processes.get(name),
+            )
+            for name, fn in stage_fns.items()
+        ]
 
     def _process_video(
         self,
@@ -144,31 +666,29 @@ class Tarkibi:
         dict[str, list] | None
             The audio groups
         """
-        logger.info(f"Tarkibi _process_video: Processing video {video_id}")
-        wav_file = f"{self._AUDIO_RAW_PATH}/{video_id}.wav"
-        # fix age restricted video download error
-        try:
-            self._youtube._download_video_dlc(video_id, self._AUDIO_RAW_PATH)
-        except Exception as e:
-            logger.error(f"Error downloading video {video_id}: {e}")
-            return
-
-        nr_output_path = self._noise_reduction._noise_reduction(
-            wav_file, self._AUDIO_NN_PATH
-        )
-
-        ac_output_path = self._diarization._diarize_audio_file(
-            nr_output_path, f"{self._AUDIO_CLIPS_PATH}/{video_id}"
-        )
-
-        similar_clips = self._speaker_verification._speaker_verify_dir(
-            ac_output_path, reference_path
+        job = tarkibi.utilities.job._BuildJob(
+            None, reference_path, None, output_path=os.path.dirname(wav_output_dir)
         )
+        job.wav_output_dir = wav_output_dir
+        # continue the numbering of clips already in the directory
+        clip_ids = [
+            int(filename.split(".")[0])
+            for filename in os.listdir(wav_output_dir)
+            if filename.endswith(".wav") and filename.split(".")[0].isdigit()
+        ]
+        job.offset = max(clip_ids) + 1 if clip_ids else 0
 
-        for clip_path in similar_clips:
-            self._split_audio_clips_to_dataset(wav_output_dir, clip_path)
+        video = self._new_video(job, video_id)
+        self._keep_intermediates = debug_mode
+        try:
+            for stage in self._build_stages():
+                video = stage.fn(video)
+                if video is None:
+                    return
+        finally:
+            self._keep_intermediates = False
 
-        return similar_clips
+        return video["similar_clips"]
 
     def _single_duration(self, audio_file: str) -> float:
         """
@@ -188,35 +708,42 @@ class Tarkibi:
 
         return duration
 
-    def _total_duration(self, audio_directory: str) -> float:
+    def _plan_clip_windows(self, total_duration: float) -> list[tuple[float, float]]:
         """
-        Function to calculate the total duration of a directory of audio files
+        Function to pick random clip windows from an audio file
         paramaters
         ----------
-        audio_directory : str (required)
-            The path to the directory containing the audio files
+        total_duration : float (required)
+            The duration of the audio file in seconds
 
         returns
         -------
-        float
-            The total duration of the audio files
+        list[tuple[float, float]]
+            The (start time, duration) of every clip
         """
-        total_duration = 0
-        for filename in os.listdir(audio_directory):
-            if filename.endswith(".wav"):
-                total_duration += self._single_duration(f"{audio_directory}/{filename}")
+        windows = []
+        while total_duration > self._MIN_CLIP_DURATION:
+            clip_duration = random.uniform(
+                self._MIN_CLIP_DURATION, self._MAX_CLIP_DURATION
+            )
+            clip_duration = min(clip_duration, total_duration)
+
+            start_time = random.uniform(0, total_duration - clip_duration)
+            windows.append((start_time, clip_duration))
+
+            total_duration -= clip_duration
 
-        return total_duration
+        return windows
 
     def _split_audio_clips_to_dataset(
-        self, output_path: str, audio_file: str
+        self, job: tarkibi.utilities.job._BuildJob, audio_file: str
     ) -> list[str]:
         """
         Function to split an audio file into clips and add the clips to the dataset
         paramaters
         ----------
-        output_path : str (required)
-            The path to the dataset
+        job : _BuildJob (required)
+            The build the clips are added to
         audio_file : str (required)
             The path to the audio file to split
 
@@ -228,18 +755,164 @@ class Tarkibi:
         logger.info(
             f"Tarkibi _split_audio_clips_to_dataset: Splitting audio file {audio_file} to dataset"
         )
-        total_duration = self._single_duration(audio_file)
+        windows = self._plan_clip_windows(self._single_duration(audio_file))
+        offset, windows = job.reserve_clips(windows)
+        output_files = [
+            os.path.join(job.wav_output_dir, f"{clip_id:05d}.wav")
+            for clip_id in range(offset, offset + len(windows))
+        ]
 
-        output_files = []
-        while total_duration > self._MIN_CLIP_DURATION:
-            clip_duration = random.uniform(
-                self._MIN_CLIP_DURATION, self._MAX_CLIP_DURATION
+        try:
+            if tarkibi.utilities.wav.is_pcm16_wav(audio_file):
+                durations = self._cut_clips_in_process(
+                    job, audio_file, windows, output_files
+                )
+            else:
+                durations = self._cut_clips_ffmpeg(
+                    job, audio_file, windows, output_files
+                )
+        except Exception:
+            # none of the clips reach the ledger, so they must not count towards the target either
+            job.release_clips(windows)
+            raise
+
+        if job.shards is not None:
+            for output_file in output_files:
+                job.shards.add_file(output_file)
+                # the staged wav is only needed to transcribe the clip
+                if not self._with_transcription and not self._keep_intermediates:
+                    os.remove(output_file)
+
+        if job.ledger is not None:
+            job.ledger.add(dict(zip(output_files, durations)))
+
+        return output_files
+
+    def _clip_outputs(
+        self, job: tarkibi.utilities.job._BuildJob, output_file: str
+    ) -> list[tuple[str, int]]:
+        """
+        Function to list the files to write for a clip, the dataset clip at the target sample rate
+        and, when transcribing at another rate, a 16kHz copy for whisper.cpp
+        paramaters
+        ----------
+        job : _BuildJob (required)
+            The build the clip belongs to
+        output_file : str (required)
+            The path of the clip in the dataset
+
+        returns
+        -------
+        list[tuple[str, int]]
+            The path and sample rate of every file to write
+        """
+        outputs = [(output_file, self._sample_rate)]
+        if self._with_transcription and self._sample_rate != self._DEFAULT_SAMPLE_RATE:
+            outputs.append(
+                (
+                    self._transcription_source(job, output_file),
+                    self._DEFAULT_SAMPLE_RATE,
+                )
             )
-            clip_duration = min(clip_duration, total_duration)
 
-            start_time = random.uniform(0, total_duration - clip_duration)
+        return outputs
+
+    def _transcription_source(
+        self, job: tarkibi.utilities.job._BuildJob, audio_file: str
+    ) -> str:
+        """
+        Function to get the 16kHz file whisper.cpp transcribes for a dataset clip
+        paramaters
+        ----------
+        job : _BuildJob (required)
+            The build the clip belongs to
+        audio_file : str (required)
+            The path of the clip in the dataset
+
+        returns
+        -------
+        str
+            The path of the 16kHz clip
+        """
+        if self._sample_rate == self._DEFAULT_SAMPLE_RATE:
+            return audio_file
+
+        return f"{job.final_path}/{os.path.basename(audio_file)}"
+
+    def _cut_clips_in_process(
+        self,
+        job: tarkibi.utilities.job._BuildJob,
+        audio_file: str,
+        windows: list[tuple[float, float]],
+        output_files: list[str],
+    ) -> list[float]:
+        """
+        Function to cut clips from a 16-bit PCM wav file, the file is memory-mapped and every clip is resampled
+        straight to the target sample rate, on the resample process pool if there is one
+        paramaters
+        ----------
+        job : _BuildJob (required)
+            The build the clips belong to
+        audio_file : str (required)
+            The path to the audio file to cut
+        windows : list[tuple[float, float]] (required)
+            The (start time, duration) of every clip
+        output_files : list[str] (required)
+            The path to write every clip to
+
+        returns
+        -------
+        list[float]
+            The duration of every clip written
+        """
+        start_times = [start_time for start_time, _ in windows]
+        clip_durations = [clip_duration for _, clip_duration in windows]
+        outputs = [self._clip_outputs(job, output_file) for output_file in output_files]
+        args = (
+            itertools.repeat(audio_file),
+            start_times,
+            clip_durations,
+            outputs,
+        )
+
+        if self._resample_executor is not None:
+            return list(
+                self._resample_executor.map(tarkibi.utilities.wav.cut_clip, *args)
+            )
+
+        with ThreadPoolExecutor(max_workers=self._CLIP_WRITER_THREADS) as executor:
+            return list(executor.map(tarkibi.utilities.wav.cut_clip, *args))
+
+    def _cut_clips_ffmpeg(
+        self,
+        job: tarkibi.utilities.job._BuildJob,
+        audio_file: str,
+        windows: list[tuple[float, float]],
+        output_files: list[str],
+    ) -> list[float]:
+        """
+        Function to cut clips from any audio file ffmpeg can read, one ffmpeg process per clip
+        paramaters
+        ----------
+        job : _BuildJob (required)
+            The build the clips belong to
+        audio_file : str (required)
+            The path to the audio file to cut
+        windows : list[tuple[float, float]] (required)
+            The (start time, duration) of every clip
+        output_files : list[str] (required)
+            The path to write every clip to
+
+        returns
+        -------
+        list[float]
+            The duration of every clip written
+        """
+        for (start_time, clip_duration), output_file in zip(windows, output_files):
+            output_args = []
+            for path, sample_rate in self._clip_outputs(job, output_file):
+                output_args.extend(["-ar", str(sample_rate), "-c:a", "pcm_s16le", path])
 
-            output_file = os.path.join(output_path, f"{self._offset:05d}.wav")
             subprocess.run(
                 [
                     "ffmpeg",
@@ -249,45 +922,37 @@ class Tarkibi:
                     audio_file,
                     "-t",
                     str(clip_duration),
-                    "-ar",
-                    str(self._DEFAULT_SAMPLE_RATE),
-                    "-c:a",
-                    "pcm_s16le",
-                    output_file,
+                    *output_args,
                 ],
                 capture_output=True,
                 text=True,
             )
 
-            total_duration -= clip_duration
-            self._offset += 1
-            output_files.append(output_file)
-
-        return output_files
+        return [clip_duration for _, clip_duration in windows]
 
     def _deep_clean(self) -> None:
         items = os.listdir(self._BASE_DIR)
         for item in items:
             item_path = os.path.join(self._BASE_DIR, item)
 
-            if os.path.isdir(item_path) and item != "whisper.cpp":
+            if os.path.isdir(item_path) and item not in (
+                "whisper.cpp",
+                os.path.basename(self._CACHE_PATH),
+            ):
                 shutil.rmtree(item_path, ignore_errors=True)
 
-    def _format_transcription_ljspeech(
-        self, transcription_directory: str, dataset_path: str
-    ) -> None:
+    def _read_transcriptions(self, transcription_directory: str) -> dict[str, str]:
         """
-        Function to format the transcription files to the LJSpeech format
+        Function to read and remove the transcription files written by whisper.cpp
         paramaters
         ----------
         transcription_directory : str (required)
             The path to the directory containing the transcription files
-        dataset_path : str (required)
-            The path to the dataset
 
         returns
         -------
-        None
+        dict[str, str]
+            The text of every clip, keyed by clip id and ordered by clip id
         """
         transcription_files = []
         for root, _, files in os.walk(transcription_directory):
@@ -299,59 +964,264 @@ class Tarkibi:
             transcription_files, key=lambda x: int(x.split("/")[-1].split(".")[0])
         )
 
+        transcriptions = {}
+        for file in sorted_transcription_files:
+            file_id = file.split("/")[-1].split(".")[0]
+            with open(file) as g:
+                file_content = g.read()
+                file_content = file_content.replace("\n", " ")
+
+            transcriptions[file_id] = file_content[1:]
+            os.remove(file)
+
+        return transcriptions
+
+    def _format_transcription_ljspeech(
+        self, transcription_directory: str, dataset_path: str
+    ) -> None:
+        """
+        Function to format the transcription files to the LJSpeech format
+        paramaters
+        ----------
+        transcription_directory : str (required)
+            The path to the directory containing the transcription files
+        dataset_path : str (required)
+            The path to the dataset
+
+        returns
+        -------
+        None
+        """
+        transcriptions = self._read_transcriptions(transcription_directory)
+
         with open(f"{dataset_path}/metadata.txt", "w") as metadata_file:
-            for file in sorted_transcription_files:
-                file_id = file.split("/")[-1].split(".")[0]
-                with open(file) as g:
-                    file_content = g.read()
-                    file_content = file_content.replace("\n", " ")
+            for file_id, text in transcriptions.items():
+                metadata_file.write(f"{file_id}|{text}\n")
 
-                metadata_file.write(f"{file_id}|{file_content[1:]}\n")
-                os.remove(file)
+    def _restore_staged_clips(
+        self, job: tarkibi.utilities.job._BuildJob, audio_files: list[str]
+    ) -> None:
+        """
+        Function to write back the staged wavs of a sharded dataset that were removed, for transcription
+        paramaters
+        ----------
+        job : _BuildJob (required)
+            The sharded build
+        audio_files : list[str] (required)
+            The paths of the staged wavs
 
-    def _transcribe_files(self, audio_files: list[str]) -> None:
+        returns
+        -------
+        None
+        """
+        for audio_file in audio_files:
+            if not os.path.exists(audio_file):
+                samples, sample_rate = job.shards.read(
+                    os.path.basename(audio_file).split(".")[0]
+                )
+                tarkibi.utilities.wav.write_wav(audio_file, samples, sample_rate)
+
+    def _transcribe_files(
+        self, job: tarkibi.utilities.job._BuildJob, audio_files: list[str]
+    ) -> None:
+        pending = []
         for audio_file in audio_files:
             output_name = audio_file.split("/")[-1].split(".")[0]
-            self._transcription.transcribe_file(audio_file, output_name)
+            transcription_source = self._transcription_source(job, audio_file)
+            if not os.path.exists(transcription_source):
+                # clips from an earlier run, their copy was cleaned up with .tarkibi
+                samples, sample_rate = tarkibi.utilities.wav.read_wav(audio_file)
+                tarkibi.utilities.wav.write_wav(
+                    transcription_source,
+                    tarkibi.utilities.wav.resample(
+                        samples, sample_rate, self._DEFAULT_SAMPLE_RATE
+                    ),
+                    self._DEFAULT_SAMPLE_RATE,
+                )
 
-    def _collect_audio_clips(
-        self,
-        author: str,
-        target_duration: timedelta,
-        reference_audio: str,
-        wav_output_dir: str,
-    ) -> list[str]:
+            transcript_path = f"{job.output_path}/{output_name}.txt"
+            subject = None
+            if self._cache is not None:
+                subject = self._cache.file_digest(transcription_source)
+            key, cached = self._cache_fetch("transcription", subject)
+            if cached is not None:
+                with open(transcript_path, "w") as transcript_file:
+                    transcript_file.write(cached[1])
+                continue
+
+            pending.append((audio_file, transcription_source, output_name, key))
+
+        if not pending:
+            return
+
+        # one whisper.cpp run per batch of clips, so the model is not loaded for every clip
+        transcription_sources = [source for _, source, _, _ in pending]
+        self._profiler.measure(
+            "transcribe_files",
+            self._transcription.transcribe_files,
+            transcription_sources,
+            [output_name for _, _, output_name, _ in pending],
+            job.output_path,
+            audio=lambda: sum(
+                self._audio_seconds(source) for source in transcription_sources
+            ),
+        )
+
+        for audio_file, transcription_source, output_name, key in pending:
+            transcript_path = f"{job.output_path}/{output_name}.txt"
+            if key is not None and os.path.exists(transcript_path):
+                with open(transcript_path) as transcript_file:
+                    self._cache_store(
+                        "transcription", key, value=transcript_file.read()
+                    )
+
+            if transcription_source != audio_file and not self._keep_intermediates:
+                os.remove(transcription_source)
+
+    def _collect_audio_clips(self, job: tarkibi.utilities.job._BuildJob) -> list[str]:
         """
-        Function to collect audio clips for a particular person
+        Function to select the videos to collect audio clips from for a particular person
         paramaters
         ----------
-        author : str (required)
-            The name of the person to collect audio clips for
-        target_duration : timedelta (required)
-            The target duration of the audio clips
-        reference_audio : str (required)
-            The path to the reference audio file to compare the audio clips to
-        wav_output_dir : str (required)
-            The path to save the audio clips to
+        job : _BuildJob (required)
+            The build to collect audio clips for
 
         returns
         -------
         list[str]
-            A list of the audio clips collected
+            The ids of the videos selected
         """
+        deficit = timedelta(seconds=job.remaining_seconds())
         logger.info(
-            f"Tarkibi _collect_audio_clips: Collecting audio clips for {author} with target duration {target_duration}"
+            f"Tarkibi _collect_audio_clips: Collecting audio clips for {job.author}, {deficit} of {job.target_duration} left"
         )
-        search_query = self._agent._generate_search_query(author)
+        search_query = self._agent._generate_search_query(job.author)
         videos = self._youtube._search(search_query)
 
-        if self._clips_used:
-            videos = [video for video in videos if video["id"] not in self._clips_used]
+        if job.clips_used:
+            videos = [video for video in videos if video["id"] not in job.clips_used]
+
+        # size the round from the yield seen so far, for this query if possible
+        expected_yield = self._yield_stats.estimate(job.author, search_query)
+        logger.info(
+            f"Tarkibi _collect_audio_clips: Expected yield {expected_yield}, yield of this run {self._yield_stats.run_yield(job.author)}"
+        )
 
-        closest_combination = self._find_closest_combination(videos, target_duration)
+        closest_combination = self._find_closest_combination(
+            videos, deficit, expected_yield
+        )
         for video in closest_combination:
-            self._clips_used.append(video["id"])
-            self._process_video(video["id"], reference_audio, wav_output_dir)
+            job.clips_used.append(video["id"])
+            job.queries[video["id"]] = search_query
+            if job.manifest is not None:
+                job.manifest.record(video["id"], "selected")
+
+        return [video["id"] for video in closest_combination]
+
+    def _interleave(
+        self, selections: list[tuple[tarkibi.utilities.job._BuildJob, list[str]]]
+    ) -> list[tuple[tarkibi.utilities.job._BuildJob, str]]:
+        """
+        Function to interleave the videos of several builds, so every build keeps the stages busy
+        paramaters
+        ----------
+        selections : list[tuple[_BuildJob, list[str]]] (required)
+            The build and the ids of its videos, per build
+
+        returns
+        -------
+        list[tuple[_BuildJob, str]]
+            The build and id of every video, taking one video from each build in turn
+        """
+        rounds = itertools.zip_longest(
+            *[
+                [(job, video_id) for video_id in video_ids]
+                for job, video_ids in selections
+            ]
+        )
+        return [item for item in itertools.chain.from_iterable(rounds) if item]
+
+    def _run_pipeline(
+        self, videos: list[tuple[tarkibi.utilities.job._BuildJob, str]]
+    ) -> list[dict]:
+        """
+        Function to process videos concurrently through the stages of _process_video
+        paramaters
+        ----------
+        videos : list[tuple[_BuildJob, str]] (required)
+            The build and id of every video to process
+
+        returns
+        -------
+        list[dict]
+            The processed video items
+        """
+        items = (self._new_video(job, video_id) for job, video_id in videos)
+        self._running_jobs = list({id(job): job for job, _ in videos}.values())
+        try:
+            if self._pipeline is not None:
+                return self._pipeline.run(items)
+
+            with tarkibi.utilities.pipeline._Pipeline(self._build_stages()) as pipeline:
+                self._pipeline = pipeline
+                try:
+                    return pipeline.run(items)
+                finally:
+                    self._pipeline = None
+        finally:
+            # videos skipped by a stopped or failed run never release their slot
+            if self._scratch is not None:
+                self._scratch.reset()
+
+    def _restore_from_manifest(self, job: tarkibi.utilities.job._BuildJob) -> list[str]:
+        """
+        Function to restore the build state from the manifest of a previous run
+        paramaters
+        ----------
+        job : _BuildJob (required)
+            The build to restore, its manifest must be loaded
+
+        returns
+        -------
+        list[str]
+            The ids of the videos that were selected but not finished
+        """
+        existing_clips = [
+            os.path.join(job.wav_output_dir, filename)
+            for filename in sorted(os.listdir(job.wav_output_dir))
+            if filename.endswith(".wav")
+        ]
+
+        recorded_clips = {os.path.basename(path) for path in job.manifest.clip_paths()}
+        if not job.manifest and job.shards is None:
+            # adopt clips from builds that predate the manifest
+            if existing_clips:
+                job.manifest.record(None, "existing", {"clips": existing_clips})
+        else:
+            for clip_path in existing_clips:
+                if os.path.basename(clip_path) not in recorded_clips:
+                    # written by a split that never completed, it will be redone
+                    os.remove(clip_path)
+
+        clip_ids = [
+            int(os.path.basename(path).split(".")[0])
+            for path in job.manifest.clip_paths()
+        ]
+        job.offset = max(clip_ids) + 1 if clip_ids else 0
+        job.clips_used = job.manifest.videos("selected")
+        if job.shards is not None:
+            job.shards.retain({clip_name.split(".")[0] for clip_name in recorded_clips})
+
+        finished = set(job.manifest.videos("split")) | set(
+            job.manifest.videos("dropped")
+        )
+        pending = [video_id for video_id in job.clips_used if video_id not in finished]
+        if pending:
+            logger.info(
+                f"Tarkibi _restore_from_manifest: Resuming {len(pending)} unfinished videos for {job.author}"
+            )
+
+        return pending
 
     def _create_dataset_dirs(self, output_path: str, wav_file_output_path: str) -> None:
         if not os.path.exists(output_path):
@@ -360,39 +1230,302 @@ class Tarkibi:
         if not os.path.exists(wav_file_output_path):
             os.mkdir(wav_file_output_path)
 
-    def _update_sample_rate(
-        self, output_path: str, sample_rate: int, all_output_files: list[str]
-    ):
+    def _prepare_job(self, job: tarkibi.utilities.job._BuildJob) -> list[str]:
         """
-        Function to update the sample rate of the dataset
+        Function to create the directories of a build and load its manifest and duration ledger
         paramaters
         ----------
-        output_path : str (required)
-            The path to the dataset
-        sample_rate : int (required)
-            The sample rate to update to
-        all_output_files : list[str] (required)
-            A list of all the audio files in the dataset
+        job : _BuildJob (required)
+            The build to prepare
+
+        returns
+        -------
+        list[str]
+            The ids of the videos a previous run selected but did not finish
+        """
+        logger.info(
+            f"Tarkibi _build_dataset: Building dataset for {job.author} with target duration {job.target_duration}"
+        )
+        tarkibi.utilities.general.make_directories(
+            [job.raw_path, job.nn_path, job.clips_path, job.final_path]
+        )
+        if job.output_format == "sharded":
+            tarkibi.utilities.general.make_directories([job.wav_output_dir])
+            job.shards = tarkibi.utilities.shards._ShardedDataset(job.shard_path)
+        self._create_dataset_dirs(job.output_path, job.wav_output_dir)
+
+        job.manifest = tarkibi.utilities.manifest._Manifest(job.output_path)
+        pending_videos = self._restore_from_manifest(job)
+        job.ledger = tarkibi.utilities.ledger._DurationLedger(job.output_path)
+        if job.shards is not None:
+            # the shard index is the record of the clips, the staged wavs come and go
+            job.ledger.reset(job.shards.durations())
+        else:
+            job.ledger.reconcile(job.wav_output_dir, self._single_duration)
+        job.planned_seconds = job.ledger.total
+
+        return pending_videos
+
+    def _finish_job(self, job: tarkibi.utilities.job._BuildJob) -> None:
+        all_output_files = job.ledger.clip_paths(job.wav_output_dir)
+
+        if job.shards is not None:
+            transcriptions = {}
+            if self._with_transcription:
+                self._restore_staged_clips(job, all_output_files)
+                self._transcribe_files(job, all_output_files)
+                transcriptions = self._read_transcriptions(job.output_path)
+            job.shards.write_metadata(transcriptions)
+        elif self._with_transcription:
+            self._transcribe_files(job, all_output_files)
+            self._format_transcription_ljspeech(job.output_path, job.output_path)
+
+        self._profiler.export(job.output_path)
+        if self._cache is not None:
+            self._cache.export(job.output_path)
+
+    def _job_work_dir(self, output_path: str, batch_size: int) -> str:
+        if batch_size == 1:
+            return self._BASE_DIR
+
+        # intermediate files of different speakers must not share a directory
+        slug = re.sub(r"[^A-Za-z0-9_-]+", "_", os.path.normpath(output_path))
+        return f"{self._BASE_DIR}/jobs/{slug.strip('_')}"
+
+    def build_datasets(
+        self,
+        jobs: list[tuple[str, str, timedelta, str]],
+        sample_rate: int = _DEFAULT_SAMPLE_RATE,
+        with_transcription: bool = True,
+        stage_workers: dict[str, int] | None = None,
+        resample_workers: int | None = None,
+        profile: bool = False,
+        chunk_duration: timedelta | None = None,
+        cache_budget: int | None = None,
+        scratch_budget: int | None = None,
+        output_format: str = "ljspeech",
+        clean_speech_snr: float | None = None,
+        noise_reduction_backend: str = "auto",
+        gate_workers: int | None = None,
+        diarization_workers: int | None = None,
+        verification_mode: str = "titanet",
+    ) -> None:
+        """
+        Function to build LJSpeech-like datasets for several people in one batch. The models and stage workers
+        are shared by every dataset and the videos of different people go through the stages together.
+        paramaters
+        ----------
+        jobs : list[tuple[str, str, timedelta, str]] (required)
+            The author, reference audio, target duration and output path of every dataset,
+            output paths must be different
+        sample_rate : int (optional)
+            The sample rate of the datasets
+            Default is 16000 (i.e. 16kHz)
+        with_transcription : bool (optional)
+            Whether to transcribe the datasets or not
+            Default is True
+        stage_workers : dict[str, int] (optional)
+            The number of concurrent workers per stage, any of 'download', 'noise_reduction',
+            'diarization', 'verification' and 'split'
+            Default is one worker per stage
+        resample_workers : int (optional)
+            The number of processes cutting and resampling clips, shared by every split
+            Default is None, clips are cut on threads of the split stage
+        profile : bool (optional)
+            Whether to record the time and memory of every stage call, written to
+            tarkibi_profile.json and a Chrome trace, tarkibi_trace.json, in every output path.
+            The profile covers the whole batch
+            Default is False
+        chunk_duration : timedelta (optional)
+            Recordings longer than this are separated, diarized and verified in overlapping windows of
+            this length, which bounds memory use on multi-hour videos
+            Default is None, recordings are processed whole
+        cache_budget : int (optional)
+            The disk space in bytes for a cache of downloads, vocals, speaker tracks, verification results
+            and transcripts kept in .tarkibi/cache across builds, the least recently used entries are
+            evicted first. Hits and misses are written to tarkibi_cache.json in the output path
+            Default is None, nothing is cached
+        scratch_budget : int (optional)
+            The disk space in bytes the intermediate files in .tarkibi may use, downloads wait while the
+            videos in progress are near the limit
+            Default is None, downloads are not throttled
+        output_format : str (optional)
+            'ljspeech' for a wav per clip and metadata.txt, 'sharded' for clips packed into memory-mappable
+            shards with columnar metadata in the shards directory of every output path, see
+            tarkibi.utilities.shards for the exporters between the two
+            Default is 'ljspeech'
+        clean_speech_snr : float (optional)
+            Recordings, or windows of them with chunk_duration, whose estimated SNR in dB is at least this and
+            that have no music under the speech skip vocal separation. Every decision is logged with its
+            measurements, 30 is a reasonable start
+            Default is None, every recording is separated
+        noise_reduction_backend : str (optional)
+            How vocals are isolated, 'spectral_gate' for a light NumPy denoiser suited to steady background
+            noise, 'resident' or 'cli' to force how Spleeter is run, 'auto' for Spleeter in-process with the
+            CLI as fallback
+            Default is 'auto'
+        gate_workers : int (optional)
+            The number of threads gating chunks of a recording at the same time, needs the 'spectral_gate'
+            noise_reduction_backend. Every noise_reduction worker runs this many threads
+            Default is None, chunks are gated one after the other
+        diarization_workers : int (optional)
+            The number of processes diarizing windows at the same time, needs chunk_duration. They are the
+            processes of the diarization stage, its stage_workers only split recordings into windows, so
+            there are this many diarizers in total. Speakers are then linked across windows by their
+            x-vector centroids
+            Default is None, windows are diarized one after the other
+        verification_mode : str (optional)
+            'centroid' keeps the x-vector centroid of every diarized speaker and compares it to the
+            reference, only speakers too close to call are verified with TitaNet. 'sampled' verifies a
+            few random windows of every speaker track with TitaNet, longest first, and only samples more
+            windows of a track while its scores are too close to call. 'titanet' verifies every speaker track
+            with TitaNet
+            Default is 'titanet'
 
         returns
         -------
         None
         """
-        final_path = f"{output_path}/wavs"
-        temp_path = f"{output_path}/wavs_temp"
+        if output_format not in self._OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format: {output_format}")
+
+        if (
+            noise_reduction_backend
+            not in tarkibi.audio.noise_reduction._NoiseReduction._BACKENDS
+        ):
+            raise ValueError(
+                f"Unknown noise reduction backend: {noise_reduction_backend}"
+            )
 
-        os.makedirs(temp_path)
-        for file in all_output_files:
-            file_id = file.split("/")[-1]
-            subprocess.run(
-                f"ffmpeg -i {file} -ar {str(sample_rate)} {temp_path}/{file_id}",
-                shell=True,
+        if (
+            verification_mode
+            not in tarkibi.audio.speaker_verification._SpeakerVerification._VERIFICATION_MODES
+        ):
+            raise ValueError(f"Unknown verification mode: {verification_mode}")
+
+        if gate_workers is not None:
+            if noise_reduction_backend != "spectral_gate":
+                raise ValueError(
+                    "gate_workers needs the spectral_gate noise reduction backend"
+                )
+            if gate_workers < 1:
+                raise ValueError(
+                    f"gate_workers needs at least one worker, got {gate_workers}"
+                )
+
+        if diarization_workers is not None:
+            if not chunk_duration:
+                raise ValueError("diarization_workers needs chunk_duration")
+            if diarization_workers < 1:
+                raise ValueError(
+                    f"diarization_workers needs at least one worker, got {diarization_workers}"
+                )
+
+        if stage_workers:
+            unknown_stages = set(stage_workers) - set(self._STAGE_WORKERS)
+            if unknown_stages:
+                raise ValueError(f"Unknown pipeline stages: {sorted(unknown_stages)}")
+        # workers of this build only, later builds start from the defaults again
+        stage_workers = {**self._stage_workers, **(stage_workers or {})}
+
+        output_paths = [os.path.abspath(output_path) for *_, output_path in jobs]
+        if len(set(output_paths)) != len(output_paths):
+            raise ValueError("Every dataset in a batch needs its own output path")
+
+        build_jobs = [
+            tarkibi.utilities.job._BuildJob(
+                author,
+                reference_audio,
+                target_duration,
+                output_path,
+                work_dir=self._job_work_dir(output_path, len(jobs)),
+                min_clip_duration=self._MIN_CLIP_DURATION,
+                output_format=output_format,
             )
+            for author, reference_audio, target_duration, output_path in jobs
+        ]
 
-            os.remove(file)
-            shutil.move(f"{temp_path}/{file_id}", f"{final_path}/{file_id}")
+        self._profiler = tarkibi.utilities.profiler._Profiler(enabled=profile)
+        logger.info(f"Tarkibi build_datasets: Building {len(build_jobs)} datasets")
+        pending_videos = [(job, self._prepare_job(job)) for job in build_jobs]
+
+        self._sample_rate = sample_rate
+        self._with_transcription = with_transcription
+        self._scratch = None
+        if scratch_budget:
+            self._scratch = tarkibi.utilities.scratch._ScratchBudget(
+                scratch_budget,
+                [
+                    path
+                    for job in build_jobs
+                    for path in (
+                        job.raw_path,
+                        job.nn_path,
+                        job.clips_path,
+                        job.final_path,
+                    )
+                ],
+            )
+
+        self._cache = None
+        if cache_budget:
+            self._cache = tarkibi.utilities.cache._ArtifactCache(
+                self._CACHE_PATH, cache_budget
+            )
+
+        self._noise_reduction.clean_speech_snr = clean_speech_snr
+        self._noise_reduction.backend = noise_reduction_backend
+        self._noise_reduction.gate_workers = gate_workers or 1
+        self._speaker_verification.verification_mode = verification_mode
+        self._diarization.keep_centroids = verification_mode == "centroid"
+
+        self._chunked_audio = None
+        if chunk_duration:
+            self._chunked_audio = tarkibi.audio.chunking._ChunkedAudio(
+                self._noise_reduction,
+                self._diarization,
+                self._speaker_verification,
+                chunk_duration.total_seconds(),
+                self._CHUNK_OVERLAP_SECONDS,
+                diarization_workers,
+            )
+
+        if resample_workers:
+            self._resample_executor = ProcessPoolExecutor(
+                max_workers=resample_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+        # one pipeline for the whole batch, its worker processes keep their models loaded
+        try:
+            with tarkibi.utilities.pipeline._Pipeline(
+                self._build_stages(stage_workers)
+            ) as pipeline:
+                self._pipeline = pipeline
+                if any(video_ids for _, video_ids in pending_videos):
+                    self._run_pipeline(self._interleave(pending_videos))
+
+                active_jobs = [job for job in build_jobs if not job.is_complete()]
+                while active_jobs:
+                    self._run_pipeline(
+                        self._interleave(
+                            [
+                                (job, self._collect_audio_clips(job))
+                                for job in active_jobs
+                            ]
+                        )
+                    )
+                    active_jobs = [job for job in active_jobs if not job.is_complete()]
+        finally:
+            self._pipeline = None
+            if self._resample_executor is not None:
+                self._resample_executor.shutdown()
+                self._resample_executor = None
+
+        for job in build_jobs:
+            self._finish_job(job)
 
-        shutil.rmtree(temp_path, ignore_errors=True)
+        self._deep_clean()
 
     def build_dataset(
         self,
@@ -402,6 +1535,18 @@ class Tarkibi:
         output_path: str = "dataset",
         sample_rate: int = _DEFAULT_SAMPLE_RATE,
         with_transcription: bool = True,
+        stage_workers: dict[str, int] | None = None,
+        resample_workers: int | None = None,
+        profile: bool = False,
+        chunk_duration: timedelta | None = None,
+        cache_budget: int | None = None,
+        scratch_budget: int | None = None,
+        output_format: str = "ljspeech",
+        clean_speech_snr: float | None = None,
+        noise_reduction_backend: str = "auto",
+        gate_workers: int | None = None,
+        diarization_workers: int | None = None,
+        verification_mode: str = "titanet",
     ) -> None:
         """
         Function to build an LJSpeech-like dataset for a particular person. Uses Youtube as the source for the audio clips.
@@ -422,40 +1567,123 @@ class Tarkibi:
         with_transcription : bool (optional)
             Whether to transcribe the dataset or not
             Default is True
+        stage_workers : dict[str, int] (optional)
+            The number of concurrent workers per stage, any of 'download', 'noise_reduction',
+            'diarization', 'verification' and 'split'
+            Default is one worker per stage
+        resample_workers : int (optional)
+            The number of processes cutting and resampling clips, shared by every split
+            Default is None, clips are cut on threads of the split stage
+        profile : bool (optional)
+            Whether to record the time and memory of every stage call, written to
+            tarkibi_profile.json and a Chrome trace, tarkibi_trace.json, in output_path
+            Default is False
+        chunk_duration : timedelta (optional)
+            Recordings longer than this are separated, diarized and verified in overlapping windows of
+            this length, which bounds memory use on multi-hour videos
+            Default is None, recordings are processed whole
+        cache_budget : int (optional)
+            The disk space in bytes for a cache of downloads, vocals, speaker tracks, verification results
+            and transcripts kept in .tarkibi/cache across builds, the least recently used entries are
+            evicted first. Hits and misses are written to tarkibi_cache.json in the output path
+            Default is None, nothing is cached
+        scratch_budget : int (optional)
+            The disk space in bytes the intermediate files in .tarkibi may use, downloads wait while the
+            videos in progress are near the limit
+            Default is None, downloads are not throttled
+        output_format : str (optional)
+            'ljspeech' for a wav per clip and metadata.txt, 'sharded' for clips packed into memory-mappable
+            shards with columnar metadata in output_path/shards
+            Default is 'ljspeech'
+        clean_speech_snr : float (optional)
+            Recordings, or windows of them with chunk_duration, whose estimated SNR in dB is at least this and
+            that have no music under the speech skip vocal separation. Every decision is logged with its
+            measurements, 30 is a reasonable start
+            Default is None, every recording is separated
+        noise_reduction_backend : str (optional)
+            How vocals are isolated, 'spectral_gate' for a light NumPy denoiser suited to steady background
+            noise, 'resident' or 'cli' to force how Spleeter is run, 'auto' for Spleeter in-process with the
+            CLI as fallback
+            Default is 'auto'
+        gate_workers : int (optional)
+            The number of threads gating chunks of a recording at the same time, needs the 'spectral_gate'
+            noise_reduction_backend. Every noise_reduction worker runs this many threads
+            Default is None, chunks are gated one after the other
+        diarization_workers : int (optional)
+            The number of processes diarizing windows at the same time, needs chunk_duration. They are the
+            processes of the diarization stage, its stage_workers only split recordings into windows, so
+            there are this many diarizers in total. Speakers are then linked across windows by their
+            x-vector centroids
+            Default is None, windows are diarized one after the other
+        verification_mode : str (optional)
+            'centroid' keeps the x-vector centroid of every diarized speaker and compares it to the
+            reference, only speakers too close to call are verified with TitaNet. 'sampled' verifies a
+            few random windows of every speaker track with TitaNet, longest first, and only samples more
+            windows of a track while its scores are too close to call. 'titanet' verifies every speaker track
+            with TitaNet
+            Default is 'titanet'
 
         returns
         -------
         None
         """
-        logger.info(
-            f"Tarkibi _build_dataset: Building dataset for {author} with target duration {target_duration}"
+        self.build_datasets(
+            [(author, reference_audio, target_duration, output_path)],
+            sample_rate=sample_rate,
+            with_transcription=with_transcription,
+            stage_workers=stage_workers,
+            resample_workers=resample_workers,
+            profile=profile,
+            chunk_duration=chunk_duration,
+            cache_budget=cache_budget,
+            scratch_budget=scratch_budget,
+            output_format=output_format,
+            clean_speech_snr=clean_speech_snr,
+            noise_reduction_backend=noise_reduction_backend,
+            gate_workers=gate_workers,
+            diarization_workers=diarization_workers,
+            verification_mode=verification_mode,
         )
-        wav_file_output_path = f"{output_path}/wavs"
-        self._create_dataset_dirs(output_path, wav_file_output_path)
 
-        remaining_duration = target_duration.total_seconds() - self._total_duration(
-            wav_file_output_path
-        )
-        while remaining_duration > (0.2 * target_duration.total_seconds()):
-            self._collect_audio_clips(
-                author, target_duration, reference_audio, wav_file_output_path
-            )
-
-            remaining_duration = target_duration.total_seconds() - self._total_duration(
-                wav_file_output_path
-            )
+    def warm_up(self, with_transcription: bool = True) -> dict[str, float]:
+        """
+        Function to load the models in this process ahead of a build, so the first video does not wait for
+        them. The diarization and verification workers of a build load their own models when the build starts
+        paramaters
+        ----------
+        with_transcription : bool (optional)
+            Whether to build whisper.cpp and download its model as well
+            Default is True
 
-        all_output_files = [
-            f"{wav_file_output_path}/{file}"
-            for file in os.listdir(wav_file_output_path)
-            if file.endswith(".wav")
+        returns
+        -------
+        dict[str, float]
+            The seconds every model loaded by this process took to load, keyed by model name
+        """
+        components = [
+            self._noise_reduction,
+            self._diarization,
+            self._speaker_verification,
         ]
-
         if with_transcription:
-            self._transcribe_files(all_output_files)
-            self._format_transcription_ljspeech(output_path, output_path)
+            components.append(self._transcription)
 
-        if sample_rate != self._DEFAULT_SAMPLE_RATE:
-            self._update_sample_rate(output_path, sample_rate, all_output_files)
+        for component in components:
+            component.warm_up()
 
-        self._deep_clean()
+        return tarkibi.utilities.models.registry.load_times()
+
+    def release_models(self) -> list[str]:
+        """
+        Function to free the memory of the models loaded in this process, they are shared by every Tarkibi
+        instance and are loaded again when next used
+        paramaters
+        ----------
+        None
+
+        returns
+        -------
+        list[str]
+            The names of the models released
+        """
+        return tarkibi.utilities.models.registry.evict()
@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import typing
+from tarkibi.utilities._config import logger
+
+logger = logger.getChild(__name__)
+
+
+class _ArtifactCache:
+    _INDEX_FILE = "index.json"
+    _REPORT_FILE = "tarkibi_cache.json"
+
+    def __init__(self, cache_dir: str, max_bytes: int) -> None:
+        """
+        Content-addressed cache of stage artifacts that outlives builds, evicting the least recently used
+        entries when it grows past its budget. Files are copied in and out rather than linked, the stages
+        overwrite their outputs in place
+        parameters
+        ----------
+        cache_dir: str
+            The directory to keep the cache in
+        max_bytes: int
+            The disk space the cached files may use
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._index_path = os.path.join(cache_dir, self._INDEX_FILE)
+        self._lock = threading.Lock()
+        # the number of fetches copying each entry out, entries being copied are not evicted or replaced
+        self._readers: dict[str, int] = {}
+        self._readers_done = threading.Condition(self._lock)
+        # key -> {"stage", "files", "value", "size", "last_used"}
+        self._entries: dict[str, dict] = {}
+        self._counts: dict[str, dict[str, int]] = {}
+        self._evicted = 0
+        self._digests: dict[tuple, str] = {}
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+        # the budget may be smaller than in the build that filled the cache
+        with self._lock:
+            self._evict()
+            self._save()
+
+    def _load(self) -> None:
+        if not os.path.exists(self._index_path):
+            return
+
+        try:
+            with open(self._index_path) as index_file:
+                entries = json.load(index_file)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Tarkibi _ArtifactCache: Ignoring unreadable index: {e}")
+            return
+
+        # entries whose files went missing are dropped
+        self._entries = {
+            key: entry
+            for key, entry in entries.items()
+            if all(
+                os.path.exists(os.path.join(self.cache_dir, key, filename))
+                for filename in entry["files"]
+            )
+        }
+
+    def _save(self) -> None:
+        temp_path = f"{self._index_path}.tmp"
+        with open(temp_path, "w") as index_file:
+            json.dump(self._entries, index_file)
+
+        os.replace(temp_path, self._index_path)
+
+    def key(self, stage: str, subject: typing.Any, params: typing.Any = None) -> str:
+        """
+        The key of an artifact
+        parameters
+        ----------
+        stage: str
+            The stage that produces the artifact
+        subject: typing.Any
+            What the artifact is made from, a video id or the digest of an audio file
+        params: typing.Any
+            The models, versions and parameters the artifact depends on, must be JSON serialisable
+
+        returns
+        -------
+        str
+            The key
+        """
+        payload = json.dumps([stage, subject, params], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def file_digest(self, path: str) -> str:
+        """
+        The sha256 of a file, remembered until the file changes
+        parameters
+        ----------
+        path: str
+            The path to the file
+
+        returns
+        -------
+        str
+            The hex digest
+        """
+        stat = os.stat(path)
+        memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if memo_key in self._digests:
+                return self._digests[memo_key]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as audio_file:
+            for block in iter(lambda: audio_file.read(1 << 20), b""):
+                digest.update(block)
+
+        with self._lock:
+            self._digests[memo_key] = digest.hexdigest()
+
+        return digest.hexdigest()
+
+    def _count(self, stage: str, outcome: str) -> None:
+        counts = self._counts.setdefault(stage, {"hits": 0, "misses": 0})
+        counts[outcome] += 1
+
+    def fetch(
+        self, stage: str, key: str, destination_dir: str | None = None
+    ) -> tuple[list[str], typing.Any] | None:
+        """
+        Get an artifact, its files are copied to destination_dir under their original names
+        parameters
+        ----------
+        stage: str
+            The stage that produces the artifact, for the report
+        key: str
+            The key of the artifact
+        destination_dir: str | None
+            The directory to copy the files to
+
+        returns
+        -------
+        tuple[list[str], typing.Any] | None
+            The paths of the copied files and the stored value, None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["last_used"] = time.time()
+                self._readers[key] = self._readers.get(key, 0) + 1
+
+        pinned = entry is not None
+        paths = []
+        try:
+            if entry is not None and entry["files"]:
+                os.makedirs(destination_dir, exist_ok=True)
+            for filename in entry["files"] if entry is not None else []:
+                destination = os.path.join(destination_dir, filename)
+                paths.append(destination)
+                shutil.copyfile(
+                    os.path.join(self.cache_dir, key, filename), destination
+                )
+        except FileNotFoundError:
+            # removed from outside the cache, the stage must not see a partial artifact
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            entry = None
+
+        with self._lock:
+            if pinned:
+                self._readers[key] -= 1
+                if not self._readers[key]:
+                    del self._readers[key]
+                    self._readers_done.notify_all()
+                    self._evict()
+                if entry is None:
+                    # its files are gone
+                    self._entries.pop(key, None)
+                self._save()
+
+            self._count(stage, "misses" if entry is None else "hits")
+
+        if entry is None:
+            return None
+
+        return paths, entry["value"]
+
+    def store(
+        self,
+        stage: str,
+        key: str,
+        paths: list[str] = (),
+        value: typing.Any = None,
+    ) -> None:
+        """
+        Add an artifact, evicting the least recently used ones if the cache is over budget
+        parameters
+        ----------
+        stage: str
+            The stage that produced the artifact
+        key: str
+            The key of the artifact
+        paths: list[str]
+            The files of the artifact, their names must be unique
+        value: typing.Any
+            A small JSON serialisable value kept with the artifact
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        temp_dir = f"{entry_dir}.{threading.get_ident()}.tmp"
+        os.makedirs(temp_dir, exist_ok=True)
+        size = 0
+        for path in paths:
+            shutil.copyfile(path, os.path.join(temp_dir, os.path.basename(path)))
+            size += os.path.getsize(path)
+
+        with self._lock:
+            # an entry being fetched is replaced once it has been copied out
+            self._readers_done.wait_for(lambda: key not in self._readers)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(temp_dir, entry_dir)
+            self._entries[key] = {
+                "stage": stage,
+                "files": [os.path.basename(path) for path in paths],
+                "value": value,
+                "size": size,
+                "last_used": time.time(),
+            }
+            self._evict()
+            self._save()
+
+    def _evict(self) -> None:
+        total = sum(entry["size"] for entry in self._entries.values())
+        for key in sorted(self._entries, key=lambda k: self._entries[k]["last_used"]):
+            if total <= self.max_bytes or key in self._readers:
+                # an entry being copied out is evicted once the copy finishes, newer entries are kept
+                break
+
+            total -= self._entries.pop(key)["size"]
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            self._evicted += 1
+
+    def report(self) -> dict[str, typing.Any]:
+        """
+        The hits and misses per stage since the cache was opened, and the state of the cache
+
+        returns
+        -------
+        dict[str, typing.Any]
+            The report
+        """
+        with self._lock:
+            return {
+                "stages": {
+                    stage: dict(counts) for stage, counts in self._counts.items()
+                },
+                "entries": len(self._entries),
+                "bytes": sum(entry["size"] for entry in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "evicted": self._evicted,
+            }
+
+    def export(self, output_path: str) -> None:
+        """
+        Log the report and write it to tarkibi_cache.json
+        parameters
+        ----------
+        output_path: str
+            The directory to write the report to
+        """
+        report = self.report()
+        for stage, counts in report["stages"].items():
+            logger.info(
+                f"Tarkibi _ArtifactCache: {stage} {counts['hits']} hits, {counts['misses']} misses"
+            )
+
+        with open(os.path.join(output_path, self._REPORT_FILE), "w") as report_file:
+            json.dump(report, report_file, indent=2)
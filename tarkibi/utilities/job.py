@@ -0,0 +1,135 @@
+import threading
+from datetime import timedelta
+from . import general
+
+
+class _BuildJob:
+    def __init__(
+        self,
+        author: str | None,
+        reference_audio: str,
+        target_duration: timedelta | None,
+        output_path: str = "dataset",
+        work_dir: str = general.BASE_DIR,
+        min_clip_duration: float = 1,
+        output_format: str = "ljspeech",
+    ) -> None:
+        """
+        The state of one speaker's dataset build, kept apart so several builds can share stage workers
+        parameters
+        ----------
+        author: str | None
+            The name of the person the dataset is for
+        reference_audio: str
+            The path to the reference audio file of the person
+        target_duration: timedelta | None
+            The target duration of the dataset
+        output_path: str
+            The path to save the dataset to
+        work_dir: str
+            The directory holding the intermediate files of the build
+        min_clip_duration: float
+            The shortest clip, the target counts as reached once less than this is missing
+        output_format: str
+            'ljspeech' for a wav per clip in output_path, 'sharded' for clips packed into shards in
+            output_path/shards, the wavs are then staged in work_dir
+        """
+        self.author = author
+        self.reference_audio = reference_audio
+        self.target_duration = target_duration
+        self.output_path = output_path
+        self.output_format = output_format
+        self.shard_path = f"{output_path}/shards"
+        if output_format == "sharded":
+            self.wav_output_dir = f"{work_dir}/audio_dataset"
+        else:
+            self.wav_output_dir = f"{output_path}/wavs"
+
+        self.work_dir = work_dir
+        self.raw_path = f"{work_dir}/audio_raw"
+        self.nn_path = f"{work_dir}/audio_nn"
+        self.clips_path = f"{work_dir}/audio_clips"
+        self.final_path = f"{work_dir}/audio_final"
+
+        self.min_clip_duration = min_clip_duration
+        self.offset = 0
+        # seconds of clips in the dataset or being written, set from the ledger when the build starts
+        self.planned_seconds = 0.0
+        self._offset_lock = threading.Lock()
+        self.clips_used: list[str] = []
+        # the search query every video was found with, for the yield stats
+        self.queries: dict[str, str] = {}
+
+        self.manifest = None
+        self.ledger = None
+        self.shards = None
+
+    def reserve_clips(
+        self, windows: list[tuple[float, float]]
+    ) -> tuple[int, list[tuple[float, float]]]:
+        """
+        Reserve clip ids for clip windows, safe to call from concurrent stages. The windows are trimmed so
+        the dataset does not overshoot the target duration, the last one may be shortened
+        parameters
+        ----------
+        windows: list[tuple[float, float]]
+            The (start time, duration) of every clip
+
+        returns
+        -------
+        tuple[int, list[tuple[float, float]]]
+            The first reserved clip id and the windows to write
+        """
+        with self._offset_lock:
+            if self.target_duration is not None:
+                kept = []
+                for start_time, clip_duration in windows:
+                    missing = (
+                        self.target_duration.total_seconds() - self.planned_seconds
+                    )
+                    if missing < self.min_clip_duration:
+                        break
+
+                    clip_duration = min(clip_duration, missing)
+                    kept.append((start_time, clip_duration))
+                    self.planned_seconds += clip_duration
+                windows = kept
+
+            offset = self.offset
+            self.offset += len(windows)
+
+        return offset, windows
+
+    def release_clips(self, windows: list[tuple[float, float]]) -> None:
+        """
+        Give back the seconds of reserved clip windows that were not written, so the target counts
+        what is actually in the dataset
+        parameters
+        ----------
+        windows: list[tuple[float, float]]
+            The (start time, duration) of every clip, as returned by reserve_clips
+        """
+        if self.target_duration is None:
+            return
+
+        with self._offset_lock:
+            self.planned_seconds -= sum(clip_duration for _, clip_duration in windows)
+
+    def target_reached(self) -> bool:
+        if self.target_duration is None:
+            return False
+
+        with self._offset_lock:
+            missing = self.target_duration.total_seconds() - self.planned_seconds
+
+        return missing < self.min_clip_duration
+
+    def remaining_seconds(self) -> float:
+        return self.target_duration.total_seconds() - self.ledger.total
+
+    def is_complete(self) -> bool:
+        # once the stages drop every video as reached, searching for more could never add clips
+        if self.target_reached():
+            return True
+
+        return self.remaining_seconds() <= 0.2 * self.target_duration.total_seconds()
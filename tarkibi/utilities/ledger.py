@@ -0,0 +1,153 @@
+import json
+import os
+import threading
+import typing
+from tarkibi.utilities._config import logger
+
+logger = logger.getChild(__name__)
+
+
+class _DurationLedger:
+    _LEDGER_FILE = ".tarkibi_durations.jsonl"
+
+    def __init__(self, output_path: str) -> None:
+        """
+        Running total of the clip durations of a dataset, persisted next to the wavs
+        parameters
+        ----------
+        output_path: str
+            The path to the dataset
+        """
+        self.path = os.path.join(output_path, self._LEDGER_FILE)
+        self._lock = threading.Lock()
+        self._durations: dict[str, float] = {}
+        self._total = 0.0
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path) as ledger_file:
+            for line in ledger_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+                self._durations[entry["clip"]] = entry["duration"]
+
+        self._total = sum(self._durations.values())
+
+    def _rewrite(self) -> None:
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as ledger_file:
+            for clip_id, duration in self._durations.items():
+                ledger_file.write(
+                    json.dumps({"clip": clip_id, "duration": duration}) + "\n"
+                )
+
+        os.replace(temp_path, self.path)
+
+    @property
+    def total(self) -> float:
+        return self._total
+
+    def __len__(self) -> int:
+        return len(self._durations)
+
+    def add(self, clips: dict[str, float]) -> None:
+        """
+        Add clips to the ledger
+        parameters
+        ----------
+        clips: dict[str, float]
+            The duration in seconds of every clip, keyed by clip path
+        """
+        entries = {
+            os.path.basename(path).split(".")[0]: duration
+            for path, duration in clips.items()
+        }
+        lines = "".join(
+            json.dumps({"clip": clip_id, "duration": duration}) + "\n"
+            for clip_id, duration in entries.items()
+        )
+
+        with self._lock:
+            with open(self.path, "a") as ledger_file:
+                ledger_file.write(lines)
+
+            for clip_id, duration in entries.items():
+                self._total += duration - self._durations.get(clip_id, 0.0)
+                self._durations[clip_id] = duration
+
+    def reconcile(
+        self, wav_output_dir: str, duration_fn: typing.Callable[[str], float]
+    ) -> None:
+        """
+        Bring the ledger in line with the clips on disk, only clips missing from the ledger are opened
+        parameters
+        ----------
+        wav_output_dir: str
+            The path to the audio clips of the dataset
+        duration_fn: typing.Callable[[str], float]
+            Returns the duration in seconds of a clip
+        """
+        on_disk = {
+            filename.split(".")[0]
+            for filename in os.listdir(wav_output_dir)
+            if filename.endswith(".wav")
+        }
+
+        with self._lock:
+            missing = [clip_id for clip_id in self._durations if clip_id not in on_disk]
+            unknown = sorted(on_disk - set(self._durations))
+
+            for clip_id in missing:
+                del self._durations[clip_id]
+
+            for clip_id in unknown:
+                self._durations[clip_id] = duration_fn(
+                    os.path.join(wav_output_dir, f"{clip_id}.wav")
+                )
+
+            if missing or unknown:
+                logger.info(
+                    f"Tarkibi _DurationLedger: Reconciled {len(unknown)} new and {len(missing)} removed clips"
+                )
+                self._rewrite()
+
+            self._total = sum(self._durations.values())
+
+    def reset(self, durations: dict[str, float]) -> None:
+        """
+        Replace the ledger with the clips of a dataset that keeps its own durations
+        parameters
+        ----------
+        durations: dict[str, float]
+            The duration in seconds of every clip, keyed by clip id
+        """
+        with self._lock:
+            if durations != self._durations:
+                self._durations = dict(durations)
+                self._rewrite()
+
+            self._total = sum(self._durations.values())
+
+    def clip_paths(self, wav_output_dir: str) -> list[str]:
+        """
+        Get the paths of every clip in the ledger
+        parameters
+        ----------
+        wav_output_dir: str
+            The path to the audio clips of the dataset
+
+        returns
+        -------
+        list[str]
+            The paths of the clips, ordered by clip id
+        """
+        with self._lock:
+            clip_ids = sorted(self._durations)
+
+        return [os.path.join(wav_output_dir, f"{clip_id}.wav") for clip_id in clip_ids]
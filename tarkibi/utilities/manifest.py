@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+import typing
+from tarkibi.utilities._config import logger
+
+logger = logger.getChild(__name__)
+
+
+class _Manifest:
+    _MANIFEST_FILE = ".tarkibi_manifest.jsonl"
+
+    def __init__(self, output_path: str) -> None:
+        """
+        Append-only log of the stages completed for every video of a build
+        parameters
+        ----------
+        output_path: str
+            The path to the dataset, the manifest is stored next to the wavs
+        """
+        self.path = os.path.join(output_path, self._MANIFEST_FILE)
+        self._lock = threading.Lock()
+        self._stages: dict[str, dict[str, dict[str, typing.Any]]] = {}
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path) as manifest_file:
+            lines = manifest_file.readlines()
+
+        if lines and not lines[-1].endswith("\n"):
+            # terminate the torn line so new entries start on a line of their own
+            with open(self.path, "a") as manifest_file:
+                manifest_file.write("\n")
+
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # a crash can leave the last line half-written
+                logger.info(
+                    f"Tarkibi _Manifest: Skipping truncated manifest entry in {self.path}"
+                )
+                continue
+
+            self._stages.setdefault(entry["video"], {})[entry["stage"]] = entry[
+                "artifacts"
+            ]
+
+    def __bool__(self) -> bool:
+        return bool(self._stages)
+
+    def record(
+        self,
+        video_id: str,
+        stage: str,
+        artifacts: dict[str, typing.Any] | None = None,
+    ) -> None:
+        """
+        Record that a stage completed for a video
+        parameters
+        ----------
+        video_id: str
+            The id of the video
+        stage: str
+            The name of the completed stage
+        artifacts: dict[str, typing.Any] | None
+            The artifacts the stage produced
+        """
+        artifacts = artifacts or {}
+        line = json.dumps({"video": video_id, "stage": stage, "artifacts": artifacts})
+
+        with self._lock:
+            with open(self.path, "a") as manifest_file:
+                manifest_file.write(line + "\n")
+                manifest_file.flush()
+                os.fsync(manifest_file.fileno())
+
+            self._stages.setdefault(video_id, {})[stage] = artifacts
+
+    def completed(self, video_id: str, stage: str) -> dict[str, typing.Any] | None:
+        """
+        Get the artifacts of a completed stage
+        parameters
+        ----------
+        video_id: str
+            The id of the video
+        stage: str
+            The name of the stage
+
+        returns
+        -------
+        dict[str, typing.Any] | None
+            The artifacts of the stage, None if the stage has not completed
+        """
+        with self._lock:
+            return self._stages.get(video_id, {}).get(stage)
+
+    def videos(self, stage: str) -> list[str]:
+        """
+        Get the videos that completed a stage
+        parameters
+        ----------
+        stage: str
+            The name of the stage
+
+        returns
+        -------
+        list[str]
+            The ids of the videos, in the order they were recorded
+        """
+        with self._lock:
+            return [
+                video_id for video_id, stages in self._stages.items() if stage in stages
+            ]
+
+    def clip_paths(self) -> list[str]:
+        """
+        Get every clip recorded in the manifest
+
+        returns
+        -------
+        list[str]
+            The paths of the clips
+        """
+        clip_paths = []
+        with self._lock:
+            for stages in self._stages.values():
+                for artifacts in stages.values():
+                    clip_paths.extend(artifacts.get("clips", []))
+
+        return clip_paths
@@ -0,0 +1,189 @@
+import collections
+import gc
+import hashlib
+import sys
+import threading
+import time
+import typing
+from tarkibi.utilities._config import logger
+
+logger = logger.getChild(__name__)
+
+
+class _ModelRegistry:
+    def __init__(self) -> None:
+        """
+        Process-wide cache of loaded models, every model is loaded once and shared by all callers
+        """
+        self._models: dict[str, typing.Any] = {}
+        self._lock = threading.Lock()
+        self._load_locks: dict[str, threading.Lock] = {}
+        self._load_seconds: dict[str, float] = {}
+        # the seconds each thread spent loading models, so callers can tell loading from inference
+        self._local = threading.local()
+
+    def get(self, name: str, loader: typing.Callable[[], typing.Any]) -> typing.Any:
+        """
+        Get a model, loading it on first use
+        parameters
+        ----------
+        name: str
+            The name the model is cached under
+        loader: typing.Callable[[], typing.Any]
+            Loads the model, only called if it is not cached yet
+
+        returns
+        -------
+        typing.Any
+            The model
+        """
+        with self._lock:
+            if name in self._models:
+                return self._models[name]
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        # loading can take a while, only block the callers waiting for this model
+        with load_lock:
+            with self._lock:
+                if name in self._models:
+                    return self._models[name]
+
+            logger.info(f"Tarkibi _ModelRegistry: Loading model {name}")
+            load_start = time.perf_counter()
+            model = loader()
+            load_seconds = time.perf_counter() - load_start
+            self._local.seconds = self.thread_load_seconds() + load_seconds
+            logger.info(
+                f"Tarkibi _ModelRegistry: Loaded model {name} in {load_seconds:.2f}s"
+            )
+
+            with self._lock:
+                self._models[name] = model
+                self._load_seconds[name] = load_seconds
+
+        return model
+
+    def warm(self, name: str, loader: typing.Callable[[], typing.Any]) -> None:
+        """
+        Load a model ahead of its first use, errors are logged rather than raised so the first
+        real use retries the load and reports the error where it matters
+        parameters
+        ----------
+        name: str
+            The name the model is cached under
+        loader: typing.Callable[[], typing.Any]
+            Loads the model, only called if it is not cached yet
+        """
+        try:
+            self.get(name, loader)
+        except Exception as e:
+            logger.error(f"Tarkibi _ModelRegistry: Warming up {name} failed: {e}")
+
+    def evict(self, names: list[str] | None = None) -> list[str]:
+        """
+        Drop models from the cache to free their memory, callers still holding a model keep it alive
+        until they are done. An evicted model is loaded again on its next use
+        parameters
+        ----------
+        names: list[str] | None
+            The names of the models to drop, None drops every model
+
+        returns
+        -------
+        list[str]
+            The names of the models dropped
+        """
+        with self._lock:
+            evicted = [
+                name for name in list(self._models) if names is None or name in names
+            ]
+            for name in evicted:
+                del self._models[name]
+
+        if evicted:
+            logger.info(f"Tarkibi _ModelRegistry: Evicted models {evicted}")
+            gc.collect()
+            # the memory of GPU models stays with torch's allocator until it is emptied
+            torch = sys.modules.get("torch")
+            if torch is not None and torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+        return evicted
+
+    def loaded(self) -> list[str]:
+        """
+        The names of the models loaded in this process
+        """
+        with self._lock:
+            return list(self._models)
+
+    def thread_load_seconds(self) -> float:
+        """
+        The seconds the calling thread has spent loading models
+        """
+        return getattr(self._local, "seconds", 0.0)
+
+    def load_times(self) -> dict[str, float]:
+        """
+        The seconds every model loaded by this process took to load, keyed by name
+        """
+        with self._lock:
+            return dict(self._load_seconds)
+
+
+class _EmbeddingCache:
+    # references rarely change within a process, a few are enough
+    _MAX_ENTRIES = 16
+
+    def __init__(self) -> None:
+        """
+        Process-wide cache of reference embeddings, kept apart from the models so computing an embedding
+        is not counted as loading a model and releasing the models keeps the embeddings
+        """
+        self._embeddings: collections.OrderedDict[str, typing.Any] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(
+        self, model_name: str, audio_file: str, embed: typing.Callable[[], typing.Any]
+    ) -> typing.Any:
+        """
+        Get the embedding of an audio file, computing it on first use
+        parameters
+        ----------
+        model_name: str
+            The model the embedding is computed with
+        audio_file: str
+            The audio file, embeddings are keyed by its content so a file replaced under the same path
+            is embedded again
+        embed: typing.Callable[[], typing.Any]
+            Computes the embedding, only called if it is not cached yet
+
+        returns
+        -------
+        typing.Any
+            The embedding
+        """
+        digest = hashlib.sha256()
+        with open(audio_file, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        key = f"{model_name}_{digest.hexdigest()}"
+
+        with self._lock:
+            if key in self._embeddings:
+                self._embeddings.move_to_end(key)
+                return self._embeddings[key]
+
+        embedding = embed()
+        with self._lock:
+            self._embeddings[key] = embedding
+            while len(self._embeddings) > self._MAX_ENTRIES:
+                self._embeddings.popitem(last=False)
+
+        return embedding
+
+
+registry = _ModelRegistry()
+embeddings = _EmbeddingCache()
@@ -0,0 +1,269 @@
+import multiprocessing
+import queue
+import threading
+import typing
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from tarkibi.utilities._config import logger
+
+logger = logger.getChild(__name__)
+
+_SENTINEL = object()
+
+
+class _Stage:
+    def __init__(
+        self,
+        name: str,
+        fn: typing.Callable[[typing.Any], typing.Any],
+        workers: int = 1,
+        use_processes: bool = False,
+        warm_up: typing.Callable[[], None] | None = None,
+        processes: int | None = None,
+    ) -> None:
+        """
+        A single pipeline stage
+        parameters
+        ----------
+        name: str
+            The name of the stage, used to offload work to its process pool
+        fn: typing.Callable[[typing.Any], typing.Any]
+            Called from a worker thread with each item, returns the item for the next stage or None to drop it
+        workers: int
+            The number of items processed concurrently by the stage
+        use_processes: bool
+            Whether work offloaded by the stage runs in a process pool
+        warm_up: typing.Callable[[], None] | None
+            Loads the models of the stage when the pipeline starts, in every worker process of process
+            stages, so they are ready by the time the first item reaches the stage. Must be picklable
+            for process stages
+        processes: int | None
+            The number of worker processes of a process stage, None starts one per worker
+        """
+        if workers < 1:
+            raise ValueError(f"Stage {name} needs at least one worker, got {workers}")
+
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.use_processes = use_processes
+        self.warm_up = warm_up
+        self.processes = processes or workers
+
+
+class _Pipeline:
+    # processes are spawned rather than forked, torch and tensorflow do not survive a fork
+    _MP_CONTEXT = "spawn"
+
+    def __init__(self, stages: list[_Stage]) -> None:
+        """
+        Stages connected by bounded queues, the process pools live as long as the pipeline
+        so models loaded by the workers stay resident across runs
+        parameters
+        ----------
+        stages: list[_Stage]
+            The stages, in order
+        """
+        self._stages = stages
+        self._executors: dict[str, Executor] = {}
+        self._futures: set[Future] = set()
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._queues = [queue.Queue(maxsize=stage.workers) for stage in self._stages]
+        self._errors: list[BaseException] = []
+        self._failed = threading.Event()
+        self._stopped = threading.Event()
+        self._results: list[typing.Any] = []
+
+    def __enter__(self) -> "_Pipeline":
+        context = multiprocessing.get_context(self._MP_CONTEXT)
+        for stage in self._stages:
+            if stage.use_processes:
+                executor = ProcessPoolExecutor(
+                    max_workers=stage.processes,
+                    mp_context=context,
+                    initializer=stage.warm_up,
+                )
+                self._executors[stage.name] = executor
+                if stage.warm_up is not None:
+                    # the worker processes are started on the first submit, they warm up
+                    # while the earlier stages work on the first item
+                    executor.submit(int)
+            elif stage.warm_up is not None:
+                threading.Thread(
+                    target=stage.warm_up,
+                    name=f"tarkibi-{stage.name}-warm-up",
+                    daemon=True,
+                ).start()
+
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        for executor in self._executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        self._executors.clear()
+
+    def offload(
+        self, stage_name: str, fn: typing.Callable, *args: typing.Any
+    ) -> typing.Any:
+        """
+        Run fn in the process pool of a stage, or inline if the stage uses threads
+        parameters
+        ----------
+        stage_name: str
+            The name of the stage the work belongs to
+        fn: typing.Callable
+            The function to run, must be picklable for process stages
+        args: typing.Any
+            The arguments to call fn with
+
+        returns
+        -------
+        typing.Any
+            The return value of fn
+        """
+        executor = self._executors.get(stage_name)
+        if executor is None:
+            return fn(*args)
+
+        future = executor.submit(fn, *args)
+        with self._lock:
+            self._futures.add(future)
+        try:
+            return future.result()
+        finally:
+            with self._lock:
+                self._futures.discard(future)
+
+    def offload_map(
+        self, stage_name: str, fn: typing.Callable, items: list[typing.Any]
+    ) -> list[typing.Any]:
+        """
+        Run fn on every item at the same time in the process pool of a stage, or inline one after the
+        other if the stage uses threads
+        parameters
+        ----------
+        stage_name: str
+            The name of the stage the work belongs to
+        fn: typing.Callable
+            The function to run, must be picklable for process stages
+        items: list[typing.Any]
+            The items to call fn with
+
+        returns
+        -------
+        list[typing.Any]
+            The return value of fn for every item, in order
+        """
+        executor = self._executors.get(stage_name)
+        if executor is None:
+            return [fn(item) for item in items]
+
+        futures = [executor.submit(fn, item) for item in items]
+        with self._lock:
+            self._futures.update(futures)
+        try:
+            return [future.result() for future in futures]
+        finally:
+            with self._lock:
+                self._futures.difference_update(futures)
+
+    def stop(self) -> None:
+        """
+        Stop the current run, queued items are dropped and offloaded work that has not started is cancelled.
+        Work already running finishes, but its result is dropped
+        """
+        logger.info("Tarkibi _Pipeline: Stopping")
+        self._stopped.set()
+        with self._lock:
+            futures = list(self._futures)
+
+        for future in futures:
+            future.cancel()
+
+    def _worker(self, index: int, remaining: list[int]) -> None:
+        stage = self._stages[index]
+        input_queue = self._queues[index]
+        is_last = index == len(self._stages) - 1
+
+        while True:
+            item = input_queue.get()
+            if item is _SENTINEL:
+                # let the sibling workers see the sentinel as well
+                input_queue.put(_SENTINEL)
+                break
+
+            if self._failed.is_set() or self._stopped.is_set():
+                continue
+
+            try:
+                result = stage.fn(item)
+            except Exception as e:
+                if self._stopped.is_set():
+                    # cancelled by stop
+                    continue
+
+                logger.error(f"Tarkibi _Pipeline: Stage {stage.name} failed: {e}")
+                with self._lock:
+                    self._errors.append(e)
+                self._failed.set()
+                continue
+
+            if result is None:
+                continue
+
+            if is_last:
+                with self._lock:
+                    self._results.append(result)
+            else:
+                self._queues[index + 1].put(result)
+
+        with self._lock:
+            remaining[index] -= 1
+            stage_done = remaining[index] == 0
+
+        if stage_done and not is_last:
+            self._queues[index + 1].put(_SENTINEL)
+
+    def run(self, items: typing.Iterable[typing.Any]) -> list[typing.Any]:
+        """
+        Push items through every stage, stages run concurrently on different items
+        parameters
+        ----------
+        items: typing.Iterable[typing.Any]
+            The items to feed to the first stage
+
+        returns
+        -------
+        list[typing.Any]
+            The items returned by the last stage, in completion order
+        """
+        self._reset()
+        remaining = [stage.workers for stage in self._stages]
+        threads = []
+        for index, stage in enumerate(self._stages):
+            for worker in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._worker,
+                    args=(index, remaining),
+                    name=f"tarkibi-{stage.name}-{worker}",
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+
+        for item in items:
+            if self._failed.is_set() or self._stopped.is_set():
+                break
+            self._queues[0].put(item)
+        self._queues[0].put(_SENTINEL)
+
+        for thread in threads:
+            thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+        return self._results
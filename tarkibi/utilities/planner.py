@@ -0,0 +1,148 @@
+from tarkibi.utilities._config import logger
+
+logger = logger.getChild(__name__)
+
+
+class _Planner:
+    # upper bound on candidates * budget seconds for the exact bitset planner,
+    # the prefix bitsets kept for reconstruction cost about cells / 8 bytes
+    _MAX_DP_CELLS = 200_000_000
+
+    def __init__(self) -> None:
+        pass
+
+    def _convert_time_to_seconds(self, time_str: str) -> int:
+        """
+        Convert a youtube length string (MM:SS or HH:MM:SS) to seconds
+        parameters
+        ----------
+        time_str: str
+            The time string to convert
+
+        returns
+        -------
+        int
+            The time in seconds
+        """
+        parts = time_str.split(":")
+
+        if len(parts) == 2:
+            minutes, seconds = map(int, parts)
+            return minutes * 60 + seconds
+        elif len(parts) == 3:
+            hours, minutes, seconds = map(int, parts)
+            return hours * 3600 + minutes * 60 + seconds
+
+        raise ValueError(f"Invalid time string: {time_str}")
+
+    def _subset_sum_bitset(self, durations: list[int], budget: int) -> list[int]:
+        """
+        Exact closest-without-exceeding subset sum, using python ints as bitsets
+        parameters
+        ----------
+        durations: list[int]
+            The duration of every candidate in seconds
+        budget: int
+            The maximum total duration in seconds
+
+        returns
+        -------
+        list[int]
+            The indices of the chosen candidates
+        """
+        mask = (1 << (budget + 1)) - 1
+
+        # prefixes[i] has bit s set if a subset of the first i candidates sums to s
+        prefixes = [1]
+        for duration in durations:
+            reachable = prefixes[-1]
+            prefixes.append((reachable | (reachable << duration)) & mask)
+
+        remaining = prefixes[-1].bit_length() - 1
+        chosen = []
+        for i in range(len(durations) - 1, -1, -1):
+            if remaining == 0:
+                break
+
+            if not (prefixes[i] >> remaining) & 1:
+                chosen.append(i)
+                remaining -= durations[i]
+
+        return chosen
+
+    def _subset_sum_greedy(self, durations: list[int], budget: int) -> list[int]:
+        """
+        Approximate closest-without-exceeding subset sum for very large inputs
+        parameters
+        ----------
+        durations: list[int]
+            The duration of every candidate in seconds
+        budget: int
+            The maximum total duration in seconds
+
+        returns
+        -------
+        list[int]
+            The indices of the chosen candidates
+        """
+        chosen = []
+        remaining = budget
+        for i in sorted(range(len(durations)), key=lambda i: -durations[i]):
+            if 0 < durations[i] <= remaining:
+                chosen.append(i)
+                remaining -= durations[i]
+
+        return chosen
+
+    def _plan_indices(self, durations: list[int], budget: int) -> list[int]:
+        """
+        Pick the subset of durations closest to the budget without exceeding it
+        parameters
+        ----------
+        durations: list[int]
+            The duration of every candidate in seconds
+        budget: int
+            The maximum total duration in seconds
+
+        returns
+        -------
+        list[int]
+            The indices of the chosen candidates, in ascending order
+        """
+        if budget <= 0 or not durations:
+            return []
+
+        if len(durations) * budget <= self._MAX_DP_CELLS:
+            chosen = self._subset_sum_bitset(durations, budget)
+        else:
+            logger.info(
+                f"Tarkibi _plan_indices: {len(durations)} candidates over {budget}s, using greedy planner"
+            )
+            chosen = self._subset_sum_greedy(durations, budget)
+
+        return sorted(chosen)
+
+    def select(
+        self, videos: list[dict[str, str]], budget_seconds: float
+    ) -> list[dict[str, str]]:
+        """
+        Select the combination of videos whose total length is closest to the budget without exceeding it
+        parameters
+        ----------
+        videos: list[dict[str, str]]
+            The search results, each with a 'length' string
+        budget_seconds: float
+            The maximum total length in seconds
+
+        returns
+        -------
+        list[dict[str, str]]
+            The selected videos, shortest first
+        """
+        durations = [self._convert_time_to_seconds(video["length"]) for video in videos]
+        order = sorted(range(len(videos)), key=lambda i: durations[i])
+        sorted_durations = [durations[i] for i in order]
+
+        chosen = self._plan_indices(sorted_durations, int(budget_seconds))
+
+        return [videos[order[i]] for i in chosen]
@@ -0,0 +1,219 @@
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import typing
+import tarkibi.utilities.models
+from tarkibi.utilities._config import logger
+
+logger = logger.getChild(__name__)
+
+# ru_maxrss is reported in kilobytes on linux and in bytes on macOS
+_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def _measured_call(
+    fn: typing.Callable, *args: typing.Any
+) -> tuple[typing.Any, dict[str, typing.Any]]:
+    """
+    Call fn and measure the resources it used, runs wherever fn runs (thread or worker process)
+    parameters
+    ----------
+    fn: typing.Callable
+        The function to call
+    args: typing.Any
+        The arguments to call fn with
+
+    returns
+    -------
+    tuple[typing.Any, dict[str, typing.Any]]
+        The return value of fn and its resource usage
+    """
+    children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    load_start = tarkibi.utilities.models.registry.thread_load_seconds()
+    cpu_start = time.thread_time()
+
+    result = fn(*args)
+
+    cpu = time.thread_time() - cpu_start
+    # models loaded on first use, not yet warmed up, are reported apart from inference
+    load = tarkibi.utilities.models.registry.thread_load_seconds() - load_start
+    children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # subprocesses (spleeter, ffmpeg, whisper.cpp) only show up in RUSAGE_CHILDREN, which is
+    # process wide, so concurrent stages can be attributed some of each other's children
+    cpu += (children_end.ru_utime - children_start.ru_utime) + (
+        children_end.ru_stime - children_start.ru_stime
+    )
+    peak_rss = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, children_end.ru_maxrss
+    )
+
+    return result, {
+        "cpu": cpu,
+        "load": load,
+        "peak_rss": peak_rss * _RSS_UNIT,
+        "pid": os.getpid(),
+        "tid": threading.get_ident(),
+    }
+
+
+class _Profiler:
+    _SUMMARY_FILE = "tarkibi_profile.json"
+    _TRACE_FILE = "tarkibi_trace.json"
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self._records: list[dict[str, typing.Any]] = []
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+
+    def measure(
+        self,
+        name: str,
+        fn: typing.Callable,
+        *args: typing.Any,
+        audio: typing.Callable[[], float] | None = None,
+        runner: typing.Callable | None = None,
+    ) -> typing.Any:
+        """
+        Call fn, recording its wall time, cpu time, peak rss and real-time factor when enabled
+        parameters
+        ----------
+        name: str
+            The name of the stage call
+        fn: typing.Callable
+            The function to call
+        args: typing.Any
+            The arguments to call fn with
+        audio: typing.Callable[[], float] | None
+            Returns the seconds of audio the call processed, only called when enabled
+        runner: typing.Callable | None
+            Runs fn(*args) somewhere else, e.g. in a process pool, instead of calling it directly
+
+        returns
+        -------
+        typing.Any
+            The return value of fn
+        """
+        if not self.enabled:
+            return runner(fn, *args) if runner else fn(*args)
+
+        started_at = time.time()
+        wall_start = time.perf_counter()
+        if runner:
+            result, usage = runner(_measured_call, fn, *args)
+        else:
+            result, usage = _measured_call(fn, *args)
+        wall = time.perf_counter() - wall_start
+
+        audio_seconds = audio() if audio else None
+        with self._lock:
+            self._records.append(
+                {
+                    "name": name,
+                    "start": started_at,
+                    "wall": wall,
+                    "audio_seconds": audio_seconds,
+                    **usage,
+                }
+            )
+
+        return result
+
+    def summary(self) -> dict[str, typing.Any]:
+        """
+        Aggregate the recorded calls per stage
+
+        returns
+        -------
+        dict[str, typing.Any]
+            The totals of every stage and of the build
+        """
+        stages: dict[str, dict[str, typing.Any]] = {}
+        with self._lock:
+            records = list(self._records)
+
+        for record in records:
+            stage = stages.setdefault(
+                record["name"],
+                {
+                    "calls": 0,
+                    "wall_seconds": 0.0,
+                    "load_seconds": 0.0,
+                    "cpu_seconds": 0.0,
+                    "peak_rss_bytes": 0,
+                    "audio_seconds": 0.0,
+                },
+            )
+            stage["calls"] += 1
+            stage["wall_seconds"] += record["wall"]
+            stage["load_seconds"] += record["load"]
+            stage["cpu_seconds"] += record["cpu"]
+            stage["peak_rss_bytes"] = max(stage["peak_rss_bytes"], record["peak_rss"])
+            stage["audio_seconds"] += record["audio_seconds"] or 0.0
+
+        for stage in stages.values():
+            stage["inference_seconds"] = stage["wall_seconds"] - stage["load_seconds"]
+            # below 1.0 means the stage is faster than real-time, model loading is left out
+            stage["real_time_factor"] = (
+                stage["inference_seconds"] / stage["audio_seconds"]
+                if stage["audio_seconds"]
+                else None
+            )
+
+        return {
+            "wall_seconds": time.time() - self._started_at,
+            "stages": stages,
+            # models loaded by this process, worker processes log their own
+            "model_load_seconds": tarkibi.utilities.models.registry.load_times(),
+        }
+
+    def _trace_events(self) -> list[dict[str, typing.Any]]:
+        with self._lock:
+            records = list(self._records)
+
+        return [
+            {
+                "name": record["name"],
+                "ph": "X",
+                "ts": int(record["start"] * 1e6),
+                "dur": int(record["wall"] * 1e6),
+                "pid": record["pid"],
+                "tid": record["tid"],
+                "args": {
+                    "cpu_seconds": record["cpu"],
+                    "load_seconds": record["load"],
+                    "peak_rss_bytes": record["peak_rss"],
+                    "audio_seconds": record["audio_seconds"],
+                },
+            }
+            for record in records
+        ]
+
+    def export(self, output_path: str) -> None:
+        """
+        Write the summary and a Chrome trace (viewable in Perfetto) of the build
+        parameters
+        ----------
+        output_path: str
+            The directory to write the files to
+        """
+        if not self.enabled:
+            return
+
+        summary_path = os.path.join(output_path, self._SUMMARY_FILE)
+        with open(summary_path, "w") as summary_file:
+            json.dump(self.summary(), summary_file, indent=2)
+
+        trace_path = os.path.join(output_path, self._TRACE_FILE)
+        with open(trace_path, "w") as trace_file:
+            json.dump(
+                {"traceEvents": self._trace_events(), "displayTimeUnit": "ms"},
+                trace_file,
+            )
+
+        logger.info(
+            f"Tarkibi _Profiler: Wrote profile to {summary_path} and trace to {trace_path}"
+        )
@@ -0,0 +1,85 @@
+import os
+import threading
+from tarkibi.utilities._config import logger
+
+logger = logger.getChild(__name__)
+
+
+class _ScratchBudget:
+    # downloads wait once the working files use this much of the budget
+    _HIGH_WATER = 0.9
+    _POLL_SECONDS = 1.0
+
+    def __init__(self, max_bytes: int, directories: list[str]) -> None:
+        """
+        Throttles downloads while the intermediate files of a build take up too much disk space
+        parameters
+        ----------
+        max_bytes: int
+            The disk space the intermediate files may use
+        directories: list[str]
+            The directories holding the intermediate files
+        """
+        self.max_bytes = max_bytes
+        self.directories = directories
+        self._condition = threading.Condition()
+        self._in_flight: set[str] = set()
+
+    def usage(self) -> int:
+        """
+        The disk space used by the intermediate files
+
+        returns
+        -------
+        int
+            The size of every file in the directories, in bytes
+        """
+        total = 0
+        for directory in self.directories:
+            for root, _, files in os.walk(directory):
+                for filename in files:
+                    try:
+                        total += os.path.getsize(os.path.join(root, filename))
+                    except FileNotFoundError:
+                        # removed by another stage while walking
+                        continue
+
+        return total
+
+    def acquire(self, video_id: str) -> None:
+        """
+        Wait until there is room for another video, then count it as in flight. A video is let through
+        when nothing else is in flight, the files of the videos in flight are the only ones that get freed
+        parameters
+        ----------
+        video_id: str
+            The id of the video about to be downloaded
+        """
+        with self._condition:
+            waited = False
+            while self._in_flight and self.usage() >= self._HIGH_WATER * self.max_bytes:
+                if not waited:
+                    logger.info(
+                        f"Tarkibi _ScratchBudget: Holding back {video_id}, working files are near {self.max_bytes} bytes"
+                    )
+                    waited = True
+                self._condition.wait(self._POLL_SECONDS)
+
+            self._in_flight.add(video_id)
+
+    def release(self, video_id: str) -> None:
+        """
+        Mark a video as done with its intermediate files, safe to call more than once
+        parameters
+        ----------
+        video_id: str
+            The id of the video
+        """
+        with self._condition:
+            self._in_flight.discard(video_id)
+            self._condition.notify_all()
+
+    def reset(self) -> None:
+        with self._condition:
+            self._in_flight.clear()
+            self._condition.notify_all()
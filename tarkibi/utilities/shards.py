@@ -0,0 +1,347 @@
+import json
+import os
+import threading
+import numpy as np
+from . import wav
+from tarkibi.utilities._config import logger
+
+logger = logger.getChild(__name__)
+
+_INDEX_FILE = "index.jsonl"
+_PARQUET_FILE = "metadata.parquet"
+_COLUMNS_FILE = "metadata.json"
+_SHARD_BYTES = 1 << 30
+_COLUMNS = ("clip", "shard", "offset", "frames", "channels", "sample_rate", "text")
+
+
+class _ShardedDataset:
+    def __init__(self, path: str, shard_bytes: int = _SHARD_BYTES) -> None:
+        """
+        Clips packed one after the other into shards of raw little-endian int16 PCM, so a dataset is a
+        handful of large files that can be memory-mapped rather than a file per clip. Every clip is
+        appended to index.jsonl as it is written, the metadata of the finished dataset goes to a
+        columnar file, metadata.parquet when pyarrow is installed and metadata.json otherwise
+        parameters
+        ----------
+        path: str
+            The directory to keep the shards in
+        shard_bytes: int
+            The size a shard is closed at, clips are never split across shards
+        """
+        self.path = path
+        self.shard_bytes = shard_bytes
+        self._index_path = os.path.join(path, _INDEX_FILE)
+        self._lock = threading.Lock()
+        # clip id -> {"shard", "offset", "frames", "channels", "sample_rate"}
+        self._clips: dict[str, dict] = {}
+        self._shard = 0
+
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _shard_path(self, shard: int) -> str:
+        return os.path.join(self.path, f"shard_{shard:05d}.pcm")
+
+    def _load(self) -> None:
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as index_file:
+                for line in index_file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+
+                    self._clips[entry.pop("clip")] = entry
+        else:
+            # a dataset converted or finished without its index
+            for entry in _read_metadata(self.path):
+                entry.pop("text")
+                self._clips[entry.pop("clip")] = entry
+
+            if self._clips:
+                self._rewrite_index()
+
+        shards = [entry["shard"] for entry in self._clips.values()]
+        self._shard = max(shards) if shards else 0
+
+    def _rewrite_index(self) -> None:
+        temp_path = f"{self._index_path}.tmp"
+        with open(temp_path, "w") as index_file:
+            for clip_id, entry in self._clips.items():
+                index_file.write(json.dumps({"clip": clip_id, **entry}) + "\n")
+
+        os.replace(temp_path, self._index_path)
+
+    def __len__(self) -> int:
+        return len(self._clips)
+
+    def add(self, clip_id: str, samples: np.ndarray, sample_rate: int) -> None:
+        """
+        Append a clip to the open shard, a clip that is already in the dataset is replaced
+        parameters
+        ----------
+        clip_id: str
+            The id of the clip
+        samples: np.ndarray
+            The int16 samples, with shape (frames,) or (frames, channels)
+        sample_rate: int
+            The sample rate of the samples
+        """
+        channels = 1 if samples.ndim == 1 else samples.shape[1]
+        data = np.ascontiguousarray(samples, dtype="<i2").tobytes()
+
+        with self._lock:
+            shard_path = self._shard_path(self._shard)
+            offset = os.path.getsize(shard_path) if os.path.exists(shard_path) else 0
+            if offset and offset + len(data) > self.shard_bytes:
+                self._shard += 1
+                shard_path = self._shard_path(self._shard)
+                offset = 0
+
+            with open(shard_path, "ab") as shard_file:
+                shard_file.write(data)
+
+            entry = {
+                "shard": self._shard,
+                "offset": offset,
+                "frames": len(samples),
+                "channels": channels,
+                "sample_rate": sample_rate,
+            }
+            with open(self._index_path, "a") as index_file:
+                index_file.write(json.dumps({"clip": clip_id, **entry}) + "\n")
+
+            self._clips[clip_id] = entry
+
+    def add_file(self, audio_file: str) -> None:
+        """
+        Append a 16-bit PCM wav file, its name without the extension is the clip id
+        parameters
+        ----------
+        audio_file: str
+            The path to the wav file
+        """
+        samples, sample_rate = wav.read_wav(audio_file)
+        self.add(os.path.basename(audio_file).split(".")[0], samples, sample_rate)
+
+    def read(self, clip_id: str) -> tuple[np.ndarray, int]:
+        """
+        Memory-map the samples of a clip
+        parameters
+        ----------
+        clip_id: str
+            The id of the clip
+
+        returns
+        -------
+        tuple[np.ndarray, int]
+            The int16 samples with shape (frames, channels), and the sample rate
+        """
+        entry = self._clips[clip_id]
+        if entry["frames"] == 0:
+            return (
+                np.zeros((0, entry["channels"]), dtype=np.int16),
+                entry["sample_rate"],
+            )
+
+        samples = np.memmap(
+            self._shard_path(entry["shard"]),
+            dtype="<i2",
+            mode="r",
+            offset=entry["offset"],
+            shape=(entry["frames"], entry["channels"]),
+        )
+
+        return samples, entry["sample_rate"]
+
+    def durations(self) -> dict[str, float]:
+        """
+        The duration in seconds of every clip, keyed by clip id
+        """
+        with self._lock:
+            return {
+                clip_id: entry["frames"] / entry["sample_rate"]
+                for clip_id, entry in self._clips.items()
+            }
+
+    def retain(self, clip_ids: set[str]) -> None:
+        """
+        Drop the clips that are not in clip_ids from the index, their samples stay in the shards
+        parameters
+        ----------
+        clip_ids: set[str]
+            The ids of the clips to keep
+        """
+        with self._lock:
+            dropped = [clip_id for clip_id in self._clips if clip_id not in clip_ids]
+            if not dropped:
+                return
+
+            for clip_id in dropped:
+                del self._clips[clip_id]
+
+            logger.info(
+                f"Tarkibi _ShardedDataset: Dropped {len(dropped)} clips of an unfinished split"
+            )
+            self._rewrite_index()
+
+    def write_metadata(self, transcriptions: dict[str, str] | None = None) -> str:
+        """
+        Write the metadata of every clip, ordered by clip id, to a columnar file
+        parameters
+        ----------
+        transcriptions: dict[str, str] | None
+            The text of every clip, keyed by clip id
+
+        returns
+        -------
+        str
+            The path to the metadata file
+        """
+        transcriptions = transcriptions or {}
+        with self._lock:
+            clip_ids = sorted(self._clips)
+            columns = {column: [] for column in _COLUMNS}
+            for clip_id in clip_ids:
+                entry = {
+                    "clip": clip_id,
+                    **self._clips[clip_id],
+                    "text": transcriptions.get(clip_id),
+                }
+                for column in _COLUMNS:
+                    columns[column].append(entry[column])
+
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            metadata_path = os.path.join(self.path, _COLUMNS_FILE)
+            with open(metadata_path, "w") as metadata_file:
+                json.dump(columns, metadata_file)
+        else:
+            metadata_path = os.path.join(self.path, _PARQUET_FILE)
+            pyarrow.parquet.write_table(pyarrow.table(columns), metadata_path)
+
+        logger.info(
+            f"Tarkibi _ShardedDataset: Wrote metadata of {len(clip_ids)} clips to {metadata_path}"
+        )
+        return metadata_path
+
+
+def _read_metadata(path: str) -> list[dict]:
+    """
+    Read the columnar metadata of a sharded dataset
+    parameters
+    ----------
+    path: str
+        The path to the sharded dataset
+
+    returns
+    -------
+    list[dict]
+        One dict per clip, with a key per column, empty if there is no metadata file
+    """
+    parquet_path = os.path.join(path, _PARQUET_FILE)
+    columns_path = os.path.join(path, _COLUMNS_FILE)
+    if os.path.exists(parquet_path):
+        import pyarrow.parquet
+
+        columns = pyarrow.parquet.read_table(parquet_path).to_pydict()
+    elif os.path.exists(columns_path):
+        with open(columns_path) as metadata_file:
+            columns = json.load(metadata_file)
+    else:
+        return []
+
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+
+def read_transcriptions(path: str) -> dict[str, str]:
+    """
+    Read the text of every transcribed clip of a sharded dataset
+    parameters
+    ----------
+    path: str
+        The path to the sharded dataset
+
+    returns
+    -------
+    dict[str, str]
+        The text of every clip, keyed by clip id
+    """
+    return {
+        entry["clip"]: entry["text"]
+        for entry in _read_metadata(path)
+        if entry["text"] is not None
+    }
+
+
+def shards_to_ljspeech(shard_path: str, output_path: str) -> None:
+    """
+    Export a sharded dataset to the LJSpeech layout, a wav per clip in wavs and, when the clips
+    are transcribed, metadata.txt
+    parameters
+    ----------
+    shard_path: str
+        The path to the sharded dataset
+    output_path: str
+        The path to write the LJSpeech dataset to
+    """
+    dataset = _ShardedDataset(shard_path)
+    transcriptions = read_transcriptions(shard_path)
+    wav_output_dir = os.path.join(output_path, "wavs")
+    os.makedirs(wav_output_dir, exist_ok=True)
+
+    clip_ids = sorted(dataset.durations())
+    for clip_id in clip_ids:
+        samples, sample_rate = dataset.read(clip_id)
+        wav.write_wav(
+            os.path.join(wav_output_dir, f"{clip_id}.wav"), samples, sample_rate
+        )
+
+    if transcriptions:
+        with open(os.path.join(output_path, "metadata.txt"), "w") as metadata_file:
+            for clip_id in clip_ids:
+                if clip_id in transcriptions:
+                    metadata_file.write(f"{clip_id}|{transcriptions[clip_id]}\n")
+
+    logger.info(
+        f"Tarkibi shards_to_ljspeech: Exported {len(clip_ids)} clips to {output_path}"
+    )
+
+
+def ljspeech_to_shards(
+    dataset_path: str, shard_path: str, shard_bytes: int = _SHARD_BYTES
+) -> None:
+    """
+    Pack an LJSpeech dataset into shards, the wavs must be 16-bit PCM
+    parameters
+    ----------
+    dataset_path: str
+        The path to the LJSpeech dataset, with wavs and optionally metadata.txt
+    shard_path: str
+        The path to write the sharded dataset to, must not hold a sharded dataset yet
+    shard_bytes: int
+        The size a shard is closed at
+    """
+    if os.path.exists(os.path.join(shard_path, _INDEX_FILE)):
+        raise ValueError(f"A sharded dataset already exists in {shard_path}")
+
+    dataset = _ShardedDataset(shard_path, shard_bytes)
+    wav_output_dir = os.path.join(dataset_path, "wavs")
+    for filename in sorted(os.listdir(wav_output_dir)):
+        if filename.endswith(".wav"):
+            dataset.add_file(os.path.join(wav_output_dir, filename))
+
+    transcriptions = {}
+    metadata_path = os.path.join(dataset_path, "metadata.txt")
+    if os.path.exists(metadata_path):
+        with open(metadata_path) as metadata_file:
+            for line in metadata_file:
+                clip_id, _, text = line.rstrip("\n").partition("|")
+                transcriptions[clip_id] = text
+
+    dataset.write_metadata(transcriptions)
+    logger.info(
+        f"Tarkibi ljspeech_to_shards: Packed {len(dataset)} clips into {shard_path}"
+    )
@@ -0,0 +1,224 @@
+import math
+import os
+import struct
+import wave
+import numpy as np
+from scipy.signal import resample_poly
+
+_SAMPLE_WIDTH = 2
+_INT16_MIN = np.iinfo(np.int16).min
+_INT16_MAX = np.iinfo(np.int16).max
+
+
+def is_pcm16_wav(path: str) -> bool:
+    """
+    Check if a file is a 16-bit PCM wav that can be read without ffmpeg
+    parameters
+    ----------
+    path: str
+        The path to the file
+
+    returns
+    -------
+    bool
+        True if the file is a 16-bit PCM wav, False otherwise
+    """
+    try:
+        with wave.open(path, "rb") as wav_file:
+            return wav_file.getsampwidth() == _SAMPLE_WIDTH
+    except (wave.Error, EOFError, OSError):
+        return False
+
+
+def _data_chunk(path: str) -> tuple[int, int]:
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as wav_file:
+        header = wav_file.read(12)
+        if header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            raise ValueError(f"Not a wav file: {path}")
+
+        while True:
+            chunk_header = wav_file.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError(f"No data chunk in wav file: {path}")
+
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+            if chunk_id == b"data":
+                offset = wav_file.tell()
+                # streamed writers leave the size at 0 or 0xFFFFFFFF
+                return offset, min(chunk_size or file_size, file_size - offset)
+
+            wav_file.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+
+def read_wav(path: str) -> tuple[np.ndarray, int]:
+    """
+    Memory-map the samples of a 16-bit PCM wav file
+    parameters
+    ----------
+    path: str
+        The path to the wav file
+
+    returns
+    -------
+    tuple[np.ndarray, int]
+        The int16 samples with shape (frames, channels), and the sample rate
+    """
+    with wave.open(path, "rb") as wav_file:
+        channels = wav_file.getnchannels()
+        sample_width = wav_file.getsampwidth()
+        sample_rate = wav_file.getframerate()
+
+    if sample_width != _SAMPLE_WIDTH:
+        raise ValueError(f"Expected 16-bit PCM, got {sample_width * 8}-bit: {path}")
+
+    offset, size = _data_chunk(path)
+    frames = size // (channels * _SAMPLE_WIDTH)
+    if frames == 0:
+        return np.zeros((0, channels), dtype=np.int16), sample_rate
+
+    samples = np.memmap(
+        path, dtype="<i2", mode="r", offset=offset, shape=(frames, channels)
+    )
+
+    return samples, sample_rate
+
+
+def write_wav(path: str, samples: np.ndarray, sample_rate: int) -> None:
+    """
+    Write int16 samples to a 16-bit PCM wav file
+    parameters
+    ----------
+    path: str
+        The path to write to
+    samples: np.ndarray
+        The samples, with shape (frames,) or (frames, channels)
+    sample_rate: int
+        The sample rate of the samples
+    """
+    channels = 1 if samples.ndim == 1 else samples.shape[1]
+
+    with open_writer(path, channels, sample_rate) as wav_file:
+        append_frames(wav_file, samples)
+
+
+def open_writer(path: str, channels: int, sample_rate: int) -> wave.Wave_write:
+    """
+    Open a 16-bit PCM wav file to write samples to in several parts
+    parameters
+    ----------
+    path: str
+        The path to write to
+    channels: int
+        The number of channels
+    sample_rate: int
+        The sample rate
+
+    returns
+    -------
+    wave.Wave_write
+        The open wav file, to be used as a context manager
+    """
+    wav_file = wave.open(path, "wb")
+    wav_file.setnchannels(channels)
+    wav_file.setsampwidth(_SAMPLE_WIDTH)
+    wav_file.setframerate(sample_rate)
+
+    return wav_file
+
+
+def append_frames(wav_file: wave.Wave_write, samples: np.ndarray) -> None:
+    wav_file.writeframes(np.ascontiguousarray(samples, dtype="<i2").tobytes())
+
+
+def write_spans(
+    path: str,
+    samples: np.ndarray,
+    sample_rate: int,
+    spans: list[tuple[float, float]],
+) -> None:
+    """
+    Write spans of samples one after the other, only one span is held in memory at a time
+    parameters
+    ----------
+    path: str
+        The path to write to
+    samples: np.ndarray
+        The samples, with shape (frames, channels), usually memory-mapped
+    sample_rate: int
+        The sample rate of the samples
+    spans: list[tuple[float, float]]
+        The (start, end) of every span in seconds
+    """
+    with open_writer(path, samples.shape[1], sample_rate) as wav_file:
+        for start, end in spans:
+            append_frames(
+                wav_file, samples[int(start * sample_rate) : int(end * sample_rate)]
+            )
+
+
+def resample(samples: np.ndarray, sample_rate: int, target_rate: int) -> np.ndarray:
+    """
+    Resample int16 samples with a polyphase filter
+    parameters
+    ----------
+    samples: np.ndarray
+        The samples, with shape (frames,) or (frames, channels)
+    sample_rate: int
+        The sample rate of the samples
+    target_rate: int
+        The sample rate to resample to
+
+    returns
+    -------
+    np.ndarray
+        The resampled int16 samples
+    """
+    if sample_rate == target_rate:
+        return np.asarray(samples, dtype=np.int16)
+
+    divisor = math.gcd(sample_rate, target_rate)
+    resampled = resample_poly(
+        np.asarray(samples, dtype=np.float32),
+        target_rate // divisor,
+        sample_rate // divisor,
+        axis=0,
+    )
+
+    return np.clip(np.rint(resampled), _INT16_MIN, _INT16_MAX).astype(np.int16)
+
+
+def cut_clip(
+    audio_file: str,
+    start_time: float,
+    duration: float,
+    outputs: list[tuple[str, int]],
+) -> float:
+    """
+    Cut a clip from a 16-bit PCM wav file and write it at one or more sample rates,
+    every output is resampled from the source rather than from another output
+    parameters
+    ----------
+    audio_file: str
+        The path to the wav file to cut from
+    start_time: float
+        The start of the clip in seconds
+    duration: float
+        The duration of the clip in seconds
+    outputs: list[tuple[str, int]]
+        The path and sample rate of every file to write
+
+    returns
+    -------
+    float
+        The duration of the clip that was written, in seconds
+    """
+    samples, sample_rate = read_wav(audio_file)
+    start = int(start_time * sample_rate)
+    end = min(start + int(duration * sample_rate), len(samples))
+    clip = samples[start:end]
+
+    for output_file, target_rate in outputs:
+        write_wav(output_file, resample(clip, sample_rate, target_rate), target_rate)
+
+    return (end - start) / sample_rate
@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+from . import general
+from tarkibi.utilities._config import logger
+
+logger = logger.getChild(__name__)
+
+
+class _YieldStats:
+    _STATS_FILE = "yield_stats.json"
+    # a video where verification found nothing must not make the next round unbounded
+    _MIN_YIELD = 0.05
+
+    def __init__(self, base_dir: str = general.BASE_DIR) -> None:
+        """
+        Verified speaker seconds per downloaded second, recorded per video and kept across builds
+        parameters
+        ----------
+        base_dir: str
+            The directory to keep the stats in, survives _deep_clean as it is not a directory
+        """
+        self.path = os.path.join(base_dir, self._STATS_FILE)
+        self._lock = threading.Lock()
+        # author -> video id -> {"query", "downloaded", "verified"}
+        self._videos: dict[str, dict[str, dict]] = {}
+        # author -> [downloaded seconds, verified seconds] of the videos recorded by this run
+        self._run: dict[str, list[float]] = {}
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path) as stats_file:
+                self._videos = json.load(stats_file)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Tarkibi _YieldStats: Ignoring unreadable {self.path}: {e}")
+            self._videos = {}
+
+    def _save(self) -> None:
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as stats_file:
+            json.dump(self._videos, stats_file)
+
+        os.replace(temp_path, self.path)
+
+    def record(
+        self,
+        author: str,
+        query: str | None,
+        video_id: str,
+        downloaded_seconds: float,
+        verified_seconds: float,
+    ) -> None:
+        """
+        Record the yield of a processed video
+        parameters
+        ----------
+        author: str
+            The person the video was downloaded for
+        query: str | None
+            The search query that found the video
+        video_id: str
+            The id of the video
+        downloaded_seconds: float
+            The length of the downloaded audio
+        verified_seconds: float
+            The length of the audio verified as the person
+        """
+        with self._lock:
+            self._videos.setdefault(author, {})[video_id] = {
+                "query": query,
+                "downloaded": downloaded_seconds,
+                "verified": verified_seconds,
+            }
+            run = self._run.setdefault(author, [0.0, 0.0])
+            run[0] += downloaded_seconds
+            run[1] += verified_seconds
+            self._save()
+
+    def _pooled(self, videos: list[dict]) -> float | None:
+        downloaded = sum(video["downloaded"] for video in videos)
+        if downloaded <= 0:
+            return None
+
+        verified = sum(video["verified"] for video in videos)
+        return max(verified / downloaded, self._MIN_YIELD)
+
+    def run_yield(self, author: str) -> float | None:
+        """
+        The yield of the videos processed for a person by this run
+        parameters
+        ----------
+        author: str
+            The person
+
+        returns
+        -------
+        float | None
+            The yield, None if no video was processed yet
+        """
+        with self._lock:
+            downloaded, verified = self._run.get(author, (0.0, 0.0))
+
+        return self._pooled([{"downloaded": downloaded, "verified": verified}])
+
+    def estimate(self, author: str, query: str | None = None) -> float | None:
+        """
+        Estimate the yield of the next videos for a person, from the videos found by the same query
+        if there are any, otherwise from every video of the person, including those of earlier builds
+        parameters
+        ----------
+        author: str
+            The person
+        query: str | None
+            The search query the next videos come from
+
+        returns
+        -------
+        float | None
+            The estimated yield, None if nothing was recorded for the person
+        """
+        with self._lock:
+            videos = list(self._videos.get(author, {}).values())
+
+        same_query = [video for video in videos if video["query"] == query]
+        return self._pooled(same_query) or self._pooled(videos)